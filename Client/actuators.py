@@ -0,0 +1,79 @@
+# Hardware the client drives. The runtime in steering_client.py only
+# uses set_steering, set_throttle and close, so FakeActuators can stand
+# in for the real board when benchmarking without a car.
+import threading
+import time
+
+# Servo angle for driving straight (degrees)
+STRAIGHT_ANGLE = 90
+# Motor PWM value at which the ESC neither drives nor brakes, see
+# calibration.py
+NEUTRAL_THROTTLE = 0.075
+
+
+class ServoKitActuators:
+    """
+    Steering servo on the PCA9685 board (I2C, through ServoKit) and
+    optionally the motor ESC on a GPIO pin.
+
+    Parameters:
+        steering_channel (int): PCA9685 channel of the steering servo.
+        motor_pin (int, optional): GPIO pin of the ESC, None to leave
+            the motor alone.
+    """
+
+    def __init__(self, steering_channel=0, motor_pin=None):
+        # Only available on the Raspberry Pi
+        from adafruit_servokit import ServoKit
+        from gpiozero import PWMOutputDevice
+
+        self._servo = ServoKit(channels=8).servo[steering_channel]
+        self._motor = None
+        if motor_pin is not None:
+            self._motor = PWMOutputDevice(motor_pin, frequency=50)
+
+    def set_steering(self, angle):
+        self._servo.angle = angle
+
+    def set_throttle(self, value):
+        if self._motor is not None:
+            self._motor.value = value
+
+    def close(self):
+        if self._motor is not None:
+            self._motor.value = NEUTRAL_THROTTLE
+            self._motor.close()
+
+
+class FakeActuators:
+    """
+    Records every write instead of driving hardware.
+
+    Parameters:
+        write_delay (float): Time one write takes (seconds), to stand in
+            for the I2C transfer.
+    """
+
+    def __init__(self, write_delay=0.0):
+        self.write_delay = write_delay
+        self.steering = None
+        self.throttle = None
+        # (time.monotonic(), "steering" or "throttle", value)
+        self.writes = []
+        self._lock = threading.Lock()
+
+    def _write(self, name, value):
+        if self.write_delay:
+            time.sleep(self.write_delay)
+        with self._lock:
+            setattr(self, name, value)
+            self.writes.append((time.monotonic(), name, value))
+
+    def set_steering(self, angle):
+        self._write("steering", angle)
+
+    def set_throttle(self, value):
+        self._write("throttle", value)
+
+    def close(self):
+        pass
@@ -0,0 +1,131 @@
+"""
+Runs the client runtime of steering_client.py over loopback against
+fake actuators, no car needed. A fake server sends binary commands
+faster than the actuator loop runs, with some of them with a throttle,
+then goes silent. The report shows how many hardware writes the
+actuator loop made compared to writing every command like the old
+clients, the largest step between two writes, and how long it took the
+fail safe to stop the car. A second run sends the manual steering.py
+words, split and merged across packets, through the text reader.
+
+Usage:
+    python bench_client.py [--seconds 2] [--rate 200] [--write-delay 0.001]
+"""
+import argparse
+import random
+import socket
+import threading
+import time
+
+from actuators import NEUTRAL_THROTTLE, FakeActuators
+from steering_client import (COMMAND_TIMEOUT, MANUAL_COMMANDS, ActuatorLoop,
+                             LatestTarget, receive_tcp, receive_text)
+from steering_protocol import pack_command
+
+
+def connect():
+    """
+    Returns a connected (server side, vehicle side) TCP socket pair.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    vehicle = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    vehicle.connect(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    server.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return server, vehicle
+
+def start_runtime(vehicle, receive, write_delay):
+    actuators = FakeActuators(write_delay)
+    target = LatestTarget()
+    loop = ActuatorLoop(actuators, target)
+    threading.Thread(target=receive, args=(vehicle, target),
+                     daemon=True).start()
+    loop.start()
+    return actuators, target, loop
+
+def largest_step(writes, name):
+    values = [value for _, kind, value in writes if kind == name]
+    return max((abs(b - a) for a, b in zip(values, values[1:])), default=0)
+
+def run_binary(seconds, rate, write_delay):
+    server, vehicle = connect()
+    actuators, target, loop = start_runtime(vehicle, receive_tcp, write_delay)
+
+    # Jittery commands, often several per actuator tick
+    rng = random.Random(0)
+    angle = 90
+    sent = 0
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        angle = max(48, min(132, angle + rng.randint(-15, 15)))
+        throttle = 0.085 if sent % 10 == 0 else float("nan")
+        server.sendall(pack_command(1, sent + 1, time.time(), angle, throttle))
+        sent += 1
+        time.sleep(rng.expovariate(rate))
+    last_command = time.monotonic()
+
+    # Go silent and wait for the fail safe
+    time.sleep(COMMAND_TIMEOUT + 0.5)
+    stop_write = next((t for t, name, value in actuators.writes
+                       if name == "throttle" and value == NEUTRAL_THROTTLE
+                       and t > last_command), None)
+    loop.stop()
+    server.close()
+    vehicle.close()
+
+    writes = [w for w in actuators.writes if w[0] <= last_command]
+    print(f"Binary commands: {sent} sent in {seconds:.0f} s, "
+          f"{target.commands} received")
+    print(f"  old clients: {target.commands} servo writes, "
+          f"{target.commands * write_delay * 1000:.0f} ms spent writing")
+    print(f"  actuator loop: {len(writes)} writes "
+          f"({loop.stats['unchanged']} unchanged values skipped), "
+          f"{len(writes) * write_delay * 1000:.0f} ms spent writing, "
+          f"{loop.stats['late']} late ticks")
+    print(f"  largest step: steering {largest_step(writes, 'steering')} "
+          f"degrees, throttle {largest_step(writes, 'throttle'):.4f}")
+    if stop_write is None:
+        print("  fail safe: motor was not stopped")
+    else:
+        print(f"  fail safe: motor stopped {(stop_write - last_command) * 1000:.0f} ms "
+              f"after the last command (timeout {COMMAND_TIMEOUT * 1000:.0f} ms)")
+
+def run_text(count):
+    server, vehicle = connect()
+    actuators, target, loop = start_runtime(vehicle, receive_text, 0.0)
+
+    # steering.py sends words without separators, so they arrive merged
+    # and split at random points
+    rng = random.Random(1)
+    words = [rng.choice(list(MANUAL_COMMANDS)) for _ in range(count)]
+    stream = "".join(words).encode()
+    position = 0
+    while position < len(stream):
+        size = rng.randint(1, 40)
+        server.sendall(stream[position:position + size])
+        position += size
+        time.sleep(0.001)
+    time.sleep(0.1)
+    loop.stop()
+    server.close()
+    vehicle.close()
+    print(f"Manual text commands: {count} words sent, {target.commands} parsed")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--rate", type=float, default=200.0,
+                        help="Average commands per second")
+    parser.add_argument("--write-delay", type=float, default=0.001,
+                        help="Time of one hardware write (seconds)")
+    args = parser.parse_args()
+
+    run_binary(args.seconds, args.rate, args.write_delay)
+    run_text(500)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,8 @@
-import socket
-from adafruit_servokit import ServoKit
-from gpiozero import PWMOutputDevice
-
-USER = 1
-# Use IP from central PC
-SERVER_IP = "192.168.0.219"
-SERVER_PORT = 5000
-STEERING_CHANNEL = 0
-
-kit = ServoKit(channels=8)
-
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.connect((SERVER_IP, SERVER_PORT))
-s.sendall(str(USER).encode())
-
-# Code for a small torque on the motor
-# pin = 26
-# motor = PWMOutputDevice(pin, frequency=50)
-# motor.value = 0.085
-
-# Wrap socket as file-like object for clean line reading
-sock_file = s.makefile("r")
-
-try:
-    for line in sock_file:
-        data = line.strip()
-        try:
-            angle = int(data)
-            if 48 <= angle <= 132:
-                kit.servo[STEERING_CHANNEL].angle = angle
-                print(f"Steering angle set to {angle}")
-            else:
-                print(f"Ignored out-of-range angle: {angle}")
-        except ValueError:
-            print(f"Invalid angle received: {data}")
-
-except Exception as e:
-    print("Client error:", e)
-
-finally:
-    s.close()
-
-
-
+# Manual steering client for the steering.py server. It runs the same
+# runtime as steering_client.py, reading the text commands steering.py
+# sends ("left", "forward", ...) instead of binary ones, and drives the
+# motor on MANUAL_MOTOR_PIN.
+from steering_client import MANUAL_MOTOR_PIN, main
+
+if __name__ == "__main__":
+    main(protocol="text", motor_pin=MANUAL_MOTOR_PIN)
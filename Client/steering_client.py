@@ -1,94 +1,456 @@
-from threading import Timer
-from adafruit_servokit import ServoKit
-import time
-from gpiozero import PWMOutputDevice
 import socket
+import threading
+import time
+
+from actuators import NEUTRAL_THROTTLE, STRAIGHT_ANGLE, ServoKitActuators
+from steering_protocol import (COMMAND, HEARTBEAT, HELLO, MESSAGE_SIZE,
+                               MessageReader, SequenceFilter, has_throttle,
+                               pack_ack, pack_message, unpack_message)
 
 USER = 1
-pin=26
-motor= PWMOutputDevice(pin,frequency=50)
+# Use IP from central PC
+SERVER_IP = "192.168.0.219"
+SERVER_PORT = 5000
+STEERING_CHANNEL = 0
+# GPIO pin of the motor ESC, None to leave the motor alone
+MOTOR_PIN = None
+# The manual client (client.py) always drives the motor
+MANUAL_MOTOR_PIN = 26
+# Must match PROTOCOL and TRANSPORT in aruco_edge_detector.py:
+# "binary" or "text", and for binary commands "tcp" or "udp".
+# The manual steering.py server uses "text".
+PROTOCOL = "binary"
+TRANSPORT = "tcp"
+# How often to resend the UDP hello while no commands arrive (seconds)
+HELLO_INTERVAL = 1.0
+# How often to send a heartbeat over TCP (seconds), well within the
+# server's HEARTBEAT_TIMEOUT
+HEARTBEAT_INTERVAL = 1.0
+# How often the servo and motor are updated (per second)
+ACTUATOR_RATE = 50
+# Fastest change of the servo angle (degrees per second) and of the
+# motor PWM value (per second)
+STEERING_SLEW = 600
+THROTTLE_SLEW = 0.1
+# Steer straight and stop the motor if no command arrived for this
+# long (seconds)
+COMMAND_TIMEOUT = 1.0
+# Servo angles the car can steer to
+MIN_ANGLE = 48
+MAX_ANGLE = 132
+
+# Manual steering: each "left" or "right" turns TURN_STEP degrees
+# further, each "forward" or "backward" changes the motor PWM value by
+# THROTTLE_STEP, within these limits
+TURN_STEP = 5
+MANUAL_MIN_ANGLE = 50
+MANUAL_MAX_ANGLE = 130
+THROTTLE_STEP = 0.005
+MIN_THROTTLE = 0.05
+MAX_THROTTLE = 0.1
+
+# Commands sent by the manual steering server: (angle, throttle,
+# relative). None leaves the value as it is, relative commands add to
+# the current target. "hold" changes nothing, the server sends it
+# while no key is held so that the fail safe does not stop the car.
+MANUAL_COMMANDS = {
+    "full_left": (MANUAL_MIN_ANGLE, None, False),
+    "left": (-TURN_STEP, None, True),
+    "straight": (STRAIGHT_ANGLE, None, False),
+    "right": (TURN_STEP, None, True),
+    "full_right": (MANUAL_MAX_ANGLE, None, False),
+    "forward": (None, THROTTLE_STEP, True),
+    "backward": (None, -THROTTLE_STEP, True),
+    "stop": (None, NEUTRAL_THROTTLE, False),
+    "hold": (None, None, False),
+}
+
+
+# ==== Targets ====
+class LatestTarget:
+    """
+    The newest steering and throttle target. The network reader
+    overwrites it as commands arrive, and the actuator loop reads it at
+    its own rate, so commands that arrive faster than the servo is
+    updated simply replace each other.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.angle = None
+        self.throttle = None
+        self.received = None  # time.monotonic() of the last command
+        self.commands = 0
+        self._ack = None  # Sequence number to acknowledge once applied
+
+    def set(self, angle=None, throttle=None, sequence=None):
+        """
+        Stores a command. None leaves the angle or throttle as it is.
+        """
+        with self._lock:
+            if angle is not None:
+                self.angle = angle
+            if throttle is not None:
+                self.throttle = throttle
+            self.received = time.monotonic()
+            self.commands += 1
+            self._ack = sequence
+
+    def change(self, angle_step=None, throttle_step=None):
+        """
+        Stores a manual command that steps the angle or throttle from
+        the current target, or from straight and neutral if there is
+        none, within the manual limits.
+        """
+        with self._lock:
+            if angle_step is not None:
+                angle = STRAIGHT_ANGLE if self.angle is None else self.angle
+                self.angle = max(MANUAL_MIN_ANGLE,
+                                 min(MANUAL_MAX_ANGLE, angle + angle_step))
+            if throttle_step is not None:
+                throttle = (NEUTRAL_THROTTLE if self.throttle is None
+                            else self.throttle)
+                self.throttle = round(max(MIN_THROTTLE, min(
+                    MAX_THROTTLE, throttle + throttle_step)), 4)
+            self.received = time.monotonic()
+            self.commands += 1
+            self._ack = None
+
+    def clear(self, received):
+        """
+        Forgets the targets if no command arrived since received, so
+        the car does not drive off with an old throttle when commands
+        resume after the fail safe.
+        """
+        with self._lock:
+            if self.received == received:
+                self.angle = None
+                self.throttle = None
+
+    def take(self):
+        """
+        Returns (angle, throttle, received, sequence), where sequence is
+        the command to acknowledge, None if it was taken before.
+        """
+        with self._lock:
+            sequence, self._ack = self._ack, None
+            return self.angle, self.throttle, self.received, sequence
+
 
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-#Use the PC (server) IP-adress for connection
-s.connect(("192.168.0.219", 5000))
-s.sendall(str(USER).encode())
+# ==== Actuator Loop ====
+def slew(current, target, max_step):
+    """
+    Moves current towards target by at most max_step.
+    """
+    if current is None:
+        return target
+    return current + max(-max_step, min(max_step, target - current))
+
+
+class ActuatorLoop(threading.Thread):
+    """
+    Updates the servo and motor at a fixed rate from a LatestTarget.
+    Values are changed by at most the slew limits per second, and only
+    written when they changed. If no command arrived for command_timeout
+    seconds the car steers straight and the motor is set to neutral at
+    once.
+
+    Parameters:
+        actuators: Hardware with set_steering(angle), set_throttle(value)
+            and close(), see actuators.py.
+        target (LatestTarget): Where the commands come from.
+        rate (float): Updates per second.
+        steering_slew (float): Degrees per second.
+        throttle_slew (float): PWM value per second.
+        command_timeout (float): Seconds without commands before the
+            fail safe.
+        on_applied (callable, optional): Called as on_applied(sequence,
+            hold_time) after the servo was set for a command with a
+            sequence number, hold_time being the seconds since the
+            command arrived.
+    """
+
+    def __init__(self, actuators, target, rate=ACTUATOR_RATE,
+                 steering_slew=STEERING_SLEW, throttle_slew=THROTTLE_SLEW,
+                 command_timeout=COMMAND_TIMEOUT, on_applied=None):
+        super().__init__(name="actuator-loop", daemon=True)
+        self.actuators = actuators
+        self.target = target
+        self.period = 1.0 / rate
+        self.steering_slew = steering_slew
+        self.throttle_slew = throttle_slew
+        self.command_timeout = command_timeout
+        self.on_applied = on_applied
+
+        self.angle = None
+        self.throttle = None
+        self.failsafe = True
+        self._stopped = threading.Event()
+        self.stats = {"ticks": 0, "writes": 0, "unchanged": 0, "late": 0,
+                      "failsafes": 0}
+
+    def stop(self):
+        """
+        Stops the loop, steers straight and sets the motor to neutral.
+        """
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+        self.actuators.set_steering(STRAIGHT_ANGLE)
+        self.actuators.set_throttle(NEUTRAL_THROTTLE)
+        self.actuators.close()
+
+    def run(self):
+        next_tick = time.monotonic()
+        while not self._stopped.is_set():
+            self.step(time.monotonic())
+            next_tick += self.period
+            wait = next_tick - time.monotonic()
+            if wait < 0:
+                # Too slow, skip the missed ticks instead of catching up
+                self.stats["late"] += 1
+                next_tick = time.monotonic()
+            else:
+                self._stopped.wait(wait)
+
+    def step(self, now):
+        """
+        Runs one update.
+        """
+        angle, throttle, received, sequence = self.target.take()
+        self.stats["ticks"] += 1
+        if received is None or now - received > self.command_timeout:
+            if not self.failsafe:
+                self.failsafe = True
+                self.stats["failsafes"] += 1
+                print("No commands received, steering straight and stopping")
+                self.target.clear(received)
+            angle, throttle = STRAIGHT_ANGLE, NEUTRAL_THROTTLE
+        elif self.failsafe:
+            self.failsafe = False
+
+        if angle is None:
+            angle = STRAIGHT_ANGLE
+        if throttle is None:
+            throttle = NEUTRAL_THROTTLE
+        new_angle = round(slew(self.angle, angle,
+                               self.steering_slew * self.period))
+        # The fail safe stops the motor at once rather than slowing down
+        throttle_step = float("inf") if self.failsafe else \
+            self.throttle_slew * self.period
+        new_throttle = round(slew(self.throttle, throttle, throttle_step), 4)
+
+        if new_angle != self.angle:
+            self.actuators.set_steering(new_angle)
+            self.angle = new_angle
+            self.stats["writes"] += 1
+        else:
+            self.stats["unchanged"] += 1
+        if new_throttle != self.throttle:
+            self.actuators.set_throttle(new_throttle)
+            self.throttle = new_throttle
+            self.stats["writes"] += 1
+        else:
+            self.stats["unchanged"] += 1
 
-kit = ServoKit(channels=8)
+        if sequence is not None and self.on_applied is not None:
+            self.on_applied(sequence, time.monotonic() - received)
 
-servo=14
-motor.value = 0.075
 
-turn_min = 50
-turn_max = 130
-turn_neutral = 90
-turn_change = 5
-turn = turn_neutral
+# ==== Network Readers ====
+def parse_angle(value):
+    """
+    Returns the angle if the car can steer to it, else None.
+    """
+    if MIN_ANGLE <= value <= MAX_ANGLE:
+        return value
+    print(f"Ignored out-of-range angle: {value}")
+    return None
 
-speed_min = 0.05
-speed_max = 0.1
-speed_neutral = 0.075
-speed_change = 0.005
-speed = speed_neutral
 
-try:
+class TextCommandReader:
+    """
+    Splits the text protocol into commands. aruco_edge_detector.py sends
+    one angle per line, steering.py sends the words in MANUAL_COMMANDS
+    without separators, so one recv can hold several commands or a
+    part of one.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        # Longest first, so "full_left" is not read as something shorter
+        self._words = sorted(MANUAL_COMMANDS, key=len, reverse=True)
+
+    def feed(self, data):
+        """
+        Adds received text and returns the complete commands in it as
+        (angle, throttle, relative), see MANUAL_COMMANDS.
+        """
+        self._buffer += data
+        commands = []
+        while True:
+            self._buffer = self._buffer.lstrip()
+            if not self._buffer:
+                break
+            if self._buffer[0] in "-0123456789":
+                line, newline, rest = self._buffer.partition("\n")
+                if not newline:
+                    break  # Wait for the rest of the number
+                self._buffer = rest
+                try:
+                    angle = parse_angle(int(line))
+                except ValueError:
+                    print(f"Invalid angle received: {line.strip()}")
+                    continue
+                if angle is not None:
+                    commands.append((angle, None, False))
+                continue
+            word = next((w for w in self._words if self._buffer.startswith(w)),
+                        None)
+            if word is not None:
+                self._buffer = self._buffer[len(word):]
+                commands.append(MANUAL_COMMANDS[word])
+            elif any(w.startswith(self._buffer) for w in self._words):
+                break  # Wait for the rest of the word
+            else:
+                invalid = self._buffer.split(None, 1)[0]
+                print(f"Invalid command received: {invalid}")
+                self._buffer = self._buffer[len(invalid):]
+        return commands
+
+
+def receive_text(sock, target):
+    reader = TextCommandReader()
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            break
+        for angle, throttle, relative in reader.feed(
+                data.decode(errors="replace")):
+            if relative:
+                target.change(angle, throttle)
+            else:
+                target.set(angle, throttle)
+
+def apply_message(message, sequence_filter, target):
+    if message.kind != COMMAND or not sequence_filter.accept(message):
+        return
+    angle = parse_angle(message.angle)
+    throttle = message.throttle if has_throttle(message) else None
+    if angle is not None or throttle is not None:
+        target.set(angle, throttle, message.sequence)
+
+def receive_tcp(sock, target):
+    reader = MessageReader()
+    sequence_filter = SequenceFilter()
     while True:
-        print("Looping")
-        data=s.recv(1024)
+        data = sock.recv(4096)
         if not data:
             break
-        
-        command = data.decode("utf-8").strip()
-        
-        if command == "forward":
-            print(f"Command = {command}")
-            if speed + speed_change <= speed_max:
-                speed = speed + speed_change
-                motor.value = speed
-             
-        elif command == "backward":
-            print(f"Command = {command}")
-            if speed - speed_change >= speed_min:
-                speed = speed - speed_change
-                motor.value = speed
-        
-        elif command == "left":
-            print(f"Command = {command}")
-            if turn - turn_change >= turn_min:
-                turn = turn - turn_change
-                kit.servo[0].angle = turn
-        
-        elif command == "full_left":
-            print(f"Command = {command}")
-            turn = turn_min
-            kit.servo[0].angle = turn
-            
-        elif command == "right":
-            print(f"Command = {command}")
-            if turn + turn_change <= turn_max:
-                turn = turn + turn_change
-                kit.servo[0].angle = turn
-                
-        elif command == "full_right":
-            print(f"Command = {command}")
-            turn = turn_max
-            kit.servo[0].angle = turn
-            
-        elif command == "straight":
-            print(f"Command = {command}")
-            turn = turn_neutral
-            kit.servo[0].angle = turn
-        
-        elif command == "stop":
-            print(f"Command = {command}")
-            speed = speed_neutral
-            motor.value = speed
-        
+        for message in reader.feed(data):
+            apply_message(message, sequence_filter, target)
+
+def receive_udp(udp, target, user=USER, server=(SERVER_IP, SERVER_PORT)):
+    udp.settimeout(HELLO_INTERVAL)
+    # Tell the server where to send the commands
+    hello = pack_message(HELLO, user)
+    udp.sendto(hello, server)
+    # Datagrams can arrive out of order, old ones are dropped
+    sequence_filter = SequenceFilter()
+    while True:
+        try:
+            data, _ = udp.recvfrom(MESSAGE_SIZE)
+        except socket.timeout:
+            udp.sendto(hello, server)
+            continue
+        try:
+            message = unpack_message(data)
+        except ValueError as e:
+            print(f"Invalid message received: {e}")
+            continue
+        apply_message(message, sequence_filter, target)
+
+def ack_sender(sock, user=USER, server=None, clock=time.time, lock=None):
+    """
+    Returns an on_applied callback for ActuatorLoop that tells the
+    server when the servo was set, for its latency measurement. Over
+    UDP server is the address to send to. lock is held while sending,
+    to share the TCP socket with send_heartbeats.
+    """
+    lock = lock or threading.Lock()
+
+    def on_applied(sequence, hold_time):
+        ack = pack_ack(user, sequence, clock(), hold_time)
+        try:
+            with lock:
+                if server is None:
+                    sock.sendall(ack)
+                else:
+                    sock.sendto(ack, server)
+        except OSError:
+            pass  # The reader notices the closed connection
+    return on_applied
+
+def send_heartbeats(sock, stop, lock, user=USER, interval=HEARTBEAT_INTERVAL):
+    """
+    Sends a heartbeat over TCP every interval seconds until stop is
+    set. Acknowledgements only go out while commands arrive, and the
+    server stops sending commands to a car it does not see, so without
+    heartbeats a car that is out of view for a moment would be dropped.
+    """
+    heartbeat = pack_message(HEARTBEAT, user)
+    while not stop.wait(interval):
+        try:
+            with lock:
+                sock.sendall(heartbeat)
+        except OSError:
+            return  # The reader notices the closed connection
+
+
+# ==== Start of the Program ====
+def main(protocol=PROTOCOL, transport=TRANSPORT, motor_pin=MOTOR_PIN):
+    actuators = ServoKitActuators(STEERING_CHANNEL, motor_pin)
+    target = LatestTarget()
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((SERVER_IP, SERVER_PORT))
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    s.sendall(str(USER).encode())
+
+    udp = None
+    on_applied = None
+    stop_heartbeats = threading.Event()
+    if protocol != "text":
+        if transport == "udp":
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            on_applied = ack_sender(udp, server=(SERVER_IP, SERVER_PORT))
         else:
-            print(f"Unkown command: {command}")
-
-except Exception as e:
-    print(f"Error: {e}")
-    
-finally:
-    s.close()
-    print("Diconnecting from server")
\ No newline at end of file
+            send_lock = threading.Lock()
+            on_applied = ack_sender(s, lock=send_lock)
+            threading.Thread(target=send_heartbeats,
+                             args=(s, stop_heartbeats, send_lock),
+                             daemon=True).start()
+    actuator_loop = ActuatorLoop(actuators, target, on_applied=on_applied)
+    actuator_loop.start()
+
+    try:
+        if protocol == "text":
+            receive_text(s, target)
+        elif udp is not None:
+            receive_udp(udp, target)
+        else:
+            receive_tcp(s, target)
+
+    except Exception as e:
+        print("Client error:", e)
+
+    finally:
+        stop_heartbeats.set()
+        actuator_loop.stop()
+        s.close()
+        if udp is not None:
+            udp.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,29 @@
 import cv2
 import cv2.aruco as aruco
+import math
 import numpy as np
 import socket
 import threading
 import time
+from collections import namedtuple
 
-# ==== Socket Setup ====
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server_socket.bind(("", 5000))  # Bind to all interfaces on port 5000
-server_socket.listen(5)
-print("Server started. Waiting for RC vehicles to connect...")
+from boundary_map import BoundaryMap
+from detector_config import load_detector_settings, make_detector_parameters
+from frame_buffers import FrameBuffers
+from frame_ring import CaptureProcess
+from command_sender import CommandSender, encode_text
+from latency_monitor import LatencyMonitor
+from load_governor import LoadGovernor
+from marker_tracker import MarkerTracker
+from multi_camera import CameraPool, Coordinator, load_cameras
+from pipeline import Pipeline
+from profiler import MetricsServer, StageMetrics
+from stage_timer import NULL_TIMER
+from telemetry import (DROPPED, KEEPALIVE, QUEUED, SENT,
+                       TelemetryRecorder)
+from steering_protocol import (ACK, HELLO, MESSAGE_SIZE, MessageReader,
+                               pack_command, unpack_message)
+from vehicle_registry import VehicleRegistry
 
 # ==== Changeable Parameters ====
 # Minimum angle change required to send a new command
@@ -19,49 +33,294 @@ LOW_THRESHOLD = 40
 HIGH_THRESHOLD = 80
 # Minimum time between messages to a vehicle (seconds)
 SEND_INTERVAL = 0.05
+# Repeat the last angle if it did not change for this long (seconds),
+# a vehicle that hears nothing for COMMAND_TIMEOUT stops. Repeating
+# ends once the vehicle was not perceived for KEEPALIVE_LIMIT
+# (seconds), so a car whose marker is lost is stopped by its timeout.
+KEEPALIVE_INTERVAL = 0.25
+KEEPALIVE_LIMIT = 0.5
+# Command format: "binary" (steering_protocol.py) or "text" (one angle
+# per line), and for binary commands "tcp" or "udp". Must match the
+# settings in steering_client.py.
+PROTOCOL = "binary"
+TRANSPORT = "tcp"
+SERVER_PORT = 5000
+# A vehicle must send its user ID within HANDSHAKE_TIMEOUT (seconds)
+# of connecting. With binary commands, a vehicle that has answered
+# before and then stays silent for HEARTBEAT_TIMEOUT (seconds) is
+# dropped. Its acknowledgements, hellos and the heartbeats it sends
+# every second over TCP (HEARTBEAT_INTERVAL in steering_client.py)
+# show that it is there, even while it is out of view.
+HANDSHAKE_TIMEOUT = 5.0
+HEARTBEAT_TIMEOUT = 3.0
 # Scale for turn intensity
 SCALE = 0.2
 WEIGHT = 0.5
 ANGLE_FAVOR = 0.7
+# JSON file with tuned aruco.DetectorParameters written by
+# tune_detector.py, None for the OpenCV defaults
+DETECTOR_PARAMETERS_FILE = None
+# Only search for markers around where they were last seen, and scan
+# the full frame every FULL_SCAN_INTERVAL frames for new ones
+TRACK_MARKERS = True
+FULL_SCAN_INTERVAL = 10
+# Fraction of the (subsampled) image that must change before the
+# yellow boundaries are detected again
+BOUNDARY_CHANGE_FRACTION = 0.25
+# Pyramid level the yellow boundaries are detected on: 0 for the full
+# frame, 1 for half the width and height (about 3x faster, see
+# bench_resolution.py). Markers are always detected on the full frame.
+BOUNDARY_LEVEL = 1
+# Show the Detection window, and the minimum time between two shown
+# frames (seconds). Showing fewer frames leaves more time for steering.
+SHOW_DISPLAY = True
+DISPLAY_INTERVAL = 0.05
+# When frames are perceived less often than every CONTROL_PERIOD
+# (seconds), give up the overlay, then display rate, then boundary
+# checks, then marker detection resolution until they are again (see
+# LoadGovernor). Must not be shorter than the camera's frame period.
+LOAD_GOVERNOR = True
+CONTROL_PERIOD = 1 / 30
+# Every command decided and sent is recorded to this file instead of
+# being printed (read it with read_telemetry.py), None to record
+# nothing. The newest TELEMETRY_CAPACITY records are kept.
+TELEMETRY_FILE = "telemetry.ring"
+TELEMETRY_CAPACITY = 100000
+# How often to print the camera to servo latency of every vehicle
+# (seconds), needs binary commands acknowledged by the vehicles
+LATENCY_REPORT_INTERVAL = 5.0
+# Serve the time of every stage, counters and a sampling profiler that
+# can be switched on and off on http://127.0.0.1:METRICS_PORT (see
+# profiler.MetricsServer), None to time nothing
+METRICS_PORT = 8081
+# JSON file listing several cameras and their homographies into track
+# coordinates (see multi_camera.load_cameras), None for one camera
+CAMERA_CONFIG = None
+# Read the camera in its own process, which hands the frames over
+# through shared memory. FRAME_SHAPE is the camera resolution
+# (height, width, channels).
+CAPTURE_PROCESS = False
+FRAME_SHAPE = (480, 640, 3)
 
 
+# HSV range for detecting yellow objects
+lower_yellow = np.array([18, 80, 60])
+upper_yellow = np.array([40, 255, 255])
+
+# ArUco setup
+aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
+# Tuned detector settings (see DETECTOR_PARAMETERS_FILE), the OpenCV
+# defaults for the fields not set
+detector_settings = {}
+if DETECTOR_PARAMETERS_FILE is not None:
+    detector_settings = load_detector_settings(DETECTOR_PARAMETERS_FILE)
+parameters = make_detector_parameters(detector_settings)
+# Every ID the marker dictionary can hold
+MARKER_IDS = range(50)
+
 
 # ==== State Tracking ====
-# Track connected vehicles by ID and store last sent data
-user_sockets = {}
-last_sent_angles = {}
-last_send_times = {}
+# Connected vehicles by ID with their last sent data, a VehicleRegistry
+# once the server has started
+vehicles = None
+# Camera to servo latency of every vehicle
+latency_monitor = LatencyMonitor()
+# Steering telemetry, a TelemetryRecorder once the server has started
+telemetry = None
 
 
 # ==== Connection Handling ====
-def handle_new_connections():
+def register_vehicle(vehicle, replaced):
+    """
+    Sets up a vehicle that sent its user ID, replacing its previous
+    connection if it had one. Called by the vehicle registry.
+
+    Parameters:
+        vehicle (Vehicle): The newly connected vehicle.
+        replaced (Vehicle): Its previous connection, or None.
+
+    Returns:
+        None
     """
-    Listens for and accepts incoming TCP client connections. Each connected
-    client is expected to send a user ID as the first message. The function
-    maps the client socket to this user ID and stores it in the 
-    `user_sockets` dictionary. This function is designed to run in a
-    background thread that loops indefinitely.
+    vehicle.reader = MessageReader()
+    # Over UDP the vehicle is registered when its hello arrives
+    if TRANSPORT != "udp":
+        command_sender.register(vehicle.vehicle_id, vehicle.sock)
+    if replaced is not None:
+        latency_monitor.forget(vehicle.vehicle_id)
+        print(f"User {vehicle.vehicle_id} reconnected from {vehicle.address[0]}")
+    else:
+        print(f"Mapped IP {vehicle.address[0]} to user ID {vehicle.vehicle_id}")
+
+def expire_vehicle(vehicle, reason):
+    """
+    Stops commanding a vehicle the registry dropped because it stopped
+    sending heartbeats. Called by the vehicle registry.
+
+    Parameters:
+        vehicle (Vehicle): The dropped vehicle.
+        reason (str): Why it was dropped.
+
+    Returns:
+        None
+    """
+    print(f"Dropped user {vehicle.vehicle_id}: {reason}")
+    command_sender.unregister(vehicle.vehicle_id)
+    latency_monitor.forget(vehicle.vehicle_id)
+    if telemetry is not None:
+        telemetry.record(vehicle.vehicle_id, -1, DROPPED)
 
-    Parameters: 
+def handle_udp_messages():
+    """
+    Receives the datagrams vehicles send in UDP mode. A hello registers
+    the address it came from with the command sender, and only vehicles
+    that have connected over TCP first are accepted. Acknowledgements
+    are passed to the latency monitor. Both count as heartbeats. This
+    function is designed to run in a background thread that loops
+    indefinitely.
+
+    Parameters:
         None
 
     Returns:
         None
     """
     while True:
-        clientsocket, address = server_socket.accept()
-        ip = address[0]
         try:
-            clientsocket.settimeout(5.0)
-            user_data = clientsocket.recv(1024)
-            if not user_data:
-                raise ValueError("No data received.")
-            user_id = int(user_data.decode().strip())
-            user_sockets[user_id] = clientsocket
-            print(f"Mapped IP {ip} to user ID {user_id}")
-        except Exception as e:
-            print(f"Failed to receive user ID from {ip}: {e}")
-            clientsocket.close()
+            data, address = udp_socket.recvfrom(MESSAGE_SIZE)
+            message = unpack_message(data)
+        except (ValueError, BlockingIOError):
+            continue
+        except OSError:
+            return  # Socket closed
+        if message.vehicle_id not in vehicles:
+            continue
+        vehicles.touch(message.vehicle_id)
+        if message.kind == HELLO:
+            # Repeated hellos keep the vehicle's command sequence
+            if command_sender.register(message.vehicle_id, udp_socket,
+                                       address):
+                print(f"User {message.vehicle_id} receives commands over "
+                      f"UDP at {address[0]}:{address[1]}")
+        elif message.kind == ACK:
+            latency_monitor.record_ack(message.vehicle_id, message.sequence,
+                                       message.capture_time, time.time(),
+                                       message.hold_time)
+
+def receive_from_vehicle(marker_id, data):
+    """
+    Handles the bytes a vehicle sent back over TCP. Acknowledgements of
+    applied commands are passed to the latency monitor, and anything
+    received counts as a heartbeat. Called by the command sender.
+
+    Parameters:
+        marker_id (int): ID of the vehicle's ArUco marker.
+        data (bytes): The received bytes.
+
+    Returns:
+        None
+    """
+    arrival_time = time.time()
+    vehicle = vehicles.get(marker_id)
+    if vehicle is None or PROTOCOL != "binary":
+        return
+    vehicles.touch(marker_id)
+    try:
+        messages = vehicle.reader.feed(data)
+    except ValueError as e:
+        print(f"Invalid message from user {marker_id}: {e}")
+        vehicle.reader = MessageReader()
+        return
+    for message in messages:
+        if message.kind == ACK:
+            latency_monitor.record_ack(marker_id, message.sequence,
+                                       message.capture_time, arrival_time,
+                                       message.hold_time)
+
+def report_latency():
+    """
+    Prints the camera to servo latency of every vehicle every
+    LATENCY_REPORT_INTERVAL seconds. This function is designed to run
+    in a background thread that loops indefinitely.
+
+    Parameters:
+        None
+
+    Returns:
+        None
+    """
+    while True:
+        time.sleep(LATENCY_REPORT_INTERVAL)
+        report = latency_monitor.format_summary()
+        if report:
+            print(report)
+
+def encode_command(vehicle_id, sequence, capture_time, angle):
+    """
+    Encodes a command in the configured PROTOCOL, see CommandSender.
+    """
+    if PROTOCOL == "binary":
+        return pack_command(vehicle_id, sequence, capture_time, angle)
+    return encode_text(vehicle_id, sequence, capture_time, angle)
+
+def record_sent(marker_id, sequence, capture_time, angle, sent_time):
+    """
+    Remembers the angle and time of the last command that was sent to
+    a vehicle, and tells the latency monitor and the telemetry about
+    it. Called by the command sender.
+
+    Parameters:
+        marker_id (int): ID of the vehicle's ArUco marker.
+        sequence (int): Sequence number of the command.
+        capture_time (float): When the frame behind the command was
+            captured (time.time()), 0.0 for a keepalive.
+        angle (int): The servo angle that was sent.
+        sent_time (float): When it was sent (time.monotonic()).
+
+    Returns:
+        None
+    """
+    latency_monitor.record_send(marker_id, sequence, capture_time, time.time())
+    vehicle = vehicles.get(marker_id)
+    if vehicle is None:
+        return
+    if capture_time == 0.0 and vehicle.last_angle == angle:
+        if telemetry is not None:
+            telemetry.record(marker_id, angle, KEEPALIVE)
+        return
+    vehicle.last_angle = angle
+    vehicle.last_send = sent_time
+    if telemetry is not None:
+        telemetry.record(marker_id, angle, SENT)
+
+def forget_vehicle(marker_id, reason, sock):
+    """
+    Removes a vehicle from the registry after its connection failed,
+    unless it has reconnected in the meantime. Called by the command
+    sender.
+
+    Parameters:
+        marker_id (int): ID of the vehicle's ArUco marker.
+        reason (str): Why the vehicle was dropped.
+        sock (socket.socket): The socket that failed.
+
+    Returns:
+        None
+    """
+    print(f"Send error to user {marker_id}: {reason}")
+    if telemetry is not None:
+        telemetry.record(marker_id, -1, DROPPED)
+    # The shared UDP socket does not tell connections apart
+    if vehicles.remove(marker_id, None if TRANSPORT == "udp" else sock):
+        latency_monitor.forget(marker_id)
+
+# Sends the newest angle to each vehicle from its own thread, so a slow
+# vehicle connection never blocks the frame loop
+command_sender = CommandSender(SEND_INTERVAL, encode=encode_command,
+                               on_sent=record_sent, on_drop=forget_vehicle,
+                               on_receive=receive_from_vehicle,
+                               keepalive=KEEPALIVE_INTERVAL,
+                               keepalive_limit=KEEPALIVE_LIMIT)
 
 
 
@@ -132,38 +391,27 @@ def map_angle_to_servo(relative_angle, dist):
     # Make sure the angle is within servo range
     return int(max(48, min(132, servo_angle)))
 
-def send_if_allowed(angle):
+def send_if_allowed(marker_id, angle, capture_time=0.0):
     """
-    Sends a servo angle to a vehicle if enough time has passed. Sends a
-    TCP message with the servo angle to the RC vehicle identified by the
-    global variable marker_id. The function enforces a minimum time
-    between messages (SEND_INTERVAL). If the vehicle has not received
-    a command recently, the angle is sent, and the timestamp and last 
-    angle are updated. If sending fails (e.g., disconnected socket), 
-    the vehicle is removed from all tracking dictionaries.
+    Hands a servo angle for a vehicle to the command sender, without
+    waiting for the network. The sender keeps only the newest angle per
+    vehicle and sends it as soon as SEND_INTERVAL has passed since the
+    last message to that vehicle, so an angle posted too early replaces
+    the waiting one instead of being lost. If sending fails or the
+    vehicle stops reading, it is removed from the vehicle registry.
 
     Parameters:
+        marker_id (int): ID of the vehicle's ArUco marker.
         angle (int): The servo angle to send. Expected range is
                      between 48 (left) and 132 (right), with 90
                      meaning straight.
+        capture_time (float): time.time() when the frame the angle is
+            based on was captured, sent along in binary commands.
 
     Returns:
         None
     """
-    current_time = time.time()
-    last_time = last_send_times.get(marker_id, 0)
-
-    if current_time - last_time >= SEND_INTERVAL:
-        try:
-            user_sockets[marker_id].send((str(angle) + "\n").encode())
-            print(f"[User {marker_id}] Sent angle: {angle}")
-            last_sent_angles[marker_id] = angle
-            last_send_times[marker_id] = current_time
-        except Exception as e:
-            print(f"Send error to user {marker_id}: {e}")
-            user_sockets.pop(marker_id, None)
-            last_sent_angles.pop(marker_id, None)
-            last_send_times.pop(marker_id, None)
+    command_sender.post(marker_id, angle, capture_time)
 
 def compute_point_score(relative_angle, dist):
     """
@@ -223,105 +471,619 @@ def dynamic_threshold(relative_angle):
     else:
         return LOW_THRESHOLD  # Sharp turn — look close for quicker reaction
 
-    
 
-# ==== Start of the Program ====
-# Start the connection listener in the background
-threading.Thread(target=handle_new_connections, daemon=True).start()
 
-# Camera and ArUco setup
-cap = cv2.VideoCapture(0)
-aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
-parameters = aruco.DetectorParameters()
+# ==== Batched Scoring ====
+def dynamic_thresholds(relative_angles):
+    """
+    Vectorized version of dynamic_threshold. Computes the look ahead
+    distance for an array of relative angles at once.
 
-# HSV range for detecting yellow objects
-lower_yellow = np.array([18, 80, 60])
-upper_yellow = np.array([40, 255, 255])
+    Parameters:
+        relative_angles (np.ndarray): Relative heading angles in degrees.
 
+    Returns:
+        np.ndarray: Distance thresholds with the same shape as the input.
+    """
+    angles = np.abs(relative_angles)
+    span = HIGH_THRESHOLD - LOW_THRESHOLD
+    return np.select(
+        [angles < 15, angles < 30, angles < 60],
+        [HIGH_THRESHOLD, LOW_THRESHOLD + span * 0.5,
+         LOW_THRESHOLD + span * 0.25],
+        default=LOW_THRESHOLD)
+
+def compute_point_scores(relative_angles, dists):
+    """
+    Vectorized version of compute_point_score. Scores many points at
+    once, lower is better.
+
+    Parameters:
+        relative_angles (np.ndarray): Angles between the vehicle's heading
+            and each point in degrees.
+        dists (np.ndarray): Distances to each point, same shape as
+            relative_angles.
 
-# ==== Main loop ====
-while True:
-    # Read a frame from the camera
-    ret, frame = cap.read()
-    if not ret:
-        break  # Exit if camera frame is not captured
+    Returns:
+        np.ndarray: Scores as float64. Points outside the ±90° field of
+            view get infinity.
+    """
+    abs_angles = np.abs(relative_angles).astype(np.float64)
+    dists = np.clip(dists, LOW_THRESHOLD, HIGH_THRESHOLD)
+    normalized_dist = (dists - LOW_THRESHOLD) / (HIGH_THRESHOLD - LOW_THRESHOLD)
+    normalized_angle = (abs_angles / 90) ** 2.5
+    scores = ANGLE_FAVOR * normalized_dist + (1 - ANGLE_FAVOR) * normalized_angle
+    scores[abs_angles > 90] = np.inf
+    return scores
+
+def find_best_points(fronts, headings, points):
+    """
+    Finds the best boundary point for every marker in one NumPy pass.
+    Distances, relative angles, dynamic thresholds and scores are
+    computed for all markers and all points at once (markers x points),
+    giving the same result as scoring the points one by one.
+
+    Parameters:
+        fronts (np.ndarray): Front edge midpoints, shape (M, 2).
+        headings (np.ndarray): Marker headings in degrees, shape (M,).
+        points (np.ndarray): Boundary points, shape (N, 2), see
+            boundary_grid.stack_contour_points.
+
+    Returns:
+        tuple: (best_points, best_angles, best_dists, found) where
+            best_points has shape (M, 2) and the others shape (M,).
+            found is a boolean mask, the other values are only
+            meaningful where it is True.
+    """
+    fronts = np.asarray(fronts, dtype=np.float32).reshape(-1, 2)
+    headings = np.asarray(headings, dtype=np.float32).reshape(-1)
+    num_markers = len(fronts)
+    if num_markers == 0 or len(points) == 0:
+        return (np.zeros((num_markers, 2), dtype=np.int32),
+                np.zeros(num_markers, dtype=np.float32),
+                np.zeros(num_markers, dtype=np.float32),
+                np.zeros(num_markers, dtype=bool))
+
+    # Same float32 arithmetic as the per point loop
+    direction = points[np.newaxis, :, :] - fronts[:, np.newaxis, :]
+    dx = direction[..., 0]
+    dy = direction[..., 1]
+    dists = np.sqrt(dx * dx + dy * dy)
+    angles = np.degrees(np.arctan2(-dy, dx))
+    relative = (headings[:, np.newaxis] - angles + 360) % 360
+    relative = np.where(relative > 180, relative - 360, relative)
+
+    scores = compute_point_scores(relative, dists)
+    scores[dists >= dynamic_thresholds(relative)] = np.inf
+
+    # argmin keeps the first of equal scores, like the strict < in the loop
+    best = np.argmin(scores, axis=1)
+    rows = np.arange(num_markers)
+    found = np.isfinite(scores[rows, best])
+    return points[best], relative[rows, best], dists[rows, best], found
+
+def find_best_points_near(fronts, headings, grid, clearances=None, level=0):
+    """
+    Same as find_best_points, but every marker only scores the boundary
+    points in the grid cells around its front point. A point farther
+    away than HIGH_THRESHOLD can never pass the dynamic threshold, so
+    the result is the same as scoring every point on the track.
+
+    Parameters:
+        fronts (np.ndarray): Front edge midpoints, shape (M, 2).
+        headings (np.ndarray): Marker headings in degrees, shape (M,).
+        grid (BoundaryGrid): Grid built from this frame's boundary
+            points with a cell size of at least HIGH_THRESHOLD.
+        clearances (sequence of float, optional): Distance from each
+            front point to the nearest boundary pixel, see
+            BoundaryMap.clearance. Markers with no boundary within
+            HIGH_THRESHOLD are skipped without a grid query.
+        level (int): Pyramid level of the distance field the clearances
+            were read from, their error grows with it.
+
+    Returns:
+        tuple: (best_points, best_angles, best_dists, found), see
+            find_best_points.
+    """
+    fronts = np.asarray(fronts, dtype=np.float32).reshape(-1, 2)
+    headings = np.asarray(headings, dtype=np.float32).reshape(-1)
+    best_points, best_angles, best_dists, found = find_best_points(
+        fronts, headings, grid.points[:0])
+
+    # A clearance is read where the front point falls in the downscaled
+    # distance field, and can be off by up to the diagonal of one of its
+    # pixels, rounding of the front point included
+    slack = 2 ** level * math.sqrt(2)
+    for i in range(len(fronts)):
+        if clearances is not None and clearances[i] > HIGH_THRESHOLD + slack:
+            continue
+        nearby = grid.points[grid.query(fronts[i], HIGH_THRESHOLD)]
+        point, angle, dist, ok = find_best_points(
+            fronts[i:i + 1], headings[i:i + 1], nearby)
+        if ok[0]:
+            best_points[i] = point[0]
+            best_angles[i] = angle[0]
+            best_dists[i] = dist[0]
+            found[i] = True
+
+    return best_points, best_angles, best_dists, found
+
+
+# ==== Frame Processing ====
+# The boundary point a marker steers away from. point, angle and dist
+# are None if no boundary point is close enough. heading is the
+# marker's heading in degrees.
+Target = namedtuple("Target", "marker_id front point angle dist heading",
+                    defaults=(None,))
+# Everything found in one frame, handed from perception to the send
+# and display stages. sequence is the frame's number in the capture
+# ring when frame is a view of shared memory (CAPTURE_PROCESS), None
+# otherwise.
+Perception = namedtuple("Perception",
+                        "frame capture_time corners ids targets commands "
+                        "sequence", defaults=(None,))
+
+def find_targets(corners, ids, boundary_map):
+    """
+    Finds the boundary point in front of every detected marker.
+
+    Parameters:
+        corners (sequence of np.ndarray): Marker corners from
+            aruco.detectMarkers, each with shape (1, 4, 2).
+        ids (np.ndarray or None): Marker IDs from aruco.detectMarkers.
+        boundary_map (BoundaryMap): Current lane boundaries.
+
+    Returns:
+        list of Target: One target per detected marker.
+    """
+    if ids is None:
+        return []
+    marker_corners = [corner[0] for corner in corners]
+    fronts = [(c[0] + c[1]) / 2 for c in marker_corners]  # Front edge midpoint
+    headings = [estimate_heading(c) for c in marker_corners]
+
+    # Only the boundary points near each marker can be chosen
+    clearances = [boundary_map.clearance(f) for f in fronts]
+    best_points, best_angles, best_dists, found = find_best_points_near(
+        fronts, headings, boundary_map.grid, clearances, boundary_map.level)
+
+    targets = []
+    for i, marker_id in enumerate(ids.flatten()):
+        if found[i]:
+            targets.append(Target(int(marker_id), fronts[i], best_points[i],
+                                  best_angles[i], best_dists[i], headings[i]))
+        else:
+            targets.append(Target(int(marker_id), fronts[i], None, None, None,
+                                  headings[i]))
+    return targets
+
+def choose_commands(targets, connected=None, registry=None):
+    """
+    Decides which servo angles to send. A vehicle steers away from its
+    target if the new angle differs enough from the last one sent (at
+    least ANGLE_THRESHOLD, but less than 70 degrees), and is told to go
+    straight if no boundary point is close.
+
+    Parameters:
+        targets (list of Target): Targets from find_targets.
+        connected (container, optional): IDs of the vehicles to command,
+            the ones connected to the registry by default.
+        registry (optional): Has connected() and get(marker_id), the
+            latter returning a Vehicle with the last angle sent. The
+            server's vehicle registry by default.
+
+    Returns:
+        list of tuple: (marker_id, servo_angle) pairs to send.
+    """
+    if registry is None:
+        registry = vehicles
+    if connected is None:
+        connected = registry.connected()
+    commands = []
+    for target in targets:
+        if target.marker_id not in connected:
+            continue
+        vehicle = (registry.get(target.marker_id)
+                   if registry is not None else None)
+        last_angle = None if vehicle is None else vehicle.last_angle
+
+        if target.point is not None:
+            # Convert angle-to-point to a servo angle
+            servo_angle = map_angle_to_servo(target.angle, target.dist)
+            # Angle is None if closest is behind the marker
+            if servo_angle is not None:
+                if last_angle is None or (abs(servo_angle - last_angle
+                    ) >= ANGLE_THRESHOLD and abs(servo_angle - last_angle) < 70):
+                    commands.append((target.marker_id, servo_angle))
+
+        # If no object found, command vehicle to go straight
+        elif last_angle != 90:
+            commands.append((target.marker_id, 90))
+    return commands
+
+def perceive(frame, boundary_map, timer=NULL_TIMER, connected=None,
+             tracker=None, capture_time=None, buffers=None,
+             detection_scale=1.0, registry=None):
+    """
+    Detects the markers and lane boundaries in a frame and decides the
+    steering commands. Nothing is drawn on the frame.
+
+    Parameters:
+        frame (np.ndarray): BGR camera frame.
+        boundary_map (BoundaryMap): Cached lane boundaries, updated if
+            the view has changed.
+        timer (StageTimer, optional): Records the time of every stage.
+        connected (container, optional): IDs of the vehicles to command,
+            see choose_commands.
+        tracker (MarkerTracker, optional): Detects the markers around
+            their predicted positions instead of in the full frame.
+        capture_time (float, optional): time.time() when the frame was
+            captured, now if not given.
+        buffers (FrameBuffers, optional): Reused for the grayscale image
+            instead of allocating a new one for every frame.
+        detection_scale (float): Detect the markers on the grayscale
+            image resized by this factor, used by the LoadGovernor. The
+            corners are scaled back to frame coordinates.
+        registry (optional): The vehicles and their last angles, see
+            choose_commands.
+
+    Returns:
+        Perception: The frame, detections, targets and commands.
+    """
+    if capture_time is None:
+        capture_time = time.time()
 
     # Convert to grayscale for ArUco detection
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    corners, ids, _ = aruco.detectMarkers(
-        gray, aruco_dict, parameters=parameters)
-
-    # Detect yellow areas using HSV color thresholding
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-    yellow_mask = cv2.inRange(hsv, lower_yellow, upper_yellow)
-    contours, _ = cv2.findContours(
-        yellow_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    cv2.drawContours(frame, contours, -1, (0, 0, 0), 2)
-
-    # Process each detected ArUco marker
-    if ids is not None:
-        aruco.drawDetectedMarkers(frame, corners, ids)
-        for i, marker_id in enumerate(ids.flatten()):
-            c = corners[i][0]  # Extract the 4 corners on the ArUco
-            front_point = (c[0] + c[1]) / 2  # Front edge midpoint
-            cx, cy = front_point.astype(int)
-            center = front_point
-            car_heading = estimate_heading(c)
-
-            best_point = None
-            best_angle = None
-            best_score = float('inf')
-            best_dist = None
-
-            # Find closest object point in front of the marker
-            for contour in contours:
-                for point in contour:
-                    direction_vector = point[0] - center
-                    dist = np.linalg.norm(direction_vector)
-                    angle = np.degrees(np.arctan2(-direction_vector[1],
-                                direction_vector[0]))
-                    relative_angle = (car_heading - angle + 360) % 360
-                    if relative_angle > 180:
-                        relative_angle -= 360  # Convert to [-180, 180]
-                    
-                    if dist < dynamic_threshold(relative_angle):
-                        score = compute_point_score(relative_angle, dist)
-                        if score < best_score:
-                            best_point = point[0]
-                            best_angle = relative_angle
-                            best_dist = dist
-                            best_score = score
-
-            # If a valid point is found, draw it and compute turn
-            if best_point is not None:
-                # Draw the best point on the shown frame
-                cv2.circle(frame, tuple(best_point), 5, (0, 0, 255), -1)
-                cv2.line(frame, (cx, cy), tuple(best_point), (0, 0, 255), 2)
-
-                if marker_id in user_sockets:
-                    # Convert angle-to-point to a servo angle
-                    servo_angle = map_angle_to_servo(best_angle, best_dist)
-                    # Angle is None if closest is behind the marker 
-                    if servo_angle is not None:
-                        last_angle = last_sent_angles.get(marker_id, None)
-                        if last_angle is None or (abs(servo_angle - last_angle
-                            ) >= ANGLE_THRESHOLD and abs(servo_angle - last_angle) < 70):
-                            # if abs(servo_angle - last_angle) < 70:
-                                send_if_allowed(servo_angle)
-
-            # If no object found, command vehicle to go straight
-            elif last_sent_angles.get(marker_id, None) != 90:
-                send_if_allowed(90)
-
-    # Display the processed video frame
-    cv2.imshow("Detection", frame)
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break  # Exit on pressing 'q'
-
-
-# Clean up on exit
-cap.release()
-cv2.destroyAllWindows()
-server_socket.close()
-for sock in user_sockets.values():
-    sock.close()
+    with timer.measure("grayscale"):
+        gray = None
+        if buffers is not None:
+            gray = buffers.get("gray", frame.shape[:2])
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+        if detection_scale != 1.0:
+            height, width = gray.shape
+            size = (round(width * detection_scale),
+                    round(height * detection_scale))
+            small = None
+            if buffers is not None:
+                small = buffers.get("gray_small", (size[1], size[0]))
+            gray = cv2.resize(gray, size, dst=small,
+                              interpolation=cv2.INTER_AREA)
+    with timer.measure("detect_markers"):
+        # A tracker that sees the scale change loses its tracks once
+        # and scans the full frame
+        if tracker is not None:
+            corners, ids = tracker.detect(gray)
+        else:
+            corners, ids, _ = aruco.detectMarkers(
+                gray, aruco_dict, parameters=parameters)
+        if detection_scale != 1.0:
+            corners = tuple(corner / detection_scale for corner in corners)
+
+    # Detect yellow areas, only when the track or lighting changed
+    if boundary_map.update(frame, [corner[0] for corner in corners], timer):
+        timer.count("boundary_rebuilds")
+
+    with timer.measure("scoring"):
+        targets = find_targets(corners, ids, boundary_map)
+    with timer.measure("commands"):
+        commands = choose_commands(targets, connected, registry)
+    timer.count("frames")
+    timer.count("markers", len(targets))
+    timer.count("commands", len(commands))
+    return Perception(frame, capture_time, corners, ids, targets, commands)
+
+def process_frame(frame, boundary_map, timer=NULL_TIMER, tracker=None):
+    """
+    Runs the whole vision step on one frame without a camera, network
+    or window, and returns the steering commands it decided on. Every
+    detected marker is treated as a connected vehicle.
+
+    Parameters:
+        frame (np.ndarray): BGR frame, e.g. from a recorded video.
+        boundary_map (BoundaryMap): Lane boundaries kept between frames.
+        timer (StageTimer, optional): Records the time of every stage.
+        tracker (MarkerTracker, optional): See perceive.
+
+    Returns:
+        list of tuple: (marker_id, servo_angle) pairs, see choose_commands.
+    """
+    return perceive(frame, boundary_map, timer, MARKER_IDS, tracker).commands
+
+def perceive_cameras(coordinator, timer=NULL_TIMER, connected=None):
+    """
+    Decides the steering commands from the merged view of several
+    cameras. Same as perceive, but the markers and boundaries come from
+    the camera workers in track coordinates, and there is no frame.
+
+    Parameters:
+        coordinator (Coordinator): Merged camera results.
+        timer (StageTimer, optional): Records the time of every stage.
+        connected (container, optional): See choose_commands.
+
+    Returns:
+        Perception: The merged detections, targets and commands, with
+            frame set to None.
+    """
+    corners, ids, capture_time = coordinator.markers()
+    with timer.measure("scoring"):
+        targets = find_targets(corners, ids, coordinator)
+    with timer.measure("commands"):
+        commands = choose_commands(targets, connected)
+    return Perception(None, capture_time, corners, ids, targets, commands)
+
+def run_multi_camera(cameras, timer=NULL_TIMER):
+    """
+    Steers the vehicles with several cameras, each one read and
+    processed in its own worker process. Runs until every camera has
+    ended or Ctrl+C is pressed. The Detection window is not shown.
+
+    Parameters:
+        cameras (list of tuple): (source, homography) per camera, see
+            multi_camera.load_cameras.
+        timer (StageTimer, optional): Records the time of the merged
+            scoring and of sending.
+
+    Returns:
+        None
+    """
+    options = {
+        "lower": lower_yellow,
+        "upper": upper_yellow,
+        "cell_size": HIGH_THRESHOLD,
+        "track_markers": TRACK_MARKERS,
+        "full_scan_interval": FULL_SCAN_INTERVAL,
+        "change_fraction": BOUNDARY_CHANGE_FRACTION,
+        "boundary_level": BOUNDARY_LEVEL,
+        "detector_settings": detector_settings,
+    }
+    pool = CameraPool(cameras, options)
+    coordinator = Coordinator(HIGH_THRESHOLD)
+    pool.start()
+    print(f"Started {len(cameras)} camera workers")
+    try:
+        for result in pool.results():
+            coordinator.add(result)
+            perception = perceive_cameras(coordinator, timer)
+            with timer.measure("send"):
+                send_commands(perception)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+    print(f"Cameras: {coordinator.stats}")
+
+def apply_load_level(governor, boundary_map, display=None):
+    """
+    Sets the boundary check and display rates of the governor's current
+    level. The overlay and detection resolution are read from the
+    governor on every frame.
+
+    Parameters:
+        governor (LoadGovernor): Governor whose level changed.
+        boundary_map (BoundaryMap): Map whose change checks are thinned.
+        display (Stage, optional): Display stage of the Pipeline.
+
+    Returns:
+        None
+    """
+    print(f"Load level {governor.level} ({governor.name}), "
+          f"loop {governor.loop_time * 1000:.1f} ms")
+    boundary_map.check_interval = governor.boundary_check_interval()
+    if display is not None:
+        display.period = governor.display_period(DISPLAY_INTERVAL)
+
+def send_commands(perception):
+    """
+    Sends the commands of one perceived frame to the vehicles.
+
+    Parameters:
+        perception (Perception): Result from perceive.
+
+    Returns:
+        None
+    """
+    # Seen vehicles keep getting their last angle repeated
+    command_sender.seen(target.marker_id for target in perception.targets)
+    for marker_id, servo_angle in perception.commands:
+        send_if_allowed(marker_id, servo_angle, perception.capture_time)
+    if telemetry is not None and perception.commands:
+        targets = {target.marker_id: target for target in perception.targets}
+        for marker_id, servo_angle in perception.commands:
+            target = targets[marker_id]
+            if target.point is None:
+                telemetry.record(marker_id, servo_angle, QUEUED,
+                                 target.heading)
+            else:
+                telemetry.record(marker_id, servo_angle, QUEUED,
+                                 target.heading, target.point,
+                                 compute_point_score(target.angle,
+                                                     target.dist))
+
+def draw_overlay(perception, boundary_map, frame=None):
+    """
+    Draws the lane boundaries, the detected markers and the chosen
+    boundary point of every marker on the perceived frame.
+
+    Parameters:
+        perception (Perception): Result from perceive.
+        boundary_map (BoundaryMap): Lane boundaries to draw.
+        frame (np.ndarray, optional): Image to draw on instead of
+            perception.frame, e.g. a copy of a frame in the capture
+            ring.
+
+    Returns:
+        np.ndarray: The frame with the overlay drawn on it.
+    """
+    if frame is None:
+        frame = perception.frame
+    cv2.drawContours(frame, boundary_map.contours, -1, (0, 0, 0), 2)
+    if perception.ids is not None:
+        aruco.drawDetectedMarkers(frame, perception.corners, perception.ids)
+    for target in perception.targets:
+        if target.point is not None:
+            # Draw the best point on the shown frame
+            cx, cy = target.front.astype(int)
+            cv2.circle(frame, tuple(target.point), 5, (0, 0, 255), -1)
+            cv2.line(frame, (cx, cy), tuple(target.point), (0, 0, 255), 2)
+    return frame
+
+
+# ==== Start of the Program ====
+if __name__ == "__main__":
+    # ==== Socket Setup ====
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.bind(("", SERVER_PORT))  # Bind to all interfaces
+    server_socket.listen(5)
+    print("Server started. Waiting for RC vehicles to connect...")
+
+    # Accept vehicles and send their commands in the background. Over
+    # TCP the command sender closes the vehicle sockets.
+    heartbeat = HEARTBEAT_TIMEOUT if PROTOCOL == "binary" else None
+    vehicles = VehicleRegistry(server_socket, HANDSHAKE_TIMEOUT, heartbeat,
+                               on_connect=register_vehicle,
+                               on_disconnect=expire_vehicle,
+                               close_sockets=TRANSPORT == "udp")
+    vehicles.start()
+    command_sender.start()
+    if TRANSPORT == "udp":
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.bind(("", SERVER_PORT))
+        threading.Thread(target=handle_udp_messages, daemon=True).start()
+    threading.Thread(target=report_latency, daemon=True).start()
+    if TELEMETRY_FILE is not None:
+        telemetry = TelemetryRecorder(TELEMETRY_FILE, TELEMETRY_CAPACITY)
+        telemetry.start()
+    # Stage times for the metrics endpoint, NULL_TIMER times nothing
+    metrics = NULL_TIMER
+    metrics_server = None
+    if METRICS_PORT is not None:
+        metrics = StageMetrics()
+        metrics.add_stats("sender", command_sender.stats)
+        metrics.add_stats("registry", vehicles.stats)
+        command_sender.timer = metrics
+        metrics_server = MetricsServer(metrics, port=METRICS_PORT)
+        metrics_server.start()
+        print(f"Metrics on http://127.0.0.1:{METRICS_PORT}/metrics")
+
+    if CAMERA_CONFIG is not None:
+        # One worker process per camera, merged in track coordinates
+        run_multi_camera(load_cameras(CAMERA_CONFIG), metrics)
+    else:
+        # Camera setup, keep as few frames buffered as possible
+        if CAPTURE_PROCESS:
+            camera = CaptureProcess(0, FRAME_SHAPE)
+            camera.start()
+        else:
+            cap = cv2.VideoCapture(0)
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # Grayscale image reused for every frame
+        buffers = FrameBuffers()
+
+        # The boundaries are cached and only rebuilt when the view changes
+        boundary_map = BoundaryMap(lower_yellow, upper_yellow, HIGH_THRESHOLD,
+                                   change_fraction=BOUNDARY_CHANGE_FRACTION,
+                                   level=BOUNDARY_LEVEL)
+        tracker = None
+        if TRACK_MARKERS:
+            tracker = MarkerTracker(aruco_dict, parameters, FULL_SCAN_INTERVAL)
+        governor = LoadGovernor(CONTROL_PERIOD) if LOAD_GOVERNOR else None
+        if governor is not None:
+            metrics.add_stats("governor", governor.stats)
+        last_loop = [None]
+
+        def capture():
+            if CAPTURE_PROCESS:
+                # Newest frame in shared memory, when it was taken and
+                # its number in the ring
+                return camera.read()
+            # Read a frame from the camera and note when it was taken
+            with metrics.measure("capture"):
+                ret, frame = cap.read()
+            if not ret:
+                raise EOFError("Camera frame not captured")
+            return time.time(), frame, None
+
+        def torn(sequence):
+            """
+            True if the capture process overwrote the frame while it
+            was used, anything computed from it is then dropped.
+            """
+            if sequence is None or camera.valid(sequence):
+                return False
+            metrics.count("torn_frames")
+            return True
+
+        def perceive_governed(captured):
+            capture_time, frame, sequence = captured
+            if governor is None:
+                perception = perceive(frame, boundary_map, metrics,
+                                      tracker=tracker,
+                                      capture_time=capture_time,
+                                      buffers=buffers)
+            else:
+                start = time.perf_counter()
+                perception = perceive(
+                    frame, boundary_map, metrics, tracker=tracker,
+                    capture_time=capture_time, buffers=buffers,
+                    detection_scale=governor.detection_scale())
+                period = (None if last_loop[0] is None
+                          else start - last_loop[0])
+                last_loop[0] = start
+                if governor.record(time.perf_counter() - start, period):
+                    apply_load_level(governor, boundary_map,
+                                     pipeline.display)
+            if torn(sequence):
+                return None  # Not sent or shown
+            return perception._replace(sequence=sequence)
+
+        def send(perception):
+            with metrics.measure("send"):
+                send_commands(perception)
+
+        def display(perception):
+            # Display the processed video frame
+            frame = perception.frame
+            if perception.sequence is not None:
+                # Never draw into the capture ring, and check that the
+                # copy was taken before the slot was reused
+                frame = frame.copy()
+                if torn(perception.sequence):
+                    return True
+            if governor is None or governor.draw_overlay():
+                with metrics.measure("overlay"):
+                    frame = draw_overlay(perception, boundary_map, frame)
+            with metrics.measure("display"):
+                cv2.imshow("Detection", frame)
+                key = cv2.waitKey(1) & 0xFF
+            if key == ord('r'):
+                boundary_map.request_refresh()  # Detect the boundaries again
+            return key != ord('q')  # Exit on pressing 'q'
+
+        # ==== Main loop ====
+        # Capture, perception, sending and display run in their own threads
+        pipeline = Pipeline(
+            capture,
+            perceive_governed,
+            send,
+            display=display if SHOW_DISPLAY else None,
+            display_period=DISPLAY_INTERVAL,
+            report_interval=5.0)
+        try:
+            pipeline.run()
+        except KeyboardInterrupt:
+            pass
+        pipeline.stop()
+        if CAPTURE_PROCESS:
+            camera.stop()
+        else:
+            cap.release()
+        cv2.destroyAllWindows()
+
+    # Clean up on exit
+    if metrics_server is not None:
+        metrics_server.stop()
+    vehicles.stop()
+    server_socket.close()
+    command_sender.stop()
+    if telemetry is not None:
+        telemetry.stop()
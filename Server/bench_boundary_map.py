@@ -0,0 +1,108 @@
+"""
+Times the cached boundary map against segmenting every frame. A
+synthetic overhead view of a taped track is rendered with cars driving
+over it, and the lighting is dimmed halfway through. The report shows
+how often the map was rebuilt, the cost per frame, and how much of the
+tape was lost under the cars compared with the empty track.
+
+Usage:
+    python bench_boundary_map.py [--frames 300]
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from aruco_edge_detector import HIGH_THRESHOLD
+from boundary_map import BoundaryMap
+
+LOWER_YELLOW = np.array([18, 80, 60])
+UPPER_YELLOW = np.array([40, 255, 255])
+TAPE_COLOR = (0, 220, 230)
+FLOOR_COLOR = (90, 90, 90)
+
+
+def draw_track(width=640, height=480, margin=60, tape=10):
+    """
+    Renders an empty track: a gray floor with a yellow taped rectangle.
+    """
+    frame = np.full((height, width, 3), FLOOR_COLOR, dtype=np.uint8)
+    cv2.rectangle(frame, (margin, margin), (width - margin, height - margin),
+                  TAPE_COLOR, tape)
+    return frame
+
+def car_corners(t, width=640, height=480, size=30):
+    """
+    Marker corners of a car driving along the tape at time t (0..1).
+    """
+    x = 60 + (width - 120) * t
+    y = 60
+    half = size / 2
+    return np.array([[x - half, y - half], [x + half, y - half],
+                     [x + half, y + half], [x - half, y + half]],
+                    dtype=np.float32)
+
+def draw_car(frame, corners):
+    """
+    Draws a dark car body with a white marker square on the frame.
+    """
+    center = corners.mean(axis=0)
+    body = np.round((corners - center) * 2 + center).astype(np.int32)
+    cv2.fillConvexPoly(frame, body, (30, 30, 30))
+    cv2.fillConvexPoly(frame, np.round(corners).astype(np.int32),
+                       (255, 255, 255))
+
+def segment(frame):
+    """
+    The per frame segmentation the cache replaces.
+    """
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, LOWER_YELLOW, UPPER_YELLOW)
+    contours, _ = cv2.findContours(
+        mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return mask, contours
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    track = draw_track()
+    clean_mask, _ = segment(track)
+    tape_pixels = np.count_nonzero(clean_mask)
+
+    boundary_map = BoundaryMap(LOWER_YELLOW, UPPER_YELLOW, HIGH_THRESHOLD)
+    cached_time = full_time = 0.0
+    cached_lost = full_lost = 0
+
+    for i in range(args.frames):
+        frame = track.copy()
+        corners = car_corners(i / args.frames)
+        draw_car(frame, corners)
+        if i >= args.frames // 2:
+            # Lights dimmed, the tape is still yellow but darker
+            frame = (frame * 0.6).astype(np.uint8)
+
+        start = time.perf_counter()
+        boundary_map.update(frame, [corners])
+        cached_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        mask, _ = segment(frame)
+        full_time += time.perf_counter() - start
+
+        cached_lost = max(cached_lost, np.count_nonzero(
+            clean_mask & ~boundary_map.mask))
+        full_lost = max(full_lost, np.count_nonzero(clean_mask & ~mask))
+
+    frames = args.frames
+    print(f"Frames: {frames}, map rebuilds: {boundary_map.builds}")
+    print(f"Segment every frame: {full_time / frames * 1000:.3f} ms/frame, "
+          f"worst tape lost under cars: {full_lost / tape_pixels:.1%}")
+    print(f"Cached map:          {cached_time / frames * 1000:.3f} ms/frame, "
+          f"worst tape lost under cars: {cached_lost / tape_pixels:.1%}")
+
+
+if __name__ == "__main__":
+    main()
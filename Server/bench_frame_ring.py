@@ -0,0 +1,155 @@
+"""
+Measures the cost of getting frames from a capture process to the
+perception code. A video file stands in for the camera and is read in
+a separate process, which hands every frame over either pickled through
+a multiprocessing.Queue or through the shared memory FrameRing. The
+report shows frames per second, hand-off latency and the bytes sent
+between the processes per frame.
+
+The second part measures the memory allocated while a steady-state
+frame is read and perceived (tracemalloc peak above the baseline),
+with a new frame and grayscale image per frame as before, and with
+cap.read(image=...) and FrameBuffers.
+
+Usage:
+    python bench_frame_ring.py [--video clip.avi] [--frames 300]
+"""
+import argparse
+import multiprocessing
+import os
+import pickle
+import queue
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import aruco_edge_detector as detector
+from bench_pipeline import write_test_video
+from boundary_map import BoundaryMap
+from frame_buffers import FrameBuffers
+from frame_ring import CaptureProcess
+
+
+def queue_capture_worker(source, frames):
+    """
+    Capture process of the pickling hand-off.
+    """
+    cap = cv2.VideoCapture(source)
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.put((time.time(), frame))
+    frames.put(None)
+    cap.release()
+
+def run_queue(video):
+    context = multiprocessing.get_context("spawn")
+    frames = context.Queue(maxsize=8)
+    process = context.Process(target=queue_capture_worker,
+                              args=(video, frames), daemon=True)
+    process.start()
+    latencies = []
+    sent_bytes = 0
+    start = None
+    while True:
+        try:
+            item = frames.get(timeout=10.0)
+        except queue.Empty:
+            break
+        if item is None:
+            break
+        if start is None:
+            start = time.perf_counter()  # Leave out the process start
+        capture_time, frame = item
+        latencies.append(time.time() - capture_time)
+        if not sent_bytes:
+            sent_bytes = len(pickle.dumps(item, pickle.HIGHEST_PROTOCOL))
+    elapsed = time.perf_counter() - start
+    process.join()
+    return len(latencies), elapsed, np.asarray(latencies), sent_bytes
+
+def run_ring(video, shape):
+    camera = CaptureProcess(video, shape)
+    camera.start()
+    latencies = []
+    start = None
+    while True:
+        try:
+            capture_time, frame, _ = camera.read(timeout=10.0)
+        except EOFError:
+            break
+        if start is None:
+            start = time.perf_counter()
+        latencies.append(time.time() - capture_time)
+    elapsed = time.perf_counter() - start
+    skipped = camera.skipped
+    camera.stop()
+    # Only a sequence number goes through the pipe
+    sent_bytes = len(pickle.dumps(len(latencies), pickle.HIGHEST_PROTOCOL))
+    return len(latencies) + skipped, elapsed, np.asarray(latencies), sent_bytes
+
+def allocated_per_frame(video, frames, reuse):
+    """
+    Returns the mean and max bytes allocated while reading and
+    perceiving one frame, after a warm up.
+    """
+    cap = cv2.VideoCapture(video)
+    boundary_map = BoundaryMap(detector.lower_yellow, detector.upper_yellow,
+                               detector.HIGH_THRESHOLD)
+    buffers = FrameBuffers() if reuse else None
+    frame = None
+    peaks = []
+    tracemalloc.start()
+    for i in range(frames):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        if reuse:
+            ret, frame = cap.read(image=frame)
+        else:
+            ret, frame = cap.read()
+        if not ret:
+            break
+        detector.perceive(frame, boundary_map, connected=detector.MARKER_IDS,
+                          buffers=buffers)
+        if i >= 10:
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    cap.release()
+    return np.mean(peaks), np.max(peaks)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--video", help="Recorded clip, a synthetic one is "
+                        "used if not given")
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    video = args.video
+    if video is None:
+        video = os.path.join(tempfile.mkdtemp(), "ring.avi")
+        write_test_video(video, frames=args.frames)
+    cap = cv2.VideoCapture(video)
+    ret, first = cap.read()
+    cap.release()
+
+    print("Hand-off from the capture process:")
+    for name, run in (("pickled Queue", lambda: run_queue(video)),
+                      ("FrameRing", lambda: run_ring(video, first.shape))):
+        count, elapsed, latencies, sent_bytes = run()
+        ms = latencies * 1000
+        print(f"  {name:<14} {count / elapsed:>6.0f} frames/s, latency p50 "
+              f"{np.percentile(ms, 50):.2f} ms, p99 {np.percentile(ms, 99):.2f} ms, "
+              f"{sent_bytes} bytes sent per frame")
+
+    print("Memory allocated per steady-state frame (read + perceive):")
+    for name, reuse in (("new arrays", False), ("reused buffers", True)):
+        mean, worst = allocated_per_frame(video, min(args.frames, 200), reuse)
+        print(f"  {name:<14} mean {mean / 1024:>7.1f} KiB, max {worst / 1024:>7.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
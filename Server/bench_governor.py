@@ -0,0 +1,176 @@
+"""
+Shows the LoadGovernor keeping the control rate under CPU load. A clip
+is replayed at camera speed through the threaded pipeline, and the
+governor's target is the camera period (CONTROL_PERIOD is not used so
+that a fast machine can be loaded too). The pipeline has a
+display stage that draws the overlay and encodes the frame in place of
+the window. Halfway through the first third, busy threads start
+competing for the CPU and stop again two thirds in. The run is done
+without and with the governor, and the report shows the perception
+rate (control rate) and loop time of each phase and the load levels
+the governor went through.
+
+Usage:
+    python bench_governor.py [--video clip.avi] [--fps 120] [--seconds 15]
+                             [--load-threads 4] [--width 1280 --height 720]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import aruco_edge_detector as detector
+from bench_pipeline import write_test_video
+from boundary_map import BoundaryMap
+from frame_buffers import FrameBuffers
+from load_governor import LoadGovernor
+from marker_tracker import MarkerTracker
+from pipeline import Pipeline
+
+
+def busy(stop):
+    """
+    Burns CPU until stop is set, like another program on the machine.
+    OpenCV releases the GIL, so this competes for the cores rather than
+    for the interpreter.
+    """
+    image = np.random.default_rng(0).integers(0, 255, (720, 1280, 3),
+                                              dtype=np.uint8)
+    while not stop.is_set():
+        cv2.GaussianBlur(image, (31, 31), 0)
+
+def load_frames(video):
+    cap = cv2.VideoCapture(video)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+def run(frames, fps, seconds, load_threads, use_governor):
+    """
+    Replays the frames in a loop for the given time. Returns the
+    (time, loop seconds, level) of every perceived frame and the
+    governor, None if it was not used.
+    """
+    boundary_map = BoundaryMap(detector.lower_yellow, detector.upper_yellow,
+                               detector.HIGH_THRESHOLD,
+                               level=detector.BOUNDARY_LEVEL)
+    tracker = MarkerTracker(detector.aruco_dict, detector.parameters,
+                            detector.FULL_SCAN_INTERVAL)
+    governor = LoadGovernor(1 / fps) if use_governor else None
+    buffers = FrameBuffers()
+    loops = []
+    start = time.monotonic()
+    next_frame = [start]
+    last_loop = [None]
+
+    def capture():
+        now = time.monotonic()
+        if now - start > seconds:
+            raise EOFError
+        # Frames arrive at camera speed
+        time.sleep(max(0.0, next_frame[0] - now))
+        next_frame[0] += 1 / fps
+        index = int((time.monotonic() - start) * fps)
+        return time.time(), frames[index % len(frames)].copy()
+
+    def perceive(captured):
+        loop_start = time.perf_counter()
+        scale = governor.detection_scale() if governor else 1.0
+        perception = detector.perceive(
+            captured[1], boundary_map, connected=detector.MARKER_IDS,
+            tracker=tracker, capture_time=captured[0], buffers=buffers,
+            detection_scale=scale)
+        loop = time.perf_counter() - loop_start
+        period = None if last_loop[0] is None else loop_start - last_loop[0]
+        last_loop[0] = loop_start
+        if governor is not None and governor.record(loop, period):
+            detector.apply_load_level(governor, boundary_map, pipeline.display)
+        loops.append((time.monotonic() - start, loop,
+                      governor.level if governor else 0))
+        return perception
+
+    def display(perception):
+        frame = perception.frame
+        if governor is None or governor.draw_overlay():
+            frame = detector.draw_overlay(perception, boundary_map)
+        cv2.imencode(".jpg", frame)  # Stands in for imshow
+        return True
+
+    pipeline = Pipeline(capture, perceive, lambda perception: None,
+                        display=display,
+                        display_period=detector.DISPLAY_INTERVAL)
+    stop_load = threading.Event()
+    load = [threading.Thread(target=busy, args=(stop_load,), daemon=True)
+            for _ in range(load_threads)]
+
+    def schedule_load():
+        time.sleep(seconds / 3)
+        for thread in load:
+            thread.start()
+        time.sleep(seconds / 3)
+        stop_load.set()
+
+    threading.Thread(target=schedule_load, daemon=True).start()
+    pipeline.run()
+    stop_load.set()
+    return np.asarray(loops), governor
+
+def report(loops, seconds):
+    phases = (("no load", 0, seconds / 3),
+              ("under load", seconds / 3, 2 * seconds / 3),
+              ("load gone", 2 * seconds / 3, seconds))
+    for name, begin, end in phases:
+        # Leave out the first second of every phase
+        part = loops[(loops[:, 0] >= begin + 1) & (loops[:, 0] < end)]
+        if not len(part):
+            continue
+        rate = len(part) / (end - begin - 1)
+        levels = ", ".join(str(int(level)) for level in np.unique(part[:, 2]))
+        print(f"    {name:<11} {rate:5.1f} frames/s, loop p50 "
+              f"{np.percentile(part[:, 1], 50) * 1000:5.1f} ms, p95 "
+              f"{np.percentile(part[:, 1], 95) * 1000:5.1f} ms, levels {levels}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--video", help="Recorded clip, a synthetic one is "
+                        "used if not given")
+    parser.add_argument("--fps", type=float, default=120.0,
+                        help="Camera rate, also the target control rate")
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--load-threads", type=int, default=4)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    args = parser.parse_args()
+
+    video = args.video
+    if video is None:
+        video = os.path.join(tempfile.mkdtemp(), "governor.avi")
+        write_test_video(video, frames=150, width=args.width,
+                         height=args.height)
+    frames = load_frames(video)
+
+    print(f"Camera and target: {args.fps:.0f} frames/s "
+          f"({1000 / args.fps:.1f} ms per loop), {args.load_threads} load threads")
+    for name, use_governor in (("without governor", False),
+                               ("with governor", True)):
+        loops, governor = run(frames, args.fps, args.seconds,
+                              args.load_threads, use_governor)
+        print(f"  {name}:")
+        report(loops, args.seconds)
+        if governor is not None:
+            print(f"    level changes: {governor.stats['raised']} up, "
+                  f"{governor.stats['lowered']} down, loops per level "
+                  f"{governor.stats['loops_per_level']}")
+
+
+if __name__ == "__main__":
+    main()
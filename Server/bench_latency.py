@@ -0,0 +1,174 @@
+"""
+Checks the camera to servo latency measurement over loopback. The real
+client runtime of Client/steering_client.py runs against fake
+actuators, with its clock shifted by a known offset, and the
+CommandSender sends it commands whose capture time lies a simulated
+perception delay in the past. The report compares the estimated clock offset with the
+true one, and the latency percentiles with the simulated delays.
+
+Usage:
+    python bench_latency.py [--transport tcp] [--seconds 3] [--offset 0.25]
+"""
+import argparse
+import contextlib
+import io
+import os
+import socket
+import sys
+import threading
+import time
+
+from command_sender import CommandSender
+from latency_monitor import LatencyMonitor
+from steering_protocol import (ACK, HELLO, MESSAGE_SIZE, MessageReader,
+                               pack_command, unpack_message)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "Client"))
+import steering_client  # noqa: E402
+from actuators import FakeActuators  # noqa: E402
+
+VEHICLE_ID = 7
+
+
+def run(transport, seconds, rate, offset, perception, servo_delay):
+    """
+    Runs the client and server ends for seconds and returns the
+    monitor and the fake actuators.
+    """
+    monitor = LatencyMonitor(window=10000)
+    actuators = FakeActuators(servo_delay)
+    target = steering_client.LatestTarget()
+    client_clock = lambda: time.time() + offset
+    readers = {VEHICLE_ID: MessageReader()}
+
+    def on_sent(vehicle_id, sequence, capture_time, angle, send_time):
+        monitor.record_send(vehicle_id, sequence, capture_time, time.time())
+
+    def on_receive(vehicle_id, data):
+        arrival = time.time()
+        for message in readers[vehicle_id].feed(data):
+            if message.kind == ACK:
+                monitor.record_ack(vehicle_id, message.sequence,
+                                   message.capture_time, arrival,
+                                   message.hold_time)
+
+    sender = CommandSender(1.0 / rate, encode=pack_command, on_sent=on_sent,
+                           on_receive=on_receive)
+    sockets = []
+    if transport == "udp":
+        server_udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server_udp.bind(("127.0.0.1", 0))
+        server_udp.settimeout(0.2)
+        sockets.append(server_udp)
+
+        def server_udp_loop():
+            while True:
+                try:
+                    data, address = server_udp.recvfrom(MESSAGE_SIZE)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    return
+                message = unpack_message(data)
+                if message.kind == HELLO:
+                    sender.register(message.vehicle_id, server_udp, address)
+                elif message.kind == ACK:
+                    monitor.record_ack(message.vehicle_id, message.sequence,
+                                       message.capture_time, time.time(),
+                                       message.hold_time)
+
+        threading.Thread(target=server_udp_loop, daemon=True).start()
+        vehicle = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        on_applied = steering_client.ack_sender(
+            vehicle, VEHICLE_ID, server_udp.getsockname(), client_clock)
+        client = lambda: steering_client.receive_udp(
+            vehicle, target, VEHICLE_ID, server_udp.getsockname())
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        vehicle = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        vehicle.connect(listener.getsockname())
+        vehicle.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn, _ = listener.accept()
+        listener.close()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sender.register(VEHICLE_ID, conn)
+        on_applied = steering_client.ack_sender(vehicle, VEHICLE_ID,
+                                                clock=client_clock)
+        client = lambda: steering_client.receive_tcp(vehicle, target)
+    sockets.append(vehicle)
+    actuator_loop = steering_client.ActuatorLoop(actuators, target,
+                                                 on_applied=on_applied)
+
+    def client_thread():
+        try:
+            client()
+        except OSError:
+            pass
+
+    threading.Thread(target=client_thread, daemon=True).start()
+    actuator_loop.start()
+    sender.start()
+
+    # Frame loop: a frame is captured, perceived for a while and its
+    # angle posted
+    end = time.time() + seconds
+    frame = 0
+    while time.time() < end:
+        capture_time = time.time()
+        time.sleep(perception)
+        sender.post(VEHICLE_ID, 48 + frame % 84, capture_time)
+        frame += 1
+    time.sleep(0.2)
+    sender.stop()
+    actuator_loop.stop()
+    for sock in sockets:
+        sock.close()
+    return monitor, actuators
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--transport", choices=["tcp", "udp"], default="tcp")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--rate", type=float, default=50.0,
+                        help="Commands per second")
+    parser.add_argument("--offset", type=float, default=0.25,
+                        help="Vehicle clock minus server clock (seconds)")
+    parser.add_argument("--perception", type=float, default=0.02,
+                        help="Simulated time from capture to send (seconds)")
+    parser.add_argument("--servo-delay", type=float, default=0.002,
+                        help="Simulated time to set the servo (seconds)")
+    args = parser.parse_args()
+
+    # Hide the client's messages
+    with contextlib.redirect_stdout(io.StringIO()):
+        monitor, actuators = run(args.transport, args.seconds, args.rate,
+                             args.offset, args.perception, args.servo_delay)
+    entry = monitor.summary().get(VEHICLE_ID)
+    if entry is None:
+        print("No acknowledgements received")
+        return
+
+    # Every command waits for the simulated perception and servo, and
+    # on average half an actuator loop period
+    expected = (args.perception + args.servo_delay) * 1000
+    servo_writes = sum(1 for _, name, _ in actuators.writes
+                       if name == "steering")
+    print(f"{args.transport}: {entry['samples']} commands acknowledged, "
+          f"{servo_writes} servo updates")
+    print(f"  clock offset: true {args.offset * 1000:+.1f} ms, "
+          f"estimated {entry['clock_offset_ms']:+.1f} ms "
+          f"(shortest round trip {entry['rtt_ms']:.2f} ms)")
+    e2e = entry["end_to_end"]
+    print(f"  camera to servo: p50 {e2e['p50_ms']:.0f} ms, "
+          f"p95 {e2e['p95_ms']:.0f} ms, p99 {e2e['p99_ms']:.0f} ms "
+          f"(at least {expected:.0f} ms by construction)")
+    print(f"  server {entry['server']['p50_ms']:.0f} ms, "
+          f"link {entry['link']['p50_ms']:.0f} ms (p50)")
+    print(monitor.format_summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Runs multi-camera mode on video files standing in for the cameras. By
+default a wide synthetic track is rendered and cut into overlapping
+camera views, with markers driving across all of them, so the merged
+marker positions can be checked against the truth. The same frames are
+processed once in a single process, camera after camera, and once by
+one worker process per camera, to show how the throughput scales with
+the cores. The report also shows how often cars were seen by two
+cameras at once and handed from one camera to the next.
+
+Usage:
+    python bench_multi_camera.py [--cameras 4] [--frames 300]
+    python bench_multi_camera.py --config cameras.json
+"""
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import aruco_edge_detector as detector
+from bench_boundary_map import draw_track
+from bench_pipeline import marker_image
+from multi_camera import (CameraPool, CameraProcessor, Coordinator,
+                          load_cameras)
+
+CAMERA_WIDTH = 640
+CAMERA_HEIGHT = 480
+# Width of the strip two neighbouring cameras both see (pixels)
+OVERLAP = 120
+
+
+def write_camera_videos(directory, cameras, frames, markers=3, size=40):
+    """
+    Renders markers driving around a track wide enough for all cameras
+    and writes each camera's part of it as a video. Returns the cameras
+    as (path, homography) pairs and the true marker centers in track
+    coordinates, shape (frames, markers, 2).
+    """
+    step = CAMERA_WIDTH - OVERLAP
+    width = step * cameras + OVERLAP
+    track = draw_track(width, CAMERA_HEIGHT)
+    images = [marker_image(i, size) for i in range(markers)]
+    writers = []
+    setup = []
+    for camera in range(cameras):
+        path = os.path.join(directory, f"camera{camera}.avi")
+        writers.append(cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"),
+                                       30, (CAMERA_WIDTH, CAMERA_HEIGHT)))
+        # The cameras look straight down, side by side
+        homography = np.array([[1, 0, camera * step], [0, 1, 0], [0, 0, 1]],
+                              dtype=np.float64)
+        setup.append((path, homography))
+
+    truth = np.zeros((frames, markers, 2))
+    for f in range(frames):
+        frame = track.copy()
+        for i, image in enumerate(images):
+            phase = 2 * np.pi * (f / frames + i / markers)
+            center = (width / 2 + (width / 2 - 130) * np.cos(phase),
+                      CAMERA_HEIGHT / 2 + 120 * np.sin(phase))
+            x = int(center[0]) - image.shape[1] // 2
+            y = int(center[1]) - image.shape[0] // 2
+            frame[y:y + image.shape[0], x:x + image.shape[1]] = image
+            truth[f, i] = (x + image.shape[1] / 2, y + image.shape[0] / 2)
+        for camera, writer in enumerate(writers):
+            writer.write(frame[:, camera * step:camera * step + CAMERA_WIDTH])
+    for writer in writers:
+        writer.release()
+    return setup, truth
+
+def processor_options():
+    return {
+        "lower": detector.lower_yellow,
+        "upper": detector.upper_yellow,
+        "cell_size": detector.HIGH_THRESHOLD,
+        "track_markers": detector.TRACK_MARKERS,
+        "full_scan_interval": detector.FULL_SCAN_INTERVAL,
+        "change_fraction": detector.BOUNDARY_CHANGE_FRACTION,
+        "boundary_level": detector.BOUNDARY_LEVEL,
+    }
+
+def run_single_process(cameras):
+    """
+    Reads and processes every camera's frames in this process, one
+    camera after the other per frame. Returns (frames, seconds).
+    """
+    caps = [cv2.VideoCapture(source) for source, _ in cameras]
+    processors = [CameraProcessor(camera, homography, **processor_options())
+                  for camera, (_, homography) in enumerate(cameras)]
+    frames = 0
+    start = time.perf_counter()
+    while True:
+        running = False
+        for cap, processor in zip(caps, processors):
+            ret, frame = cap.read()
+            if ret:
+                processor.process(frame, time.time())
+                frames += 1
+                running = True
+        if not running:
+            break
+    elapsed = time.perf_counter() - start
+    for cap in caps:
+        cap.release()
+    return frames, elapsed
+
+def run_workers(cameras, truth=None):
+    """
+    Runs one worker process per camera and merges their results.
+    Returns (frames, seconds, coordinator, errors, most), where errors
+    are the distances between the marker centers each camera mapped to
+    track coordinates and the true ones, and most is the largest number
+    of markers in one merged view.
+    """
+    pool = CameraPool(cameras, processor_options())
+    coordinator = Coordinator(detector.HIGH_THRESHOLD)
+    errors = []
+    most = 0
+    commands = 0
+    frames = 0
+    pool.start()
+    start = None
+    for result in pool.results(timeout=10.0):
+        if start is None:
+            # Leave out the time it takes to start the processes
+            start = time.perf_counter()
+        frames += 1
+        coordinator.add(result)
+        perception = detector.perceive_cameras(
+            coordinator, connected=detector.MARKER_IDS)
+        commands += len(perception.commands)
+        most = max(most, len(perception.corners))
+        if truth is not None:
+            for marker_id, corners in zip(result.ids, result.corners):
+                errors.append(np.linalg.norm(
+                    corners.mean(axis=0) - truth[result.frame_index, marker_id]))
+    elapsed = time.perf_counter() - start
+    pool.stop()
+    coordinator.stats["commands"] = commands
+    return frames, elapsed, coordinator, np.asarray(errors), most
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--cameras", type=int,
+                        default=min(4, multiprocessing.cpu_count()))
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--config", help="Camera list with video files, "
+                        "see multi_camera.load_cameras")
+    args = parser.parse_args()
+
+    truth = None
+    if args.config:
+        cameras = load_cameras(args.config)
+    else:
+        cameras, truth = write_camera_videos(tempfile.mkdtemp(), args.cameras,
+                                             args.frames)
+
+    # Compare like with like, OpenCV's own threads are off in the workers
+    cv2.setNumThreads(1)
+    frames, elapsed = run_single_process(cameras)
+    single_fps = frames / elapsed
+    print(f"{len(cameras)} cameras, {multiprocessing.cpu_count()} cores")
+    print(f"  one process:           {frames} frames, {single_fps:.0f} frames/s")
+
+    frames, elapsed, coordinator, errors, most = run_workers(cameras, truth)
+    worker_fps = frames / elapsed
+    print(f"  one worker per camera: {frames} frames, {worker_fps:.0f} frames/s "
+          f"({worker_fps / single_fps:.1f}x)")
+    stats = coordinator.stats
+    print(f"  seen by two cameras: {stats['duplicates']} times, "
+          f"handoffs: {stats['handoffs']}, "
+          f"boundary merges: {stats['boundary_builds']}, "
+          f"commands: {stats['commands']}")
+    print(f"  most markers in one merged view: {most}")
+    if len(errors):
+        print(f"  marker position error in track coordinates: "
+              f"mean {errors.mean():.2f} px, max {errors.max():.2f} px")
+
+
+if __name__ == "__main__":
+    main()
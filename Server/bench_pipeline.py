@@ -0,0 +1,110 @@
+"""
+Runs the threaded capture / perception / send / display pipeline on a
+video file instead of the camera and reports the throughput of every
+stage. A synthetic clip with a taped track and moving markers is
+written first unless a clip is given. Sending can be slowed down on
+purpose to show that a slow stage does not stall capture or perception.
+
+Usage:
+    python bench_pipeline.py [--video clip.avi] [--send-delay 0.05]
+                             [--display-interval 0.1] [--no-display]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+
+import aruco_edge_detector as detector
+from bench_boundary_map import draw_track
+from boundary_map import BoundaryMap
+from pipeline import Pipeline
+
+
+def marker_image(marker_id, size):
+    """
+    Renders a DICT_4X4_50 marker with a white border as a BGR image.
+    """
+    if hasattr(aruco, "generateImageMarker"):
+        image = aruco.generateImageMarker(detector.aruco_dict, marker_id, size)
+    else:
+        image = aruco.drawMarker(detector.aruco_dict, marker_id, size)
+    image = cv2.copyMakeBorder(image, size // 4, size // 4, size // 4,
+                               size // 4, cv2.BORDER_CONSTANT, value=255)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+def write_test_video(path, frames=300, markers=3, width=640, height=480,
+                     size=40):
+    """
+    Writes a clip of markers driving in circles inside a taped track.
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30,
+                             (width, height))
+    track = draw_track(width, height)
+    images = [marker_image(i, size) for i in range(markers)]
+    for f in range(frames):
+        frame = track.copy()
+        for i, image in enumerate(images):
+            phase = 2 * np.pi * (f / frames + i / markers)
+            x = int(width / 2 + 180 * np.cos(phase)) - image.shape[1] // 2
+            y = int(height / 2 + 120 * np.sin(phase)) - image.shape[0] // 2
+            frame[y:y + image.shape[0], x:x + image.shape[1]] = image
+        writer.write(frame)
+    writer.release()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--video", help="Recorded clip, a synthetic one is "
+                        "used if not given")
+    parser.add_argument("--send-delay", type=float, default=0.0,
+                        help="Extra time every send takes (seconds)")
+    parser.add_argument("--display-interval", type=float, default=0.1)
+    parser.add_argument("--no-display", action="store_true")
+    args = parser.parse_args()
+
+    video = args.video
+    if video is None:
+        video = os.path.join(tempfile.mkdtemp(), "pipeline.avi")
+        write_test_video(video)
+
+    cap = cv2.VideoCapture(video)
+    boundary_map = BoundaryMap(detector.lower_yellow, detector.upper_yellow,
+                               detector.HIGH_THRESHOLD)
+    sent = []
+
+    def capture():
+        ret, frame = cap.read()
+        if not ret:
+            raise EOFError("End of video")
+        return frame
+
+    def send(perception):
+        time.sleep(args.send_delay)
+        sent.extend(perception.commands)
+
+    def display(perception):
+        # Headless: draw the overlay but do not show it
+        detector.draw_overlay(perception, boundary_map)
+
+    pipeline = Pipeline(
+        capture,
+        lambda frame: detector.perceive(frame, boundary_map,
+                                        connected=detector.MARKER_IDS),
+        send,
+        display=None if args.no_display else display,
+        display_period=args.display_interval)
+    pipeline.run()
+    cap.release()
+
+    report = pipeline.summary()
+    report["commands_sent"] = len(sent)
+    report["boundary_builds"] = boundary_map.builds
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
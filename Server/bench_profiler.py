@@ -0,0 +1,128 @@
+"""
+Measures what the built-in stage metrics and the sampling profiler
+cost the frame loop. Simulated frames of cars on the track (see
+track_simulator.py) are perceived over and over with timing off
+(NULL_TIMER, METRICS_PORT = None), with StageMetrics recording every
+stage, and with the sampling profiler running on top. The rounds are
+interleaved so that a slow moment hits all of them alike. Then the
+metrics endpoint is queried like curl would, and part of its answer
+and of the profiler report is shown.
+
+Usage:
+    python bench_profiler.py [--cars 8] [--frames 60] [--rounds 5]
+"""
+import argparse
+import time
+import urllib.request
+
+import aruco_edge_detector as detector
+from boundary_map import BoundaryMap
+from frame_buffers import FrameBuffers
+from profiler import MetricsServer, SamplingProfiler, StageMetrics
+from stage_timer import NULL_TIMER
+from track_simulator import TrackSimulator
+
+
+def make_frames(cars, count):
+    """
+    Renders count frames of cars driving around the track.
+    """
+    simulator = TrackSimulator(detector.aruco_dict)
+    simulator.add_cars(cars)
+    frames = []
+    for _ in range(count):
+        frames.append(simulator.render())
+        simulator.step()
+    return frames
+
+def perceive_all(frames, boundary_map, buffers, timer):
+    """
+    Perceives every frame, returns the time per frame (seconds).
+    """
+    start = time.perf_counter()
+    for capture_time, frame in enumerate(frames):
+        detector.perceive(frame, boundary_map, timer,
+                          connected=detector.MARKER_IDS,
+                          capture_time=float(capture_time), buffers=buffers)
+    return (time.perf_counter() - start) / len(frames)
+
+def call_cost(timer, calls=100000):
+    """
+    Time of one empty measure() block (seconds).
+    """
+    start = time.perf_counter()
+    for _ in range(calls):
+        with timer.measure("empty"):
+            pass
+    return (time.perf_counter() - start) / calls
+
+def fetch(address, path, method="GET"):
+    url = f"http://{address[0]}:{address[1]}{path}"
+    request = urllib.request.Request(url, method=method)
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.read().decode()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--cars", type=int, default=8)
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    frames = make_frames(args.cars, args.frames)
+    boundary_map = BoundaryMap(
+        detector.lower_yellow, detector.upper_yellow, detector.HIGH_THRESHOLD,
+        change_fraction=detector.BOUNDARY_CHANGE_FRACTION,
+        level=detector.BOUNDARY_LEVEL)
+    buffers = FrameBuffers()
+    metrics = StageMetrics()
+    profiler = SamplingProfiler()
+    # Warm up the boundaries and the buffers
+    perceive_all(frames[:5], boundary_map, buffers, NULL_TIMER)
+
+    times = {"off": [], "metrics": [], "metrics + profiler": []}
+    for _ in range(args.rounds):
+        times["off"].append(perceive_all(frames, boundary_map, buffers,
+                                         NULL_TIMER))
+        times["metrics"].append(perceive_all(frames, boundary_map, buffers,
+                                             metrics))
+        profiler.start()
+        times["metrics + profiler"].append(
+            perceive_all(frames, boundary_map, buffers, metrics))
+        profiler.stop()
+
+    print(f"{args.cars} cars, {args.frames} frames x {args.rounds} rounds, "
+          f"best round per setting")
+    base = min(times["off"])
+    for name, rounds in times.items():
+        best = min(rounds)
+        print(f"  {name:>20}: {best * 1000:6.2f} ms per frame "
+              f"({(best - base) / base:+.1%})")
+    off, on = call_cost(NULL_TIMER), call_cost(StageMetrics())
+    print(f"  one measure() block: off {off * 1e6:.2f} us, "
+          f"metrics {on * 1e6:.2f} us")
+    # Plus the three counters, each about as costly as a timed block
+    blocks = (sum(stage["count"] for stage in metrics.summary().values())
+              / (2 * args.rounds * args.frames) + 3)
+    print(f"  {blocks:.1f} timed blocks and counters per frame: "
+          f"{blocks * off * 1e6:.0f} us off, {blocks * on * 1e6:.0f} us with "
+          f"metrics, {blocks * on / base:.2%} of a frame")
+
+    server = MetricsServer(metrics, port=0)
+    server.start()
+    fetch(server.address, "/profile/start?interval=0.002", "POST")
+    perceive_all(frames, boundary_map, buffers, metrics)
+    report = fetch(server.address, "/profile/stop", "POST")
+    text = fetch(server.address, "/metrics")
+    server.stop()
+    print("\nGET /metrics (excerpt):")
+    for line in text.splitlines():
+        if 'quantile="0.5"' in line or line.startswith("events_total"):
+            print("  " + line)
+    print("\nPOST /profile/stop (excerpt):")
+    for line in report.splitlines()[:12]:
+        print("  " + line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Loopback comparison of the steering command formats: the old text
+protocol over TCP with Nagle's algorithm on, the binary protocol over
+TCP with TCP_NODELAY, and the binary protocol over UDP. Each is run
+once as fast as possible to measure the message rate, and once at a
+steady rate to measure the latency from send to decode.
+
+Usage:
+    python bench_protocol.py [--count 20000] [--rate 200] [--seconds 2]
+"""
+import argparse
+import socket
+import threading
+import time
+
+import numpy as np
+
+from command_sender import encode_text
+from steering_protocol import (COMMAND, MESSAGE_SIZE, MessageReader,
+                               SequenceFilter, pack_command, unpack_message)
+
+
+def text_receiver(sock, arrivals):
+    sock_file = sock.makefile("r")
+    for line in sock_file:
+        int(line.strip())
+        arrivals.append(time.perf_counter())
+
+def tcp_receiver(sock, arrivals):
+    reader = MessageReader()
+    sequence_filter = SequenceFilter()
+    while True:
+        data = sock.recv(4096)
+        if not data:
+            return
+        for message in reader.feed(data):
+            if message.kind == COMMAND and sequence_filter.accept(message):
+                arrivals.append(time.perf_counter())
+
+def udp_receiver(sock, arrivals, stop):
+    sequence_filter = SequenceFilter()
+    sock.settimeout(0.2)
+    while not stop.is_set():
+        try:
+            data, _ = sock.recvfrom(MESSAGE_SIZE)
+        except socket.timeout:
+            continue
+        message = unpack_message(data)
+        if message.kind == COMMAND and sequence_filter.accept(message):
+            arrivals.append(time.perf_counter())
+
+def run_case(protocol, transport, count, rate):
+    """
+    Sends count commands, at rate messages per second or as fast as
+    possible if rate is None. Returns the send times and arrival times.
+    """
+    arrivals = []
+    stop = threading.Event()
+    if transport == "udp":
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(("127.0.0.1", 0))
+        receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        address = receiver.getsockname()
+        thread = threading.Thread(target=udp_receiver,
+                                  args=(receiver, arrivals, stop))
+
+        def send(data):
+            sender.sendto(data, address)
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        receiver.connect(listener.getsockname())
+        sender, _ = listener.accept()
+        listener.close()
+        if protocol == "binary":
+            sender.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        target = text_receiver if protocol == "text" else tcp_receiver
+        thread = threading.Thread(target=target, args=(receiver, arrivals))
+        send = sender.sendall
+    thread.daemon = True
+    thread.start()
+
+    sent = []
+    period = 1.0 / rate if rate else 0.0
+    start = time.perf_counter()
+    for i in range(count):
+        if period:
+            wait = start + i * period - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        angle = 48 + i % 84
+        if protocol == "text":
+            data = encode_text(1, i + 1, 0.0, angle)
+        else:
+            data = pack_command(1, i + 1, time.time(), angle)
+        sent.append(time.perf_counter())
+        send(data)
+
+    # Wait for the last messages to arrive
+    deadline = time.perf_counter() + 2.0
+    while len(arrivals) < count and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    stop.set()
+    sender.close()
+    thread.join(timeout=1.0)
+    receiver.close()
+    return np.asarray(sent), np.asarray(arrivals)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--count", type=int, default=20000,
+                        help="Messages sent in the rate test")
+    parser.add_argument("--rate", type=float, default=200.0,
+                        help="Messages per second in the latency test")
+    parser.add_argument("--seconds", type=float, default=2.0,
+                        help="Length of the latency test")
+    args = parser.parse_args()
+
+    cases = [("text", "tcp"), ("binary", "tcp"), ("binary", "udp")]
+    print(f"{'protocol':<18} {'msgs/s':>10} {'lost':>6} "
+          f"{'p50 us':>8} {'p99 us':>8} {'max us':>8}")
+    for protocol, transport in cases:
+        sent, arrived = run_case(protocol, transport, args.count, None)
+        duration = arrived[-1] - sent[0] if len(arrived) else float("inf")
+        throughput = len(arrived) / duration
+
+        count = int(args.rate * args.seconds)
+        sent, arrived = run_case(protocol, transport, count, args.rate)
+        # Order is kept by TCP, and the filter keeps only in-order UDP
+        # datagrams, which on loopback are all of them
+        latency = (arrived - sent[:len(arrived)]) * 1e6
+        name = f"{protocol}/{transport}"
+        print(f"{name:<18} {throughput:>10.0f} {count - len(arrived):>6} "
+              f"{np.percentile(latency, 50):>8.1f} "
+              f"{np.percentile(latency, 99):>8.1f} {latency.max():>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
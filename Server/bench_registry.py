@@ -0,0 +1,216 @@
+"""
+Stress test for the vehicle registry. Hundreds of local fake vehicles
+connect at once while a simulated frame loop reads the connected IDs
+every few milliseconds. Some fake vehicles connect and stay silent,
+send a broken ID, reconnect with an ID already in use, or disconnect
+and stop sending heartbeats. The same crowd is then accepted one at a
+time like the old handle_new_connections did. The report shows how
+long the handshakes took, the frame loop's longest gap, and whether the
+registry ended with exactly the vehicles that should be connected.
+
+Usage:
+    python bench_registry.py [--vehicles 300] [--silent 10] [--workers 64]
+"""
+import argparse
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from vehicle_registry import VehicleRegistry
+
+HANDSHAKE_TIMEOUT = 1.0
+HEARTBEAT_TIMEOUT = 0.5
+HEARTBEAT_INTERVAL = 0.1
+
+
+class FrameLoop(threading.Thread):
+    """
+    Reads the connected IDs and every connected vehicle like the frame
+    loop does, every period seconds, and notes the longest gap between
+    two frames.
+    """
+
+    def __init__(self, registry, period=0.005):
+        super().__init__(daemon=True)
+        self.registry = registry
+        self.period = period
+        self.frames = 0
+        self.longest_gap = 0.0
+        self.stop = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self.stop.wait(self.period):
+            for vehicle_id in self.registry.connected():
+                self.registry.get(vehicle_id)
+            now = time.perf_counter()
+            self.longest_gap = max(self.longest_gap, now - last)
+            last = now
+            self.frames += 1
+
+
+def connect(port, message):
+    """
+    Connects a fake vehicle and sends message as its ID (nothing if it
+    is None). Returns the socket and when the connection was made.
+    """
+    sock = socket.create_connection(("127.0.0.1", port))
+    start = time.perf_counter()
+    if message is not None:
+        sock.sendall(message)
+    return sock, start
+
+def crowd(vehicles, silent, garbage, reconnects):
+    """
+    The ID each fake vehicle sends, in connection order: silent ones
+    send None, and the reconnecting ones reuse the first IDs.
+    """
+    messages = [str(i).encode() for i in range(vehicles)]
+    messages += [None] * silent + [b"hello"] * garbage
+    messages += [str(i).encode() for i in range(reconnects)]
+    return messages
+
+def run_registry(messages, vehicles, disconnects, workers):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1024)
+    port = listener.getsockname()[1]
+
+    registered = {}
+
+    def on_connect(vehicle, replaced):
+        registered[vehicle.address[1]] = time.perf_counter()
+
+    registry = VehicleRegistry(listener, HANDSHAKE_TIMEOUT, HEARTBEAT_TIMEOUT,
+                               on_connect=on_connect)
+    registry.start()
+    loop = FrameLoop(registry)
+    loop.start()
+
+    # The connected vehicles send heartbeats until they disconnect
+    alive = set(range(vehicles))
+    stop_heartbeats = threading.Event()
+
+    def heartbeats():
+        while not stop_heartbeats.wait(HEARTBEAT_INTERVAL):
+            for vehicle_id in list(alive):
+                registry.touch(vehicle_id)
+
+    threading.Thread(target=heartbeats, daemon=True).start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        clients = list(pool.map(lambda m: connect(port, m), messages))
+    ports = [sock.getsockname()[1] for sock, _ in clients]
+    valid = [p for p, m in zip(ports, messages)
+             if m is not None and m.isdigit()]
+    # Wait for every valid ID and its first heartbeat, then disconnect
+    # some vehicles
+    deadline = time.perf_counter() + 5.0
+    while (any(p not in registered for p in valid)
+           and time.perf_counter() < deadline):
+        time.sleep(0.001)
+    all_registered = max(registered.get(p, time.perf_counter())
+                         for p in valid) - start
+    time.sleep(2 * HEARTBEAT_INTERVAL)
+    gone = list(range(vehicles - disconnects, vehicles))
+    alive.difference_update(gone)
+    for vehicle_id in gone:
+        registry.get(vehicle_id).sock.close()
+    time.sleep(max(HANDSHAKE_TIMEOUT, HEARTBEAT_TIMEOUT) + 0.5)
+
+    latencies = [registered[port] - connected
+                 for port, (_, connected) in zip(ports, clients)
+                 if port in registered]
+    connected = registry.connected()
+    loop.stop.set()
+    loop.join()
+    stop_heartbeats.set()
+    registry.stop()
+    listener.close()
+    for sock, _ in clients:
+        sock.close()
+    return {"latencies": np.array(latencies), "all_registered": all_registered,
+            "connected": connected, "stats": registry.stats,
+            "longest_gap": loop.longest_gap, "frames": loop.frames}
+
+def run_sequential(messages, vehicles, workers):
+    """
+    Accepts the same crowd one connection at a time, waiting up to
+    HANDSHAKE_TIMEOUT for each ID like the old handle_new_connections.
+    Returns how long it took until every vehicle was registered.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1024)
+    port = listener.getsockname()[1]
+    user_sockets = {}
+
+    def accept():
+        while len(user_sockets) < vehicles:
+            clientsocket, _ = listener.accept()
+            try:
+                clientsocket.settimeout(HANDSHAKE_TIMEOUT)
+                user_id = int(clientsocket.recv(1024).decode())
+                user_sockets[user_id] = clientsocket
+            except (OSError, ValueError):
+                clientsocket.close()
+
+    # The crowd arrives in a random order, as it would in practice
+    order = np.random.default_rng(0).permutation(len(messages))
+    start = time.perf_counter()
+    acceptor = threading.Thread(target=accept, daemon=True)
+    acceptor.start()
+    with ThreadPoolExecutor(workers) as pool:
+        clients = list(pool.map(lambda i: connect(port, messages[i]), order))
+    acceptor.join()
+    elapsed = time.perf_counter() - start
+    listener.close()
+    for sock in list(user_sockets.values()) + [c for c, _ in clients]:
+        sock.close()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--vehicles", type=int, default=300)
+    parser.add_argument("--silent", type=int, default=10)
+    parser.add_argument("--garbage", type=int, default=10)
+    parser.add_argument("--reconnects", type=int, default=50)
+    parser.add_argument("--disconnects", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=64,
+                        help="Fake vehicles connecting at the same time")
+    args = parser.parse_args()
+    messages = crowd(args.vehicles, args.silent, args.garbage, args.reconnects)
+
+    result = run_registry(messages, args.vehicles, args.disconnects,
+                          args.workers)
+    stats = result["stats"]
+    latencies = result["latencies"] * 1000
+    expected = set(range(args.vehicles - args.disconnects))
+    print(f"{len(messages)} connections: {args.vehicles} vehicles, "
+          f"{args.silent} silent, {args.garbage} invalid IDs, "
+          f"{args.reconnects} reconnects, then {args.disconnects} disconnects")
+    print("VehicleRegistry")
+    print(f"  all vehicles registered after {result['all_registered']:.2f} s")
+    print(f"  handshake latency p50 {np.percentile(latencies, 50):.1f} ms, "
+          f"p99 {np.percentile(latencies, 99):.1f} ms, "
+          f"max {latencies.max():.1f} ms")
+    print(f"  frame loop: {result['frames']} frames, longest gap "
+          f"{result['longest_gap'] * 1000:.1f} ms")
+    print(f"  registered {stats['registered']}, replaced {stats['replaced']}, "
+          f"timed out {stats['timed_out']}, failed {stats['failed']}, "
+          f"expired {stats['expired']}")
+    correct = result["connected"] == expected
+    print(f"  connected at the end: {len(result['connected'])} "
+          f"({'as expected' if correct else 'WRONG'})")
+
+    elapsed = run_sequential(messages, args.vehicles, args.workers)
+    print("One at a time (old handle_new_connections)")
+    print(f"  all vehicles registered after {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Compares the resolution tiers of the boundary extraction. Every frame
+of a clip is segmented at each pyramid level of BoundaryMap (0 is the
+full frame, 1 half the width and height, ...), with a rebuild forced
+on every frame so its cost can be measured. The markers are detected
+once per frame at full resolution and shared by all tiers, so only the
+boundaries differ. The report shows the rebuild time per tier and how
+far the servo angles from map_angle_to_servo move away from the ones
+at full resolution.
+
+Usage:
+    python bench_resolution.py [--video clip.avi] [--frames 300]
+                               [--levels 0 1 2 3]
+"""
+import argparse
+import os
+import tempfile
+
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+
+import aruco_edge_detector as detector
+from bench_boundary_map import FLOOR_COLOR, TAPE_COLOR
+from bench_pipeline import marker_image
+from boundary_map import BoundaryMap
+from stage_timer import StageTimer
+
+REBUILD_STAGES = ("hsv_inrange", "find_contours", "boundary_index")
+# Servo angle difference (degrees) that counts as a different decision
+DECISION_DELTA = 5
+
+
+def write_oval_video(path, frames=300, markers=3, width=640, height=480,
+                     size=40):
+    """
+    Writes a clip of markers driving around inside an oval of tape. The
+    curved tape gives dense contour points, so the cars steer most of
+    the time.
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30,
+                             (width, height))
+    track = np.full((height, width, 3), FLOOR_COLOR, dtype=np.uint8)
+    cv2.ellipse(track, (width // 2, height // 2), (width // 2 - 40,
+                height // 2 - 40), 0, 0, 360, TAPE_COLOR, 10)
+    images = [marker_image(i, size) for i in range(markers)]
+    for f in range(frames):
+        frame = track.copy()
+        for i, image in enumerate(images):
+            phase = 2 * np.pi * (f / frames + i / markers)
+            x = int(width / 2 + (width / 2 - 110) * np.cos(phase))
+            y = int(height / 2 + (height / 2 - 100) * np.sin(phase))
+            x -= image.shape[1] // 2
+            y -= image.shape[0] // 2
+            frame[y:y + image.shape[0], x:x + image.shape[1]] = image
+        writer.write(frame)
+    writer.release()
+
+def servo_angles(targets):
+    """
+    Returns {marker_id: servo angle} of the targets as choose_commands
+    would compute them, 90 if no boundary point is close and None if
+    the point is behind the marker.
+    """
+    angles = {}
+    for target in targets:
+        if target.point is None:
+            angles[target.marker_id] = 90
+        else:
+            angles[target.marker_id] = detector.map_angle_to_servo(
+                target.angle, target.dist)
+    return angles
+
+def run_tiers(video, levels, max_frames):
+    """
+    Runs every tier over the clip. Returns per level the StageTimer
+    and a list with the servo angles of every frame.
+    """
+    maps = {level: BoundaryMap(detector.lower_yellow, detector.upper_yellow,
+                               detector.HIGH_THRESHOLD, level=level)
+            for level in levels}
+    timers = {level: StageTimer() for level in levels}
+    angles = {level: [] for level in levels}
+    cap = cv2.VideoCapture(video)
+    frames = 0
+    while frames < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        corners, ids, _ = aruco.detectMarkers(
+            gray, detector.aruco_dict, parameters=detector.parameters)
+        marker_corners = [corner[0] for corner in corners]
+        for level in levels:
+            boundary_map = maps[level]
+            boundary_map.request_refresh()
+            boundary_map.update(frame, marker_corners, timers[level])
+            targets = detector.find_targets(corners, ids, boundary_map)
+            angles[level].append(servo_angles(targets))
+        frames += 1
+    cap.release()
+    return timers, angles
+
+def compare(angles, reference):
+    """
+    Compares the servo angles of a tier with the reference tier.
+
+    Returns:
+        tuple: (differences, changed) where differences are the absolute
+            angle differences in degrees of the markers both tiers
+            steered, and changed the fraction of marker sightings whose
+            decision differs: steering against no steering, or angles
+            that differ by DECISION_DELTA or more.
+    """
+    differences = []
+    changed = 0
+    total = 0
+    for frame_angles, frame_reference in zip(angles, reference):
+        for marker_id, expected in frame_reference.items():
+            angle = frame_angles.get(marker_id)
+            total += 1
+            if angle is None or expected is None:
+                changed += angle is not expected
+                continue
+            differences.append(abs(angle - expected))
+            changed += abs(angle - expected) >= DECISION_DELTA
+    return np.asarray(differences, dtype=np.float64), changed / max(total, 1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--video", help="Recorded clip, a synthetic one is "
+                        "used if not given")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--levels", type=int, nargs="+", default=[0, 1, 2, 3])
+    args = parser.parse_args()
+
+    video = args.video
+    if video is None:
+        video = os.path.join(tempfile.mkdtemp(), "resolution.avi")
+        write_oval_video(video, frames=args.frames)
+    levels = sorted(set(args.levels) | {0})
+
+    timers, angles = run_tiers(video, levels, args.frames)
+    frames = len(angles[0])
+    print(f"{frames} frames, boundaries rebuilt on every frame")
+    print(f"  level  scale   rebuild p50   p99     angle diff mean   p95   "
+          f"same   changed by >= {DECISION_DELTA} deg")
+    for level in levels:
+        summary = timers[level].summary()
+        rebuild = np.sum([np.asarray(timers[level].samples[stage])
+                          for stage in REBUILD_STAGES], axis=0) * 1000
+        differences, changed = compare(angles[level], angles[0])
+        same = np.mean(differences == 0) if len(differences) else 1.0
+        mean = differences.mean() if len(differences) else 0.0
+        p95 = np.percentile(differences, 95) if len(differences) else 0.0
+        print(f"  {level:>5}  1/{2 ** level:<4} "
+              f"{np.percentile(rebuild, 50):>8.2f} ms {np.percentile(rebuild, 99):>6.2f} ms "
+              f"{mean:>10.2f} deg {p95:>5.0f} deg {same:>5.0%} {changed:>10.1%}")
+        stages = ", ".join(f"{stage} {summary[stage]['p50_ms']:.2f}"
+                           for stage in REBUILD_STAGES)
+        print(f"         p50 ms per stage: {stages}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Checks and times the batched boundary point scoring against the
+original per point loop. Random tracks and marker poses are generated,
+both implementations are run on them and the chosen best point, angle
+and distance are compared. The script exits with an error if any frame
+gives a different result.
+
+Usage:
+    python bench_scoring.py [--frames 200] [--markers 4] [--seed 0]
+"""
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from aruco_edge_detector import (compute_point_score, dynamic_threshold,
+                                 estimate_heading, find_best_points)
+from boundary_grid import stack_contour_points
+
+
+def reference_best_point(center, car_heading, contours):
+    """
+    The original per point search from the main loop, kept as the
+    reference for the batched version.
+
+    Parameters:
+        center (np.ndarray): Front edge midpoint of the marker.
+        car_heading (float): Heading of the marker in degrees.
+        contours (sequence of np.ndarray): Contours from cv2.findContours.
+
+    Returns:
+        tuple: (best_point, best_angle, best_dist), all None if no
+            point was found.
+    """
+    best_point = None
+    best_angle = None
+    best_score = float('inf')
+    best_dist = None
+    for contour in contours:
+        for point in contour:
+            direction_vector = point[0] - center
+            dist = np.linalg.norm(direction_vector)
+            angle = np.degrees(np.arctan2(-direction_vector[1],
+                        direction_vector[0]))
+            relative_angle = (car_heading - angle + 360) % 360
+            if relative_angle > 180:
+                relative_angle -= 360  # Convert to [-180, 180]
+
+            if dist < dynamic_threshold(relative_angle):
+                score = compute_point_score(relative_angle, dist)
+                if score < best_score:
+                    best_point = point[0]
+                    best_angle = relative_angle
+                    best_dist = dist
+                    best_score = score
+    return best_point, best_angle, best_dist
+
+def random_track(rng, width=640, height=480, lines=6):
+    """
+    Draws random thick yellow-ish polylines on a mask and returns the
+    contours the same way the server extracts them.
+    """
+    mask = np.zeros((height, width), dtype=np.uint8)
+    for _ in range(lines):
+        pts = rng.integers(0, (width, height), size=(4, 2)).astype(np.int32)
+        cv2.polylines(mask, [pts], False, 255, int(rng.integers(4, 15)))
+    contours, _ = cv2.findContours(
+        mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+def random_marker(rng, width=640, height=480, size=30):
+    """
+    Returns the 4 corners of a randomly placed and rotated marker in
+    the detector order [top-left, top-right, bottom-right, bottom-left].
+    """
+    center = rng.uniform((size, size), (width - size, height - size))
+    theta = rng.uniform(0, 2 * np.pi)
+    rot = np.array([[np.cos(theta), -np.sin(theta)],
+                    [np.sin(theta), np.cos(theta)]])
+    square = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * size / 2
+    return (square @ rot.T + center).astype(np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--markers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    loop_time = 0.0
+    batch_time = 0.0
+    mismatches = 0
+    total_points = 0
+
+    for _ in range(args.frames):
+        contours = random_track(rng)
+        markers = [random_marker(rng) for _ in range(args.markers)]
+        fronts = [(c[0] + c[1]) / 2 for c in markers]
+        headings = [estimate_heading(c) for c in markers]
+
+        start = time.perf_counter()
+        expected = [reference_best_point(f, h, contours)
+                    for f, h in zip(fronts, headings)]
+        loop_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        points = stack_contour_points(contours)
+        best_points, best_angles, best_dists, found = find_best_points(
+            fronts, headings, points)
+        batch_time += time.perf_counter() - start
+        total_points += len(points)
+
+        for i, (point, angle, dist) in enumerate(expected):
+            if point is None:
+                same = not found[i]
+            else:
+                same = (found[i]
+                        and np.array_equal(point, best_points[i])
+                        and np.isclose(angle, best_angles[i], atol=1e-3)
+                        and np.isclose(dist, best_dists[i], atol=1e-3))
+            if not same:
+                mismatches += 1
+
+    frames = args.frames
+    print(f"Frames: {frames}, markers per frame: {args.markers}, "
+          f"avg boundary points: {total_points / frames:.0f}")
+    print(f"Per point loop: {loop_time / frames * 1000:.3f} ms/frame")
+    print(f"Batched:        {batch_time / frames * 1000:.3f} ms/frame "
+          f"({loop_time / max(batch_time, 1e-12):.1f}x faster)")
+    print(f"Mismatching markers: {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Shows that a stalled vehicle cannot slow down the frame loop. Several
+local fake vehicles read commands as fast as they arrive, and one
+connects but never reads. A simulated frame loop posts an angle to
+every vehicle each frame, first with blocking socket sends like the
+old send_if_allowed and then through the CommandSender. The report
+shows the frame loop's time per frame and what the vehicles received.
+
+Usage:
+    python bench_sender.py [--vehicles 5] [--seconds 3] [--rate 100]
+"""
+import argparse
+import socket
+import threading
+import time
+
+import numpy as np
+
+from command_sender import CommandSender, encode_text
+
+# Padding added to every message so the stalled vehicle's socket
+# buffers fill up within a second instead of minutes
+PADDING = 1000
+
+
+def padded(vehicle_id, sequence, capture_time, angle):
+    return b" " * PADDING + encode_text(vehicle_id, sequence, capture_time,
+                                        angle)
+
+def reader(sock, counts, vehicle_id):
+    """
+    Fake vehicle that reads lines until the connection closes.
+    """
+    buffer = b""
+    try:
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            buffer += data
+            lines = buffer.split(b"\n")
+            buffer = lines.pop()
+            counts[vehicle_id] += len(lines)
+    except OSError:
+        pass
+
+def connect_vehicles(count):
+    """
+    Opens count reading vehicles plus one that never reads. Returns the
+    server side sockets by vehicle id (the stalled one has id 0), the
+    receive counts and the client sockets.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(count + 1)
+    port = listener.getsockname()[1]
+
+    server_side = {}
+    clients = []
+    counts = {i: 0 for i in range(count + 1)}
+    for vehicle_id in range(count + 1):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        client.connect(("127.0.0.1", port))
+        conn, _ = listener.accept()
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+        server_side[vehicle_id] = conn
+        clients.append(client)
+        if vehicle_id != 0:
+            threading.Thread(target=reader, args=(client, counts, vehicle_id),
+                             daemon=True).start()
+    listener.close()
+    return server_side, counts, clients
+
+def frame_loop(post, vehicles, seconds, rate):
+    """
+    Calls post(vehicle_id, angle) for every vehicle once per frame and
+    returns how long each frame's posting took (seconds).
+    """
+    period = 1.0 / rate
+    durations = []
+    end = time.monotonic() + seconds
+    frame = 0
+    while time.monotonic() < end:
+        start = time.monotonic()
+        for vehicle_id in vehicles:
+            post(vehicle_id, 48 + frame % 84)
+        durations.append(time.monotonic() - start)
+        frame += 1
+        time.sleep(max(0.0, period - (time.monotonic() - start)))
+    return np.asarray(durations)
+
+def report(name, durations, counts, seconds):
+    ms = durations * 1000
+    healthy = [n for i, n in counts.items() if i != 0]
+    print(f"{name}: {len(ms)} frames, loop time p50 {np.percentile(ms, 50):.3f} ms, "
+          f"p99 {np.percentile(ms, 99):.3f} ms, max {ms.max():.1f} ms")
+    print(f"  reading vehicles got {min(healthy) / seconds:.0f}-"
+          f"{max(healthy) / seconds:.0f} commands/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--vehicles", type=int, default=5)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--rate", type=float, default=100.0,
+                        help="Frame loop rate (frames per second)")
+    parser.add_argument("--send-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    # Old behavior: blocking send from the frame loop
+    sockets, counts, clients = connect_vehicles(args.vehicles)
+    last_send = {}
+
+    def blocking_post(vehicle_id, angle):
+        now = time.monotonic()
+        if vehicle_id not in sockets:
+            return
+        if now - last_send.get(vehicle_id, 0) >= args.send_interval:
+            try:
+                sockets[vehicle_id].settimeout(1.0)
+                sockets[vehicle_id].send(padded(vehicle_id, 0, 0.0, angle))
+                last_send[vehicle_id] = now
+            except OSError:
+                sockets.pop(vehicle_id).close()
+
+    durations = frame_loop(blocking_post, list(sockets), args.seconds, args.rate)
+    report("Blocking send", durations, counts, args.seconds)
+    print(f"  stalled vehicle dropped: {0 not in sockets}")
+    for sock in list(sockets.values()) + clients:
+        sock.close()
+
+    # CommandSender
+    sockets, counts, clients = connect_vehicles(args.vehicles)
+    dropped = []
+    sender = CommandSender(args.send_interval, encode=padded, stall_timeout=0.5,
+                           on_drop=lambda vehicle_id, reason, sock:
+                               dropped.append(vehicle_id))
+    for vehicle_id, sock in sockets.items():
+        sender.register(vehicle_id, sock)
+    sender.start()
+    durations = frame_loop(sender.post, list(sockets), args.seconds, args.rate)
+    report("CommandSender", durations, counts, args.seconds)
+    print(f"  stalled vehicle dropped: {0 in dropped}, "
+          f"angles replaced before sending: {sender.stats['coalesced']}")
+    sender.stop()
+    for sock in clients:
+        sock.close()
+
+
+if __name__ == "__main__":
+    main()
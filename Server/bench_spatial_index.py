@@ -0,0 +1,83 @@
+"""
+Compares the grid based nearest boundary search with scoring every
+boundary point, on tracks of growing size. The per marker cost of the
+full scan grows with the number of boundary points, while the grid
+search should stay about the same. Both must choose the same point,
+the script exits with an error otherwise.
+
+Usage:
+    python bench_spatial_index.py [--frames 50] [--markers 8] [--seed 0]
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from aruco_edge_detector import (HIGH_THRESHOLD, estimate_heading,
+                                 find_best_points, find_best_points_near)
+from bench_scoring import random_marker, random_track
+from boundary_grid import BoundaryGrid, stack_contour_points
+
+# Track sizes as multiples of a 640x480 camera image
+SCALES = [1, 2, 4, 8]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--markers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    mismatches = 0
+    print(f"{'size':>11} {'points':>8} {'build ms':>9} "
+          f"{'full us/marker':>15} {'grid us/marker':>15}")
+
+    for scale in SCALES:
+        width, height = 640 * scale, 480 * scale
+        build_time = full_time = grid_time = 0.0
+        total_points = 0
+
+        for _ in range(args.frames):
+            contours = random_track(rng, width, height, lines=6 * scale * scale)
+            markers = [random_marker(rng, width, height)
+                       for _ in range(args.markers)]
+            fronts = [(c[0] + c[1]) / 2 for c in markers]
+            headings = [estimate_heading(c) for c in markers]
+            points = stack_contour_points(contours)
+            total_points += len(points)
+
+            start = time.perf_counter()
+            full = find_best_points(fronts, headings, points)
+            full_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            grid = BoundaryGrid(points, HIGH_THRESHOLD)
+            build_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            near = find_best_points_near(fronts, headings, grid)
+            grid_time += time.perf_counter() - start
+
+            same = (np.array_equal(full[3], near[3])
+                    and np.array_equal(full[0][full[3]], near[0][near[3]])
+                    and np.allclose(full[1][full[3]], near[1][near[3]])
+                    and np.allclose(full[2][full[3]], near[2][near[3]]))
+            if not same:
+                mismatches += 1
+
+        markers = args.frames * args.markers
+        print(f"{width:>5}x{height:<5} {total_points // args.frames:>8} "
+              f"{build_time / args.frames * 1000:>9.3f} "
+              f"{full_time / markers * 1e6:>15.1f} "
+              f"{grid_time / markers * 1e6:>15.1f}")
+
+    print(f"Mismatching frames: {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
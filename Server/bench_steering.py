@@ -0,0 +1,148 @@
+"""
+Drives the manual steering server from a script instead of the
+keyboard. Several local fake cars connect, and a scripted driver holds
+keys with 30 Hz auto-repeat, combines steering and throttle, switches
+between the cars and stops. The report shows what every car received,
+how many key events were merged, and how much CPU the server used,
+next to the old loop that polled keyboard.is_pressed (emulated with a
+fake that never reports a key, the cheapest case).
+
+Usage:
+    python bench_steering.py [--cars 4]
+"""
+import argparse
+import socket
+import threading
+import time
+
+import steering
+from steering import ScriptedInput, start_server, stop_server
+
+AUTO_REPEAT = 1 / 30
+WORDS = sorted([word for _, word in steering.KEY_COMMANDS.values()]
+               + list(steering.HOLD_COMMAND), key=len, reverse=True)
+
+
+def fake_car(port, user, received):
+    """
+    Connects, sends its user ID and splits what it receives into words
+    like the client's TextCommandReader. The words that arrive together
+    are noted as one command, e.g. "left+forward".
+    """
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(str(user).encode())
+    buffer = ""
+    try:
+        while True:
+            data = sock.recv(4096)
+            if not data:
+                break
+            buffer += data.decode()
+            words = []
+            while True:
+                word = next((w for w in WORDS if buffer.startswith(w)), None)
+                if word is None:
+                    break
+                words.append(word)
+                buffer = buffer[len(word):]
+            if words:
+                received[user].append((time.monotonic(), "+".join(words)))
+    except OSError:
+        pass
+    sock.close()
+
+def hold(key, start, seconds):
+    """
+    Events of a key held from start for seconds, auto-repeating.
+    """
+    events = []
+    at = start
+    while at < start + seconds:
+        events.append((at, key, True))
+        at += AUTO_REPEAT
+    events.append((start + seconds, key, False))
+    return events
+
+def script():
+    """
+    The driver: car 1 forward and left, switch to car 2 with tab, right
+    and forward, car 3 by its number key, stop.
+    """
+    events = hold("w", 0.2, 1.0) + hold("a", 0.5, 0.5)
+    events += [(1.3, "tab", True), (1.32, "tab", False)]
+    events += hold("d", 1.4, 0.6) + hold("w", 1.5, 0.4)
+    events += [(2.1, "3", True), (2.12, "3", False)]
+    events += hold("q", 2.2, 0.3)
+    return events
+
+def busy_poll(seconds):
+    """
+    The old send_control_signals loop with no key pressed.
+    """
+    def is_pressed(key):
+        return False
+
+    start = time.process_time()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        for key in "wsxafdgq":
+            if is_pressed(key):
+                break
+    return (time.process_time() - start) / seconds
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--cars", type=int, default=4)
+    args = parser.parse_args()
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    port = listener.getsockname()[1]
+
+    events = script()
+    keys = ScriptedInput(events)
+    received = {user: [] for user in range(1, args.cars + 1)}
+    # The cars connect before the script starts, car 1 first so it is
+    # the active one
+    parts = start_server(listener, ScriptedInput([]))
+    controller, registry, _ = parts
+    for user in received:
+        threading.Thread(target=fake_car, args=(port, user, received),
+                         daemon=True).start()
+        while user not in registry:
+            time.sleep(0.001)
+
+    cpu = time.process_time()
+    start = time.monotonic()
+    keys.start(controller.on_key)
+    keys.done.wait()
+    time.sleep(0.5)
+    seconds = time.monotonic() - start
+    cpu = (time.process_time() - cpu) / seconds
+    stop_server(*parts, keys)
+    listener.close()
+
+    print(f"{len(events)} key events in {events[-1][0]:.1f} s, "
+          f"{controller.stats['repeats_ignored']} auto-repeats ignored, "
+          f"{controller.stats['posted']} commands posted")
+    for user, commands in received.items():
+        if not commands:
+            print(f"  car {user}: nothing")
+            continue
+        first = commands[0][0] - start
+        last = commands[-1][0] - start
+        sequence = []
+        for _, command in commands:
+            if not sequence or sequence[-1][0] != command:
+                sequence.append([command, 0])
+            sequence[-1][1] += 1
+        shown = ", ".join(f"{command} x{count}" for command, count in sequence)
+        print(f"  car {user}: {len(commands)} commands from {first:.2f} to "
+              f"{last:.2f} s: {shown}")
+    print(f"CPU use: event driven {cpu:.1%} of a core, "
+          f"old polling loop {busy_poll(1.0):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Measures what recording one steering command costs the thread that
+sends it. The old print() is timed writing to a line buffered file,
+which like a terminal makes one write call per line (a terminal still
+has to draw it), against TelemetryRecorder.record, which only queues
+the record for the background writer. The background writer's own
+cost per record is shown as well, and the file is read back to check
+that every record arrived.
+
+Usage:
+    python bench_telemetry.py [--records 200000]
+"""
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from telemetry import QUEUED, SENT, TelemetryRecorder, load_telemetry
+
+
+def time_print(count, path):
+    with open(path, "w", buffering=1) as f, contextlib.redirect_stdout(f):
+        start = time.perf_counter()
+        for i in range(count):
+            print(f"[User {i % 8}] Sent angle: {90 + i % 40}")
+        f.flush()
+        return time.perf_counter() - start
+
+def time_record(recorder, count):
+    point = np.array([320, 240], dtype=np.int32)
+    start = time.perf_counter()
+    for i in range(count):
+        if i % 2:
+            recorder.record(i % 8, 90 + i % 40, SENT)
+        else:
+            recorder.record(i % 8, 90 + i % 40, QUEUED, 87.5, point, 0.42)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--records", type=int, default=200000)
+    args = parser.parse_args()
+    count = args.records
+    directory = tempfile.mkdtemp()
+
+    printed = time_print(count, os.path.join(directory, "log.txt"))
+
+    path = os.path.join(directory, "telemetry.ring")
+    # Large enough that nothing is overwritten, no background thread so
+    # that record() and the writing can be timed apart
+    recorder = TelemetryRecorder(path, capacity=count)
+    recorded = time_record(recorder, count)
+    start = time.perf_counter()
+    recorder.flush()
+    written = time.perf_counter() - start
+    recorder.stop()
+
+    records = load_telemetry(path)
+    print(f"{count} records")
+    print(f"  print(), line buffered:   {printed / count * 1e6:6.2f} us per record")
+    print(f"  TelemetryRecorder.record: {recorded / count * 1e6:6.2f} us per record")
+    print(f"  background write:         {written / count * 1e6:6.2f} us per record")
+    print(f"  read back: {len(records)} records, "
+          f"{os.path.getsize(path) / count:.0f} bytes each")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Compares tracking-assisted marker detection with scanning the full
+frame on a recorded clip. Every frame is detected both ways. The report
+shows how often a tracked marker was found in its predicted crop, how
+many of the full scan's markers the tracker also found (recall), the
+largest corner difference, and the detection time of both.
+
+Usage:
+    python bench_tracker.py clip.avi [--full-scan-interval 10]
+    python bench_tracker.py --synthetic
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+
+from aruco_edge_detector import aruco_dict, parameters
+from benchmark import read_frames
+from marker_tracker import MarkerTracker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("source", nargs="?",
+                        help="Video file or image directory")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="Use a generated clip instead of a recording")
+    parser.add_argument("--full-scan-interval", type=int, default=10)
+    parser.add_argument("--max-frames", type=int)
+    args = parser.parse_args()
+
+    source = args.source
+    if source is None:
+        if not args.synthetic:
+            parser.error("give a video file or image directory, or --synthetic")
+        from bench_pipeline import write_test_video
+        source = os.path.join(tempfile.mkdtemp(), "synthetic.avi")
+        write_test_video(source)
+
+    tracker = MarkerTracker(aruco_dict, parameters, args.full_scan_interval)
+    full_time = tracked_time = 0.0
+    expected = matched = 0
+    worst_error = 0.0
+    frames = 0
+
+    for frame in read_frames(source, args.max_frames):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        start = time.perf_counter()
+        corners, ids, _ = aruco.detectMarkers(
+            gray, aruco_dict, parameters=parameters)
+        full_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        tracked_corners, tracked_ids = tracker.detect(gray)
+        tracked_time += time.perf_counter() - start
+        frames += 1
+
+        if ids is None:
+            continue
+        tracked = ({} if tracked_ids is None else
+                   {int(i): c[0] for i, c in zip(tracked_ids.flatten(),
+                                                 tracked_corners)})
+        for marker_id, c in zip(ids.flatten(), corners):
+            expected += 1
+            if int(marker_id) in tracked:
+                matched += 1
+                error = np.abs(tracked[int(marker_id)] - c[0]).max()
+                worst_error = max(worst_error, float(error))
+
+    stats = tracker.stats
+    print(f"Frames: {frames}, full scans: {stats['full_scans']} "
+          f"({stats['lost_scans']} after a lost track), "
+          f"crop scans: {stats['roi_scans']}")
+    print(f"Crop hit rate: {tracker.hit_rate():.1%}")
+    print(f"Recall vs. full scan: {matched / max(expected, 1):.1%} "
+          f"of {expected} markers, worst corner difference {worst_error:.2f} px")
+    print(f"Pixels scanned: {stats['pixels_scanned'] / max(frames, 1):.0f} "
+          f"per frame ({stats['pixels_scanned'] / max(frames * gray.size, 1):.1%}"
+          f" of full frames)")
+    print(f"Full scan:      {full_time / max(frames, 1) * 1000:.3f} ms/frame")
+    print(f"Tracked:        {tracked_time / max(frames, 1) * 1000:.3f} ms/frame "
+          f"({1 - tracked_time / max(full_time, 1e-12):.1%} time saved)")
+
+
+if __name__ == "__main__":
+    main()
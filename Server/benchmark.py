@@ -0,0 +1,194 @@
+"""
+Headless benchmark of the vision loop. Replays a recorded video or a
+directory of images through process_frame, without camera, network or
+window, and reports the p50/p95/p99 latency of every stage and the
+frames per second. The results are written to a JSON file so runs on
+different commits can be compared.
+
+Usage:
+    python benchmark.py clip.avi [--output results.json]
+    python benchmark.py frames_dir/ --refresh-boundaries
+    python benchmark.py clip.avi --compare old_results.json
+    python benchmark.py --synthetic
+"""
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+import cv2
+
+from aruco_edge_detector import (BOUNDARY_CHANGE_FRACTION, BOUNDARY_LEVEL,
+                                 FULL_SCAN_INTERVAL, HIGH_THRESHOLD, aruco_dict,
+                                 lower_yellow, parameters, process_frame,
+                                 upper_yellow)
+from boundary_map import BoundaryMap
+from marker_tracker import MarkerTracker
+from stage_timer import StageTimer
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def read_frames(source, max_frames=None):
+    """
+    Yields BGR frames from a video file or from the images in a
+    directory, in file name order.
+
+    Parameters:
+        source (str): Path to a video file or an image directory.
+        max_frames (int, optional): Stop after this many frames.
+    """
+    count = 0
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source)
+                       if name.lower().endswith(IMAGE_EXTENSIONS))
+        for name in names:
+            if max_frames is not None and count >= max_frames:
+                return
+            frame = cv2.imread(os.path.join(source, name))
+            if frame is not None:
+                count += 1
+                yield frame
+        return
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise FileNotFoundError(f"Cannot open video {source}")
+    try:
+        while max_frames is None or count < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            count += 1
+            yield frame
+    finally:
+        cap.release()
+
+def git_commit():
+    """
+    Returns the current git commit hash, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(source, max_frames=None, warmup=5, refresh_boundaries=False,
+                  track_markers=False):
+    """
+    Runs every frame of a source through process_frame and times it.
+
+    Parameters:
+        source (str): Video file or image directory.
+        max_frames (int, optional): Number of frames to use.
+        warmup (int): Frames run before timing starts.
+        refresh_boundaries (bool): Rebuild the boundary map on every
+            frame, to measure the segmentation stages each time. Without
+            it the map is still rebuilt on the first timed frame, so the
+            report always has the segmentation stages.
+        track_markers (bool): Detect the markers with a MarkerTracker
+            instead of scanning the full frame.
+
+    Returns:
+        dict: Frame count, frames per second, commands decided and the
+            latency summary of every stage.
+    """
+    boundary_map = BoundaryMap(lower_yellow, upper_yellow, HIGH_THRESHOLD,
+                               change_fraction=BOUNDARY_CHANGE_FRACTION,
+                               level=BOUNDARY_LEVEL)
+    tracker = None
+    if track_markers:
+        tracker = MarkerTracker(aruco_dict, parameters, FULL_SCAN_INTERVAL)
+    timer = StageTimer()
+    frames = 0
+    commands = 0
+    total = 0.0
+
+    for i, frame in enumerate(read_frames(source, max_frames)):
+        if refresh_boundaries or i == warmup:
+            boundary_map.request_refresh()
+        if i < warmup:
+            process_frame(frame, boundary_map, tracker=tracker)
+            continue
+        start = time.perf_counter()
+        commands += len(process_frame(frame, boundary_map, timer, tracker))
+        elapsed = time.perf_counter() - start
+        timer.record("frame", elapsed)
+        total += elapsed
+        frames += 1
+
+    return {
+        "source": source,
+        "commit": git_commit(),
+        "frames": frames,
+        "fps": frames / total if total > 0 else 0.0,
+        "commands": commands,
+        "boundary_builds": boundary_map.builds,
+        "stages": timer.summary(),
+    }
+
+def print_report(results, baseline=None):
+    """
+    Prints the stage latencies, and the change in p50 against a
+    baseline run if one is given.
+    """
+    print(f"{results['frames']} frames, {results['fps']:.1f} fps, "
+          f"{results['boundary_builds']} boundary builds")
+    header = f"{'stage':<18} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    if baseline:
+        header += f" {'p50 change':>11}"
+    print(header)
+    for name, stats in results["stages"].items():
+        line = (f"{name:<18} {stats['count']:>6} {stats['p50_ms']:>8.3f} "
+                f"{stats['p95_ms']:>8.3f} {stats['p99_ms']:>8.3f}")
+        old = baseline["stages"].get(name) if baseline else None
+        if old and old["p50_ms"] > 0:
+            line += f" {stats['p50_ms'] / old['p50_ms'] - 1:>+11.1%}"
+        print(line)
+    if baseline:
+        print(f"fps: {baseline['fps']:.1f} -> {results['fps']:.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("source", nargs="?",
+                        help="Video file or image directory")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="Use a generated clip instead of a recording")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Earlier results JSON to compare with")
+    parser.add_argument("--max-frames", type=int)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--refresh-boundaries", action="store_true",
+                        help="Segment the boundaries on every frame")
+    parser.add_argument("--track-markers", action="store_true",
+                        help="Detect markers around their predicted positions")
+    args = parser.parse_args()
+
+    source = args.source
+    if source is None:
+        if not args.synthetic:
+            parser.error("give a video file or image directory, or --synthetic")
+        from bench_pipeline import write_test_video
+        source = os.path.join(tempfile.mkdtemp(), "synthetic.avi")
+        write_test_video(source)
+
+    results = run_benchmark(source, args.max_frames, args.warmup,
+                            args.refresh_boundaries, args.track_markers)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
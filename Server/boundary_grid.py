@@ -0,0 +1,101 @@
+import numpy as np
+
+
+def stack_contour_points(contours):
+    """
+    Stacks the points of every contour into one array so that they can
+    be scored together instead of one contour at a time. The order of
+    the points is kept, which makes ties resolve the same way as when
+    looping over the contours.
+
+    Parameters:
+        contours (sequence of np.ndarray): Contours as returned by
+            cv2.findContours, each with shape (K, 1, 2).
+
+    Returns:
+        np.ndarray: Array of shape (N, 2) with all boundary points in
+            pixel coordinates. Empty (0, 2) if there are no contours.
+    """
+    if len(contours) == 0:
+        return np.empty((0, 2), dtype=np.int32)
+    return np.concatenate(contours).reshape(-1, 2)
+
+
+class BoundaryGrid:
+    """
+    Uniform grid over the lane boundary points of one frame. The points
+    are bucketed by cell once, after which a radius query only has to
+    look at the cells that overlap the search circle instead of every
+    point on the track.
+
+    The cell size should be at least the largest search radius so a
+    query never touches more than 3x3 cells.
+
+    Parameters:
+        points (np.ndarray): Boundary points, shape (N, 2), in pixel
+            coordinates (x, y).
+        cell_size (float): Side length of one grid cell in pixels.
+    """
+
+    def __init__(self, points, cell_size):
+        self.points = np.asarray(points).reshape(-1, 2)
+        self.cell_size = float(cell_size)
+
+        if len(self.points) == 0:
+            self._order = np.empty(0, dtype=np.intp)
+            self._keys = np.empty(0, dtype=np.int64)
+            self._origin = np.zeros(2)
+            self._cols = 1
+            return
+
+        cells = np.floor(self.points / self.cell_size).astype(np.int64)
+        self._origin = cells.min(axis=0)
+        cells -= self._origin
+        self._cols = int(cells[:, 0].max()) + 1
+        keys = cells[:, 1] * self._cols + cells[:, 0]
+        # Stable sort keeps the original point order inside each cell
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+    def __len__(self):
+        return len(self.points)
+
+    def query(self, center, radius):
+        """
+        Returns the indices of all points in the cells that overlap a
+        circle. The result is a superset of the points within radius,
+        so callers still have to check the exact distance.
+
+        Parameters:
+            center (array-like): Circle center (x, y) in pixels.
+            radius (float): Circle radius in pixels.
+
+        Returns:
+            np.ndarray: Point indices in ascending order, so that they
+                are visited in the same order as a full scan would.
+        """
+        if len(self._keys) == 0:
+            return np.empty(0, dtype=np.intp)
+
+        center = np.asarray(center, dtype=np.float64)
+        low = np.floor((center - radius) / self.cell_size).astype(np.int64)
+        high = np.floor((center + radius) / self.cell_size).astype(np.int64)
+        low -= self._origin
+        high -= self._origin
+        col_low = max(int(low[0]), 0)
+        col_high = min(int(high[0]), self._cols - 1)
+        row_low = max(int(low[1]), 0)
+        if col_low > col_high:
+            return np.empty(0, dtype=np.intp)
+
+        chunks = []
+        for row in range(row_low, int(high[1]) + 1):
+            # The cells of one row are next to each other in key order
+            first = np.searchsorted(self._keys, row * self._cols + col_low, "left")
+            last = np.searchsorted(self._keys, row * self._cols + col_high, "right")
+            if last > first:
+                chunks.append(self._order[first:last])
+
+        if not chunks:
+            return np.empty(0, dtype=np.intp)
+        return np.sort(np.concatenate(chunks))
@@ -0,0 +1,218 @@
+import cv2
+import numpy as np
+
+from boundary_grid import BoundaryGrid, stack_contour_points
+from frame_buffers import FrameBuffers
+from stage_timer import NULL_TIMER
+
+
+class BoundaryMap:
+    """
+    Cache of the yellow lane boundaries. The tape does not move, so the
+    HSV mask, the contours and everything derived from them are built
+    once and reused for every frame. A small subsampled grayscale copy
+    of the frame is compared with the one from the last build, and the
+    map is only rebuilt when a large part of the image has changed
+    (track moved, lighting changed) or when a refresh is requested.
+
+    The areas around the cars' markers are ignored by the change
+    detection, and on a rebuild the old mask is kept there so a car
+    standing on the tape does not cut a hole in the boundary.
+
+    The change check writes into reused buffers, so a frame that does
+    not rebuild the map allocates no images.
+
+    The boundaries can be segmented on a smaller level of an image
+    pyramid (each level halves the width and height) and their points
+    scaled back to full resolution. Steering only needs them to within
+    a few pixels, so this makes a rebuild several times cheaper. The
+    markers are not affected, they are detected on the full frame.
+
+    Parameters:
+        lower (np.ndarray): Lower HSV bound of the boundary color.
+        upper (np.ndarray): Upper HSV bound of the boundary color.
+        cell_size (float): Cell size of the BoundaryGrid, should be the
+            largest search radius.
+        sample_step (int): Pixel step used to subsample the frame for
+            change detection.
+        pixel_delta (int): Gray level difference for a sampled pixel to
+            count as changed.
+        change_fraction (float): Fraction of sampled pixels that must
+            change to rebuild the map.
+        marker_padding (float): How much the marker outline is scaled
+            up to cover the whole car.
+        level (int): Pyramid level the boundaries are segmented on, 0
+            for full resolution, 1 for half, 2 for a quarter.
+        check_interval (int): Only check for changes on every
+            check_interval-th frame. A requested refresh is not delayed.
+    """
+
+    def __init__(self, lower, upper, cell_size, sample_step=8, pixel_delta=25,
+                 change_fraction=0.25, marker_padding=2.5, level=0,
+                 check_interval=1):
+        self.lower = np.asarray(lower)
+        self.upper = np.asarray(upper)
+        self.cell_size = cell_size
+        self.sample_step = sample_step
+        self.pixel_delta = pixel_delta
+        self.change_fraction = change_fraction
+        self.marker_padding = marker_padding
+        self.level = level
+        self.check_interval = check_interval
+
+        # Boundary mask and distance field at the pyramid level
+        self.mask = None
+        self.contours = ()
+        self.points = np.empty((0, 2), dtype=np.int32)
+        self.grid = BoundaryGrid(self.points, cell_size)
+        self.distance = None
+        self.builds = 0
+        self._reference = None
+        self._refresh_requested = True
+        self._frames = 0
+        self._buffers = FrameBuffers()
+
+    def request_refresh(self):
+        """
+        Forces the map to be rebuilt on the next call to update.
+        """
+        self._refresh_requested = True
+
+    def update(self, frame, marker_corners=(), timer=NULL_TIMER):
+        """
+        Rebuilds the map from the frame if it has changed enough or a
+        refresh was requested, otherwise keeps the cached map.
+
+        Parameters:
+            frame (np.ndarray): BGR camera frame.
+            marker_corners (sequence of np.ndarray): Corners of the
+                markers in the frame, each with shape (4, 2).
+            timer (StageTimer, optional): Records the time of the change
+                check and of each step of a rebuild.
+
+        Returns:
+            bool: True if the map was rebuilt.
+        """
+        self._frames += 1
+        if (not self._refresh_requested
+                and self._frames % max(1, self.check_interval)):
+            return False
+        with timer.measure("boundary_check"):
+            sample = self._sample(frame)
+            changed = self._refresh_requested or self._changed(
+                sample, marker_corners)
+        if not changed:
+            return False
+
+        self._build(frame, marker_corners, timer)
+        self._reference = sample
+        self._refresh_requested = False
+        return True
+
+    def clearance(self, point):
+        """
+        Distance in pixels from a point to the nearest boundary pixel,
+        read from the distance field. Points outside the image get 0.
+        Above pyramid level 0 the distance is only known to within
+        2**level pixels, and the smallest possible value is returned.
+
+        Parameters:
+            point (array-like): Image coordinates (x, y).
+
+        Returns:
+            float: Distance to the closest boundary, infinity if there
+                is no boundary in the map.
+        """
+        if self.distance is None:
+            return float('inf')
+        factor = 2 ** self.level
+        x, y = int(point[0]) // factor, int(point[1]) // factor
+        height, width = self.distance.shape
+        if not (0 <= x < width and 0 <= y < height):
+            return 0.0
+        return max(0.0, float(self.distance[y, x]) * factor - (factor - 1))
+
+    def _sample(self, frame):
+        step = self.sample_step
+        strided = frame[::step, ::step]
+        small = self._buffers.get("sample_bgr", strided.shape, frame.dtype)
+        np.copyto(small, strided)
+        # Two buffers take turns, the other one may hold the reference
+        name = "sample_a"
+        if self._reference is self._buffers.get(name, small.shape[:2]):
+            name = "sample_b"
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY,
+                            dst=self._buffers.get(name, small.shape[:2]))
+
+    def _car_mask(self, shape, marker_corners, scale=1.0, out=None):
+        if out is None:
+            cars = np.zeros(shape, dtype=np.uint8)
+        else:
+            cars = out
+            cars.fill(0)
+        for corners in marker_corners:
+            corners = np.asarray(corners, dtype=np.float32).reshape(4, 2)
+            center = corners.mean(axis=0)
+            outline = ((corners - center) * self.marker_padding + center) * scale
+            cv2.fillConvexPoly(cars, np.round(outline).astype(np.int32), 255)
+        return cars
+
+    def _changed(self, sample, marker_corners):
+        if self._reference is None or self._reference.shape != sample.shape:
+            return True
+        buffer = self._buffers.get
+        ignored = self._car_mask(sample.shape, marker_corners,
+                                 1 / self.sample_step,
+                                 out=buffer("ignored", sample.shape))
+        counted = cv2.bitwise_not(ignored, dst=buffer("counted", sample.shape))
+        diff = cv2.absdiff(sample, self._reference,
+                           dst=buffer("diff", sample.shape))
+        changed = cv2.compare(diff, self.pixel_delta, cv2.CMP_GT,
+                              dst=buffer("changed", sample.shape))
+        cv2.bitwise_and(changed, counted, dst=changed)
+        total = cv2.countNonZero(counted)
+        if total == 0:
+            return False
+        return cv2.countNonZero(changed) / total > self.change_fraction
+
+    def _downscale(self, frame):
+        for level in range(1, self.level + 1):
+            height, width = frame.shape[:2]
+            shape = ((height + 1) // 2, (width + 1) // 2) + frame.shape[2:]
+            frame = cv2.pyrDown(frame, dst=self._buffers.get(f"level{level}",
+                                                             shape))
+        return frame
+
+    def _build(self, frame, marker_corners, timer=NULL_TIMER):
+        factor = 2 ** self.level
+        with timer.measure("hsv_inrange"):
+            small = self._downscale(frame)
+            cars = self._car_mask(small.shape[:2], marker_corners, 1 / factor)
+            hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV,
+                               dst=self._buffers.get("hsv", small.shape))
+            mask = cv2.inRange(hsv, self.lower, self.upper)
+            if self.mask is not None and self.mask.shape == mask.shape:
+                # Keep the old boundary under the cars
+                covered = cars > 0
+                mask[covered] = self.mask[covered]
+
+        self.mask = mask
+        with timer.measure("find_contours"):
+            contours, _ = cv2.findContours(
+                mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            if factor > 1:
+                # Back to full resolution, at the pixel nearest the
+                # middle of the ones a downscaled pixel covers: the top
+                # left of them for factor 2, so up to a pixel off
+                contours = tuple(contour * factor + (factor - 1) // 2
+                                 for contour in contours)
+            self.contours = contours
+            self.points = stack_contour_points(self.contours)
+        with timer.measure("boundary_index"):
+            self.grid = BoundaryGrid(self.points, self.cell_size)
+            if len(self.points):
+                self.distance = cv2.distanceTransform(
+                    cv2.bitwise_not(mask), cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+            else:
+                self.distance = None
+        self.builds += 1
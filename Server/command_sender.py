@@ -0,0 +1,386 @@
+import selectors
+import socket
+import threading
+import time
+
+from stage_timer import NULL_TIMER
+
+
+def encode_text(vehicle_id, sequence, capture_time, angle):
+    """
+    Encodes a servo angle as a newline terminated text line. The
+    vehicle id, sequence number and capture time are not sent.
+    """
+    return (str(angle) + "\n").encode()
+
+
+class _Peer:
+    """
+    Send state of one vehicle: the newest angle waiting to be sent and
+    the bytes the socket has not accepted yet. Peers with an address
+    are sent datagrams on a shared UDP socket.
+    """
+    __slots__ = ("sock", "address", "pending", "buffer", "value", "sequence",
+                 "last_send", "last_seen", "stalled_since", "events")
+
+    def __init__(self, sock, address=None):
+        self.sock = sock
+        self.address = address
+        self.pending = None
+        self.sequence = 0
+        self.buffer = bytearray()
+        self.value = None
+        self.last_send = 0.0
+        # When the vehicle was last perceived (time.monotonic())
+        self.last_seen = None
+        self.stalled_since = None
+        # Selector events the socket is registered for
+        self.events = 0
+
+
+class CommandSender(threading.Thread):
+    """
+    Sends servo commands to the vehicles from a background thread so
+    that a slow or dead connection can never block the frame loop.
+
+    Every vehicle has one slot holding the newest angle. The frame loop
+    only posts into the slot, and a newer angle replaces one that has
+    not been sent yet. The sender thread writes each slot at most once
+    every send_interval seconds using non-blocking sockets. A vehicle
+    whose socket has not accepted its data for stall_timeout seconds,
+    or whose connection fails or is closed, is dropped. Data the
+    vehicles send back over TCP is passed to on_receive.
+
+    Parameters:
+        send_interval (float): Minimum time between two messages to the
+            same vehicle (seconds).
+        encode (callable): Turns a command into the bytes to send, called
+            as encode(vehicle_id, sequence, capture_time, angle).
+        stall_timeout (float): How long a vehicle may leave data unread
+            before it is dropped (seconds).
+        on_sent (callable, optional): Called as on_sent(vehicle_id,
+            sequence, capture_time, angle, send_time) after a command was
+            handed to the socket. send_time is time.monotonic().
+        on_drop (callable, optional): Called as on_drop(vehicle_id,
+            reason, sock) after a vehicle was dropped, sock being the
+            socket it was registered with.
+        on_receive (callable, optional): Called as on_receive(vehicle_id,
+            data) with the bytes a vehicle sent over TCP.
+        keepalive (float, optional): Send the last angle again if no
+            new one was sent for this long (seconds), so the vehicle can
+            tell a steady angle from a lost server. Repeated commands get
+            a capture time of 0.0, as they are not based on a new frame.
+        keepalive_limit (float, optional): Only repeat the last angle
+            while the vehicle was posted an angle or marked as seen
+            within this long (seconds). A vehicle that is no longer
+            perceived then stops hearing from the server, and its own
+            command timeout stops it. No limit if None.
+        timer (StageTimer, optional): Records the time of every socket
+            write as stage socket_send. Can be set later as timer.
+    """
+
+    def __init__(self, send_interval, encode=encode_text, stall_timeout=1.0,
+                 on_sent=None, on_drop=None, on_receive=None, keepalive=None,
+                 keepalive_limit=None, timer=NULL_TIMER):
+        super().__init__(name="command-sender", daemon=True)
+        self.send_interval = send_interval
+        self.encode = encode
+        self.stall_timeout = stall_timeout
+        self.on_sent = on_sent
+        self.on_drop = on_drop
+        self.on_receive = on_receive
+        self.keepalive = keepalive
+        self.keepalive_limit = keepalive_limit
+        self.timer = timer
+
+        self._lock = threading.Lock()
+        self._peers = {}
+        # Replaced or removed peers, closed by the sender thread
+        self._retired = []
+        self._selector = selectors.DefaultSelector()
+        self._wake_read, self._wake_write = socket.socketpair()
+        self._wake_read.setblocking(False)
+        self._wake_write.setblocking(False)
+        self._selector.register(self._wake_read, selectors.EVENT_READ)
+        self._stopped = threading.Event()
+        self.stats = {"posted": 0, "sent": 0, "coalesced": 0, "dropped": 0,
+                      "keepalives": 0}
+
+    def register(self, vehicle_id, sock, address=None):
+        """
+        Adds a vehicle's socket. A different socket already registered
+        for the same vehicle is replaced and closed. Registering the
+        same socket again keeps the vehicle's send state, including its
+        sequence numbers, and only updates the address: a UDP vehicle
+        repeats its hello whenever commands stop arriving, and would
+        drop every command numbered below the ones it already saw.
+
+        Parameters:
+            vehicle_id (int): ID of the vehicle.
+            sock (socket.socket): Connected TCP socket, or the server's
+                UDP socket if address is given. A UDP socket is shared
+                and never closed by the sender.
+            address (tuple, optional): The vehicle's UDP address.
+
+        Returns:
+            bool: True if the vehicle was not registered with this
+                socket and address before.
+        """
+        if address is None:
+            sock.setblocking(False)
+        with self._lock:
+            old = self._peers.get(vehicle_id)
+            if old is not None and old.sock is sock:
+                changed = old.address != address
+                old.address = address
+                return changed
+            self._peers[vehicle_id] = _Peer(sock, address)
+            if old is not None:
+                self._retired.append(old)
+        self._wake()
+        return True
+
+    def unregister(self, vehicle_id):
+        """
+        Removes a vehicle and closes its socket.
+        """
+        with self._lock:
+            peer = self._peers.pop(vehicle_id, None)
+            if peer is not None:
+                self._retired.append(peer)
+        self._wake()
+
+    def post(self, vehicle_id, angle, capture_time=0.0):
+        """
+        Stores the newest angle for a vehicle, never blocks.
+
+        Parameters:
+            vehicle_id (int): ID of the vehicle.
+            angle (int): Servo angle.
+            capture_time (float): time.time() when the frame the angle
+                is based on was captured.
+
+        Returns:
+            bool: False if the vehicle is not registered.
+        """
+        with self._lock:
+            peer = self._peers.get(vehicle_id)
+            if peer is None:
+                return False
+            if peer.pending is not None:
+                self.stats["coalesced"] += 1
+            peer.pending = (angle, capture_time)
+            peer.last_seen = time.monotonic()
+            self.stats["posted"] += 1
+        self._wake()
+        return True
+
+    def seen(self, vehicle_ids):
+        """
+        Notes that vehicles were perceived, so their last angle may
+        still be repeated (see keepalive_limit). Never blocks.
+
+        Parameters:
+            vehicle_ids (iterable of int): IDs of the perceived vehicles.
+        """
+        now = time.monotonic()
+        returned = False
+        with self._lock:
+            for vehicle_id in vehicle_ids:
+                peer = self._peers.get(vehicle_id)
+                if peer is None:
+                    continue
+                if (self.keepalive_limit is not None
+                        and (peer.last_seen is None
+                             or now - peer.last_seen > self.keepalive_limit)):
+                    returned = True
+                peer.last_seen = now
+        if returned:
+            # Its keepalives are not scheduled while it was gone
+            self._wake()
+
+    def connected(self):
+        """
+        Returns the IDs of the registered vehicles.
+        """
+        with self._lock:
+            return list(self._peers)
+
+    def stop(self):
+        """
+        Stops the sender thread and closes every vehicle socket.
+        """
+        self._stopped.set()
+        self._wake()
+        if self.is_alive():
+            self.join(timeout=2.0)
+        with self._lock:
+            peers = list(self._peers.values()) + self._retired
+            self._peers.clear()
+            self._retired = []
+        for peer in peers:
+            self._retire(peer)
+        self._selector.close()
+        self._wake_read.close()
+        self._wake_write.close()
+
+    def run(self):
+        while not self._stopped.is_set():
+            timeout = self._service(time.monotonic())
+            for key, events in self._selector.select(timeout):
+                if key.fileobj is self._wake_read:
+                    try:
+                        while self._wake_read.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                elif events & selectors.EVENT_READ:
+                    self._receive(*key.data)
+                # Writable vehicles are flushed by the next _service
+
+    def _wake(self):
+        try:
+            self._wake_write.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # Already woken, or stopped
+
+    def _service(self, now):
+        """
+        Sends every slot that is due and flushes waiting data. Returns
+        how long the thread may sleep before something is due.
+        """
+        with self._lock:
+            peers = list(self._peers.items())
+            retired, self._retired = self._retired, []
+        for peer in retired:
+            self._retire(peer)
+
+        wait = None
+        for vehicle_id, peer in peers:
+            if peer.address is None and not peer.events:
+                # Watch new TCP vehicles for replies and disconnects
+                self._selector.register(peer.sock, selectors.EVENT_READ,
+                                        (vehicle_id, peer))
+                peer.events = selectors.EVENT_READ
+            if peer.buffer:
+                self._flush(vehicle_id, peer, now)
+                if peer.buffer:
+                    deadline = peer.stalled_since + self.stall_timeout - now
+                    if deadline <= 0:
+                        self._drop(vehicle_id, peer, "stalled")
+                    else:
+                        wait = deadline if wait is None else min(wait, deadline)
+                    continue
+
+            with self._lock:
+                if peer.pending is None:
+                    if self.keepalive is None or peer.value is None:
+                        continue
+                    if (self.keepalive_limit is not None
+                            and (peer.last_seen is None
+                                 or now - peer.last_seen
+                                 > self.keepalive_limit)):
+                        continue
+                    due = peer.last_send + self.keepalive - now
+                    if due > 0:
+                        wait = due if wait is None else min(wait, due)
+                        continue
+                    angle, capture_time = peer.value[2], 0.0
+                    self.stats["keepalives"] += 1
+                else:
+                    due = peer.last_send + self.send_interval - now
+                    if due > 0:
+                        wait = due if wait is None else min(wait, due)
+                        continue
+                    angle, capture_time = peer.pending
+                    peer.pending = None
+
+            peer.sequence += 1
+            peer.buffer += self.encode(vehicle_id, peer.sequence,
+                                       capture_time, angle)
+            peer.value = (peer.sequence, capture_time, angle)
+            peer.last_send = now
+            self._flush(vehicle_id, peer, now)
+            if self.keepalive is not None:
+                # Wake up for the next keepalive even if nothing is posted
+                wait = (self.keepalive if wait is None
+                        else min(wait, self.keepalive))
+        return wait
+
+    def _flush(self, vehicle_id, peer, now):
+        if peer.address is not None:
+            # A datagram that does not fit is dropped, the next one
+            # carries a newer angle anyway
+            try:
+                with self.timer.measure("socket_send"):
+                    peer.sock.sendto(peer.buffer, peer.address)
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as e:
+                self._drop(vehicle_id, peer, str(e))
+                return
+            peer.buffer.clear()
+        else:
+            try:
+                with self.timer.measure("socket_send"):
+                    sent = peer.sock.send(peer.buffer)
+                del peer.buffer[:sent]
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as e:
+                self._drop(vehicle_id, peer, str(e))
+                return
+
+        if peer.buffer:
+            if peer.stalled_since is None:
+                peer.stalled_since = now
+            self._watch(vehicle_id, peer,
+                        selectors.EVENT_READ | selectors.EVENT_WRITE)
+            return
+
+        peer.stalled_since = None
+        self._watch(vehicle_id, peer, selectors.EVENT_READ)
+        self.stats["sent"] += 1
+        if self.on_sent is not None:
+            self.on_sent(vehicle_id, *peer.value, now)
+
+    def _watch(self, vehicle_id, peer, events):
+        if peer.address is None and peer.events != events:
+            self._selector.modify(peer.sock, events, (vehicle_id, peer))
+            peer.events = events
+
+    def _receive(self, vehicle_id, peer):
+        try:
+            data = peer.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._drop(vehicle_id, peer, str(e))
+            return
+        if not data:
+            self._drop(vehicle_id, peer, "connection closed")
+        elif self.on_receive is not None:
+            self.on_receive(vehicle_id, data)
+
+    def _drop(self, vehicle_id, peer, reason):
+        with self._lock:
+            current = self._peers.get(vehicle_id) is peer
+            if current:
+                del self._peers[vehicle_id]
+        self._retire(peer)
+        # A peer replaced in the meantime is not reported
+        if current:
+            self.stats["dropped"] += 1
+            if self.on_drop is not None:
+                self.on_drop(vehicle_id, reason, peer.sock)
+
+    def _retire(self, peer):
+        if peer.address is not None:
+            return  # The shared UDP socket stays open
+        if peer.events:
+            try:
+                self._selector.unregister(peer.sock)
+            except (KeyError, ValueError):
+                pass
+            peer.events = 0
+        peer.sock.close()
@@ -0,0 +1,77 @@
+import json
+
+import cv2.aruco as aruco
+
+# Names for cornerRefinementMethod in the settings files
+CORNER_REFINE_METHODS = {
+    "none": aruco.CORNER_REFINE_NONE,
+    "subpix": aruco.CORNER_REFINE_SUBPIX,
+    "contour": aruco.CORNER_REFINE_CONTOUR,
+    "apriltag": aruco.CORNER_REFINE_APRILTAG,
+}
+
+
+def make_detector_parameters(settings=None):
+    """
+    Creates aruco.DetectorParameters with the OpenCV defaults replaced
+    by the given settings.
+
+    Parameters:
+        settings (dict, optional): Values by DetectorParameters field
+            name, e.g. {"adaptiveThreshWinSizeMax": 13}. The corner
+            refinement method may be given by its name in
+            CORNER_REFINE_METHODS.
+
+    Returns:
+        aruco.DetectorParameters: The parameters.
+
+    Raises:
+        ValueError: If a field or refinement method does not exist.
+    """
+    parameters = aruco.DetectorParameters()
+    for name, value in (settings or {}).items():
+        if not hasattr(parameters, name):
+            raise ValueError(f"DetectorParameters has no field {name}")
+        if name == "cornerRefinementMethod" and isinstance(value, str):
+            if value not in CORNER_REFINE_METHODS:
+                raise ValueError(f"Unknown corner refinement {value}, "
+                                 f"one of {', '.join(CORNER_REFINE_METHODS)}")
+            value = CORNER_REFINE_METHODS[value]
+        # Keep the field's type, JSON may give 4.0 for an int field
+        setattr(parameters, name, type(getattr(parameters, name))(value))
+    return parameters
+
+def load_detector_settings(path):
+    """
+    Reads the detector settings written by save_detector_settings.
+
+    Returns:
+        dict: Values by DetectorParameters field name, see
+            make_detector_parameters.
+    """
+    with open(path) as f:
+        return dict(json.load(f)["parameters"])
+
+def save_detector_settings(path, settings, measured=None, source=None):
+    """
+    Writes detector settings to a JSON file:
+
+        {"parameters": {"adaptiveThreshWinSizeMax": 13, ...},
+         "measured": {"recall": 0.99, ...},
+         "source": "simulated frames"}
+
+    Parameters:
+        path (str): File to write.
+        settings (dict): Values by DetectorParameters field name.
+        measured (dict, optional): What the settings achieved, kept for
+            reference only.
+        source (str, optional): What they were measured on.
+    """
+    document = {"parameters": settings}
+    if measured is not None:
+        document["measured"] = measured
+    if source is not None:
+        document["source"] = source
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+        f.write("\n")
@@ -0,0 +1,34 @@
+import numpy as np
+
+
+class FrameBuffers:
+    """
+    Named images that are reused for every frame, so converting a frame
+    (grayscale, HSV, masks) writes into memory that already exists
+    instead of allocating new arrays. Pass a buffer to OpenCV with its
+    dst= argument. A buffer is only allocated again when the frame size
+    changes.
+
+    Not thread safe: every thread that processes frames needs its own.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        """
+        Returns the buffer with the given name, shape and dtype. Its
+        content is whatever the last user left in it.
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(shape, dtype=dtype)
+            self.allocations += 1
+        return buffer
+
+    def nbytes(self):
+        """
+        Total size of all buffers in bytes.
+        """
+        return sum(buffer.nbytes for buffer in self._buffers.values())
@@ -0,0 +1,206 @@
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+
+class FrameRing:
+    """
+    Ring of preallocated frame slots in shared memory. One process
+    writes frames into the slots in turn and the others read them as
+    NumPy views of the same memory, so a frame is never pickled or
+    copied on its way between processes.
+
+    Every slot has a sequence number: -1 while it is being written,
+    otherwise the number of the frame it holds. A reader that keeps a
+    view can call valid() afterwards to check that the slot was not
+    reused meanwhile, which happens slots - 1 frames later at the
+    earliest.
+
+    Parameters:
+        shape (tuple): Shape of one frame, e.g. (480, 640, 3).
+        slots (int): Number of frames kept.
+        dtype: NumPy dtype of the frames.
+        name (str, optional): Attach to the ring with this name, made by
+            another process, instead of creating a new one.
+    """
+
+    def __init__(self, shape, slots=8, dtype=np.uint8, name=None):
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.dtype = np.dtype(dtype)
+        header = 64 * ((16 * slots + 63) // 64)  # Keep the frames aligned
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._owner = name is None
+        self._memory = shared_memory.SharedMemory(
+            name=name, create=self._owner, size=header + slots * frame_bytes)
+        buffer = self._memory.buf
+        self._sequences = np.ndarray((slots,), np.int64, buffer, 0)
+        self._times = np.ndarray((slots,), np.float64, buffer, 8 * slots)
+        self._frames = np.ndarray((slots,) + self.shape, self.dtype, buffer,
+                                  header)
+        if self._owner:
+            self._sequences[:] = -1
+        self._next = 0
+
+    @property
+    def name(self):
+        return self._memory.name
+
+    def write_slot(self):
+        """
+        Returns (index, view) of the slot to write the next frame into.
+        Call publish(index, capture_time) once the frame is complete.
+        """
+        index = self._next % self.slots
+        self._sequences[index] = -1
+        return index, self._frames[index]
+
+    def publish(self, index, capture_time):
+        """
+        Makes the frame in a slot visible to readers. Returns its
+        sequence number.
+        """
+        sequence = self._next
+        self._times[index] = capture_time
+        self._sequences[index] = sequence
+        self._next += 1
+        return sequence
+
+    def get(self, sequence):
+        """
+        Returns (capture_time, view) of a frame, or None if its slot
+        has already been reused.
+        """
+        index = sequence % self.slots
+        capture_time = self._times[index]
+        if self._sequences[index] != sequence:
+            return None
+        return float(capture_time), self._frames[index]
+
+    def valid(self, sequence):
+        """
+        True if the frame is still in its slot.
+        """
+        return self._sequences[sequence % self.slots] == sequence
+
+    def close(self):
+        """
+        Releases the ring, and frees it if this process created it.
+        Views of the frames must not be used afterwards.
+        """
+        self._sequences = self._times = self._frames = None
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
+
+
+def capture_worker(source, ring_name, shape, slots, notify, stop):
+    """
+    Entry point of the capture process. Reads frames with
+    cap.read(image=...) straight into the ring's slots and sends each
+    frame's sequence number through notify, then None at the end.
+
+    Parameters:
+        source (int or str): cv2.VideoCapture source.
+        ring_name (str): Name of the FrameRing to write into.
+        shape (tuple): Frame shape of the ring.
+        slots (int): Number of slots of the ring.
+        notify (multiprocessing.connection.Connection): Where the
+            sequence numbers go.
+        stop (multiprocessing.Event): Set to stop the process.
+    """
+    ring = FrameRing(shape, slots, name=ring_name)
+    cap = cv2.VideoCapture(source)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, shape[1])
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, shape[0])
+    try:
+        while not stop.is_set():
+            index, slot = ring.write_slot()
+            ret, image = cap.read(image=slot)
+            if not ret:
+                break
+            if image is not slot:
+                print(f"Camera frames are {image.shape}, expected {shape}")
+                break
+            notify.send(ring.publish(index, time.time()))
+    finally:
+        notify.send(None)
+        cap.release()
+        ring.close()
+
+
+class CaptureProcess:
+    """
+    Reads a camera in its own process into a FrameRing. read() returns
+    a view of the newest frame without copying it. The capture process
+    overwrites the view once the ring comes round to its slot, so call
+    valid() with its sequence number after using it, and drop what was
+    computed from it if that returns False.
+
+    Parameters:
+        source (int or str): cv2.VideoCapture source.
+        shape (tuple): Frame shape (height, width, 3) the camera is set to.
+        slots (int): Number of frames kept, a returned view stays valid
+            for at least slots - 1 frame times.
+    """
+
+    def __init__(self, source, shape, slots=8):
+        self.ring = FrameRing(shape, slots)
+        self._context = multiprocessing.get_context("spawn")
+        self._receive, send = self._context.Pipe(duplex=False)
+        self._stop = self._context.Event()
+        self.process = self._context.Process(
+            target=capture_worker, name="capture", daemon=True,
+            args=(source, self.ring.name, shape, slots, send, self._stop))
+        self.skipped = 0
+
+    def start(self):
+        self.process.start()
+
+    def read(self, timeout=5.0):
+        """
+        Waits for a new frame and returns (capture_time, frame,
+        sequence) of the newest one. Frames that arrived since the last
+        call and are older are skipped.
+
+        Raises:
+            EOFError: If the camera or video has ended.
+        """
+        while True:
+            if not self._receive.poll(timeout):
+                raise EOFError("No frame from the capture process")
+            sequence = self._receive.recv()
+            while sequence is not None and self._receive.poll():
+                sequence = self._receive.recv()
+                self.skipped += 1
+            if sequence is None:
+                raise EOFError("Capture ended")
+            frame = self.ring.get(sequence)
+            if frame is not None:
+                return frame + (sequence,)
+
+    def valid(self, sequence):
+        """
+        True if the frame read as sequence has not been overwritten.
+        """
+        return self.ring.valid(sequence)
+
+    def stop(self):
+        """
+        Stops the capture process and frees the ring.
+        """
+        self._stop.set()
+        try:
+            # Let a process blocked on a full pipe finish
+            while self.process.is_alive() and self._receive.poll(0.1):
+                self._receive.recv()
+        except (EOFError, OSError):
+            pass  # The process has closed its end
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.ring.close()
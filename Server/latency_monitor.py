@@ -0,0 +1,222 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class RollingHistogram:
+    """
+    Histogram of the last window samples with fixed width bins. Adding
+    a sample and reading a percentile cost the same no matter how many
+    samples were recorded before.
+
+    Parameters:
+        bin_width (float): Width of one bin (seconds).
+        max_value (float): Samples above this all go into the last bin.
+        window (int): Number of most recent samples kept.
+    """
+
+    def __init__(self, bin_width=0.001, max_value=1.0, window=500):
+        self.bin_width = bin_width
+        self.counts = np.zeros(int(np.ceil(max_value / bin_width)) + 1,
+                               dtype=np.int64)
+        self._bins = deque(maxlen=window)
+
+    def __len__(self):
+        return len(self._bins)
+
+    def add(self, value):
+        """
+        Adds a sample, dropping the oldest one if the window is full.
+        Negative values count as 0.
+        """
+        index = min(max(int(value / self.bin_width), 0), len(self.counts) - 1)
+        if len(self._bins) == self._bins.maxlen:
+            self.counts[self._bins[0]] -= 1
+        self._bins.append(index)
+        self.counts[index] += 1
+
+    def percentile(self, p):
+        """
+        Returns the upper edge of the bin holding the p-th percentile,
+        or None if there are no samples.
+        """
+        total = len(self._bins)
+        if total == 0:
+            return None
+        rank = max(1, int(np.ceil(p / 100 * total)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return (index + 1) * self.bin_width
+
+
+class ClockOffsetEstimator:
+    """
+    Estimates the offset between the server's and a vehicle's clock from
+    request/reply pairs, like NTP. With the server sending at t0, the
+    vehicle receiving the request at t1 and replying at t2, and the
+    server receiving the reply at t3, the offset is
+    (t1 + t2) / 2 - (t0 + t3) / 2 if both directions take the same
+    time, and the round trip t3 - t0 - (t2 - t1). Of the recent samples
+    the one with the shortest round trip is used, since it had the
+    least room for uneven delays.
+
+    Parameters:
+        window (int): Number of recent samples to choose from.
+    """
+
+    def __init__(self, window=64):
+        self._samples = deque(maxlen=window)
+
+    def add(self, send_time, remote_time, receive_time, remote_hold=0.0):
+        """
+        Adds one exchange, all times in seconds. remote_time is t2 and
+        remote_hold is t2 - t1, the time the vehicle held the request.
+        """
+        rtt = receive_time - send_time - remote_hold
+        offset = (remote_time - remote_hold / 2
+                  - (send_time + receive_time) / 2)
+        self._samples.append((rtt, offset))
+
+    @property
+    def offset(self):
+        """
+        Vehicle clock minus server clock (seconds), None before the
+        first sample.
+        """
+        if not self._samples:
+            return None
+        return min(self._samples)[1]
+
+    @property
+    def rtt(self):
+        """
+        Shortest recent round trip time (seconds).
+        """
+        if not self._samples:
+            return None
+        return min(self._samples)[0]
+
+
+class _VehicleLatency:
+    def __init__(self, window):
+        self.sent = {}  # sequence -> (capture_time, send_time)
+        self.clock = ClockOffsetEstimator()
+        self.end_to_end = RollingHistogram(window=window)
+        self.server = RollingHistogram(window=window)
+        self.link = RollingHistogram(window=window)
+
+
+class LatencyMonitor:
+    """
+    Measures the time from camera capture to the servo being set on
+    each vehicle. Every sent command is remembered by its sequence
+    number, and when the vehicle acknowledges it, the vehicle's apply
+    time is moved to the server clock with the estimated clock offset.
+
+    Three rolling histograms are kept per vehicle: end_to_end (capture
+    to servo set), server (capture to send) and link (send to servo
+    set). All times are time.time() values in seconds.
+
+    Parameters:
+        window (int): Number of recent commands in each histogram.
+        pending_limit (int): Unacknowledged commands kept per vehicle.
+    """
+
+    def __init__(self, window=500, pending_limit=256):
+        self.window = window
+        self.pending_limit = pending_limit
+        self._lock = threading.Lock()
+        self._vehicles = {}
+
+    def record_send(self, vehicle_id, sequence, capture_time, send_time):
+        """
+        Remembers a command that was sent.
+        """
+        with self._lock:
+            vehicle = self._vehicles.get(vehicle_id)
+            if vehicle is None:
+                vehicle = self._vehicles[vehicle_id] = _VehicleLatency(self.window)
+            vehicle.sent[sequence] = (capture_time, send_time)
+            if len(vehicle.sent) > self.pending_limit:
+                # Dicts keep insertion order, drop the oldest
+                del vehicle.sent[next(iter(vehicle.sent))]
+
+    def record_ack(self, vehicle_id, sequence, applied_time, receive_time,
+                   hold_time=0.0):
+        """
+        Handles a vehicle's acknowledgement of a command.
+
+        Parameters:
+            vehicle_id (int): ID of the vehicle.
+            sequence (int): Sequence number of the applied command.
+            applied_time (float): Vehicle clock when the servo was set.
+            receive_time (float): Server clock when the ack arrived.
+            hold_time (float): Time from the vehicle receiving the
+                command to applied_time (seconds), from the ACK.
+                Left out of the clock offset, which is otherwise off by
+                half of it.
+
+        Returns:
+            float or None: End to end latency of the command, None if
+                the command is unknown or a keepalive.
+        """
+        with self._lock:
+            vehicle = self._vehicles.get(vehicle_id)
+            if vehicle is None or sequence not in vehicle.sent:
+                return None
+            capture_time, send_time = vehicle.sent.pop(sequence)
+            vehicle.clock.add(send_time, applied_time, receive_time,
+                              hold_time)
+            applied = applied_time - vehicle.clock.offset
+            vehicle.link.add(applied - send_time)
+            if capture_time <= 0:
+                return None  # Keepalive, not based on a frame
+            latency = applied - capture_time
+            vehicle.end_to_end.add(latency)
+            vehicle.server.add(send_time - capture_time)
+            return latency
+
+    def forget(self, vehicle_id):
+        """
+        Drops everything recorded for a vehicle.
+        """
+        with self._lock:
+            self._vehicles.pop(vehicle_id, None)
+
+    def summary(self, percentiles=(50, 95, 99)):
+        """
+        Returns a dict per vehicle with the clock offset and shortest
+        round trip in milliseconds, and the percentiles of every
+        histogram in milliseconds.
+        """
+        report = {}
+        with self._lock:
+            for vehicle_id, vehicle in self._vehicles.items():
+                if len(vehicle.end_to_end) == 0:
+                    continue
+                entry = {
+                    "samples": len(vehicle.end_to_end),
+                    "clock_offset_ms": vehicle.clock.offset * 1000,
+                    "rtt_ms": vehicle.clock.rtt * 1000,
+                }
+                for name in ("end_to_end", "server", "link"):
+                    histogram = getattr(vehicle, name)
+                    entry[name] = {f"p{p}_ms": histogram.percentile(p) * 1000
+                                   for p in percentiles}
+                report[vehicle_id] = entry
+        return report
+
+    def format_summary(self):
+        """
+        One line per vehicle with the end to end latency percentiles.
+        """
+        lines = []
+        for vehicle_id, entry in sorted(self.summary().items()):
+            e2e = entry["end_to_end"]
+            lines.append(
+                f"[User {vehicle_id}] camera to servo p50 {e2e['p50_ms']:.0f} ms, "
+                f"p95 {e2e['p95_ms']:.0f} ms, p99 {e2e['p99_ms']:.0f} ms "
+                f"(server {entry['server']['p50_ms']:.0f} ms, "
+                f"link {entry['link']['p50_ms']:.0f} ms, "
+                f"clock offset {entry['clock_offset_ms']:+.1f} ms)")
+        return "\n".join(lines)
@@ -0,0 +1,314 @@
+"""
+Load generator for the command server. Opens a fleet of fake vehicles
+that connect like steering_client.py (send the user ID, then read the
+commands), some of them reading slowly, dropping their connection
+without closing it or reconnecting over and over. Without --server a
+local server is started in this process: the vehicle registry and
+command sender of aruco_edge_detector.py, fed synthetic detections of
+every marker at --fps with a steadily changing angle.
+
+The report shows per group of vehicles the command rate, the jitter of
+the time between commands and the handshake latency (connect to first
+command), and for the local server the time per frame of choosing and
+posting the commands.
+
+Usage:
+    python load_fleet.py [--vehicles 50] [--seconds 10] [--slow 5]
+                         [--disconnect 5] [--storm 10]
+                         [--protocol text] [--server HOST:PORT]
+"""
+import argparse
+import contextlib
+import io
+import math
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+import aruco_edge_detector as detector
+from steering_protocol import COMMAND, MessageReader, pack_ack
+from vehicle_registry import VehicleRegistry
+
+
+class FakeVehicle(threading.Thread):
+    """
+    One fake vehicle. It connects, sends its user ID and reads
+    commands until stop is set, noting when each one arrived. Binary
+    commands are acknowledged like the real client does.
+
+    Parameters:
+        address (tuple): Server (host, port).
+        user (int): User ID, the marker ID.
+        protocol (str): "text" or "binary".
+        read_delay (float): Pause before every read (seconds), and
+            reads of only a few bytes if not 0, for a slow reader.
+        disconnect_at (float, optional): Reset the connection this long
+            after start (seconds) and stay away.
+        reconnect_every (float, optional): Reset the connection and
+            connect again this often (seconds).
+    """
+
+    def __init__(self, address, user, protocol="text", read_delay=0.0,
+                 disconnect_at=None, reconnect_every=None):
+        super().__init__(daemon=True)
+        self.address = address
+        self.user = user
+        self.protocol = protocol
+        self.read_delay = read_delay
+        self.disconnect_at = disconnect_at
+        self.reconnect_every = reconnect_every
+        self.stop = threading.Event()
+        self.arrivals = []
+        self.handshakes = []
+        self.connections = 0
+        self.dropped_by_server = 0
+
+    def run(self):
+        start = time.monotonic()
+        while not self.stop.is_set():
+            end = None
+            if self.disconnect_at is not None:
+                end = start + self.disconnect_at
+            if self.reconnect_every is not None:
+                end = time.monotonic() + self.reconnect_every
+            self._session(end)
+            if self.disconnect_at is not None:
+                break
+
+    def _session(self, end):
+        """
+        One connection, read until end (monotonic), then reset it.
+        """
+        try:
+            sock = socket.create_connection(self.address, timeout=5.0)
+        except OSError:
+            self.stop.wait(0.1)
+            return
+        self.connections += 1
+        connected = time.monotonic()
+        first = True
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.sendall(str(self.user).encode())
+        sock.settimeout(0.1)
+        reader = MessageReader()
+        buffer = b""
+        try:
+            while not self.stop.is_set():
+                if end is not None and time.monotonic() >= end:
+                    break
+                if self.read_delay:
+                    time.sleep(self.read_delay)
+                try:
+                    data = sock.recv(16 if self.read_delay else 65536)
+                except socket.timeout:
+                    continue
+                if not data:
+                    self.dropped_by_server += 1
+                    return
+                now = time.monotonic()
+                if self.protocol == "text":
+                    buffer += data
+                    count = buffer.count(b"\n")
+                    buffer = buffer[buffer.rfind(b"\n") + 1:]
+                    sequences = [None] * count
+                else:
+                    sequences = [message.sequence
+                                 for message in reader.feed(data)
+                                 if message.kind == COMMAND]
+                if sequences and first:
+                    self.handshakes.append(now - connected)
+                    first = False
+                self.arrivals.extend([now] * len(sequences))
+                for sequence in sequences:
+                    if sequence is not None:
+                        sock.sendall(pack_ack(self.user, sequence,
+                                              time.time()))
+        except OSError:
+            self.dropped_by_server += 1
+            return
+        finally:
+            # Reset instead of closing cleanly, like a car losing power
+            with contextlib.suppress(OSError):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                                struct.pack("ii", 1, 0))
+            sock.close()
+
+
+class LocalServer:
+    """
+    The server's vehicle handling from aruco_edge_detector.py, with
+    synthetic detections of every marker instead of the camera. Each
+    frame every marker gets a target whose angle keeps turning, so the
+    vehicles are sent a new servo angle on most frames.
+    """
+
+    def __init__(self, protocol, markers, fps):
+        self.detector = detector
+        self.markers = markers
+        self.fps = fps
+        detector.PROTOCOL = protocol
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(128)
+        self.address = self.listener.getsockname()
+        heartbeat = None
+        if protocol == "binary":
+            heartbeat = detector.HEARTBEAT_TIMEOUT
+        detector.vehicles = VehicleRegistry(
+            self.listener, detector.HANDSHAKE_TIMEOUT, heartbeat,
+            on_connect=detector.register_vehicle,
+            on_disconnect=detector.expire_vehicle, close_sockets=False)
+        self.frame_times = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._frames, daemon=True)
+
+    def start(self):
+        self.detector.vehicles.start()
+        self.detector.command_sender.start()
+        self._thread.start()
+
+    def _frames(self):
+        detector = self.detector
+        period = 1 / self.fps
+        next_frame = time.monotonic()
+        frame = 0
+        while not self._stop.is_set():
+            start = time.perf_counter()
+            targets = []
+            for marker_id in range(self.markers):
+                # Boundary point 50 px away at a slowly turning angle
+                angle = 60 * math.sin(frame / 15 + marker_id)
+                targets.append(detector.Target(marker_id, np.zeros(2),
+                                               np.zeros(2, dtype=np.int32),
+                                               angle, 50.0, 90.0))
+            commands = detector.choose_commands(targets)
+            detector.send_commands(detector.Perception(
+                None, time.time(), (), None, targets, commands))
+            self.frame_times.append(time.perf_counter() - start)
+            frame += 1
+            next_frame += period
+            self._stop.wait(max(0.0, next_frame - time.monotonic()))
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.detector.vehicles.stop()
+        self.detector.command_sender.stop()
+        self.listener.close()
+
+
+def summarize(name, vehicles, seconds):
+    """
+    Prints the command rate, jitter and handshake latency of a group.
+    """
+    if not vehicles:
+        return
+    rates = [len(v.arrivals) / seconds for v in vehicles]
+    gaps = np.concatenate([np.diff(v.arrivals) for v in vehicles
+                           if len(v.arrivals) > 1] or [np.zeros(0)]) * 1000
+    handshakes = np.array([h for v in vehicles for h in v.handshakes]) * 1000
+    connections = sum(v.connections for v in vehicles)
+    dropped = sum(v.dropped_by_server for v in vehicles)
+    print(f"  {name}: {len(vehicles)} vehicles, {connections} connections, "
+          f"{dropped} closed by the server")
+    print(f"    commands per second: min {min(rates):.1f}, "
+          f"mean {np.mean(rates):.1f}, max {max(rates):.1f}")
+    if len(gaps):
+        print(f"    time between commands: "
+              f"p50 {np.percentile(gaps, 50):.1f} ms, "
+              f"p99 {np.percentile(gaps, 99):.1f} ms, "
+              f"std {gaps.std():.1f} ms, max {gaps.max():.1f} ms")
+    if len(handshakes):
+        print(f"    handshake to first command: "
+              f"p50 {np.percentile(handshakes, 50):.1f} ms, "
+              f"p99 {np.percentile(handshakes, 99):.1f} ms, "
+              f"max {handshakes.max():.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--vehicles", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--slow", type=int, default=5,
+                        help="Vehicles that read slowly")
+    parser.add_argument("--slow-delay", type=float, default=0.5,
+                        help="Pause of a slow reader before each read")
+    parser.add_argument("--disconnect", type=int, default=5,
+                        help="Vehicles that drop their connection")
+    parser.add_argument("--storm", type=int, default=10,
+                        help="Vehicles that keep reconnecting")
+    parser.add_argument("--storm-interval", type=float, default=0.5)
+    parser.add_argument("--protocol", choices=("text", "binary"),
+                        default="text")
+    parser.add_argument("--fps", type=float, default=30.0,
+                        help="Synthetic detections per second (local server)")
+    parser.add_argument("--server", help="HOST:PORT of a running server "
+                        "instead of the local one")
+    args = parser.parse_args()
+
+    server = None
+    if args.server:
+        host, port = args.server.rsplit(":", 1)
+        address = (host, int(port))
+    else:
+        server = LocalServer(args.protocol, args.vehicles, args.fps)
+        address = server.address
+
+    rng = np.random.default_rng(0)
+    groups = {"normal": [], "slow": [], "disconnect": [], "storm": []}
+    for user in range(args.vehicles):
+        if user < args.slow:
+            group, options = "slow", {"read_delay": args.slow_delay}
+        elif user < args.slow + args.disconnect:
+            at = float(rng.uniform(0.2, 0.8) * args.seconds)
+            group, options = "disconnect", {"disconnect_at": at}
+        elif user < args.slow + args.disconnect + args.storm:
+            group, options = "storm", {"reconnect_every": args.storm_interval}
+        else:
+            group, options = "normal", {}
+        groups[group].append(FakeVehicle(address, user, args.protocol,
+                                         **options))
+
+    # The server's connect and drop messages would drown the report
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        if server is not None:
+            server.start()
+        fleet = [vehicle for group in groups.values() for vehicle in group]
+        start = time.monotonic()
+        for vehicle in fleet:
+            vehicle.start()
+        time.sleep(args.seconds)
+        for vehicle in fleet:
+            vehicle.stop.set()
+        for vehicle in fleet:
+            vehicle.join()
+        seconds = time.monotonic() - start
+        if server is not None:
+            server.stop()
+
+    print(f"{args.vehicles} vehicles for {seconds:.1f} s over "
+          f"{args.protocol}, "
+          f"{log.getvalue().count(chr(10))} server log lines")
+    for name, vehicles in groups.items():
+        summarize(name, vehicles, seconds)
+    if server is not None:
+        times = np.array(server.frame_times) * 1000
+        stats = server.detector.command_sender.stats
+        registry = server.detector.vehicles.stats
+        print(f"  local server: {len(times)} frames, choose and post "
+              f"p50 {np.percentile(times, 50):.2f} ms, "
+              f"p99 {np.percentile(times, 99):.2f} ms, "
+              f"max {times.max():.2f} ms")
+        print(f"    sender: {stats['sent']} sent, "
+              f"{stats['coalesced']} merged, "
+              f"{stats['keepalives']} keepalives, {stats['dropped']} dropped")
+        print(f"    registry: {registry['registered']} registered, "
+              f"{registry['replaced']} replaced, "
+              f"{registry['expired']} expired")
+
+
+if __name__ == "__main__":
+    main()
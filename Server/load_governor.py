@@ -0,0 +1,126 @@
+class LoadGovernor:
+    """
+    Keeps the control loop at its target rate by shedding optional work
+    when the loop falls behind. The time of every loop (perceiving one
+    frame) and the period between two loops are smoothed and compared
+    with the target period. The loop is behind if either is over the
+    target (the period by more than the tolerance, since it cannot be
+    shorter than the camera's). After hold loops behind, the governor
+    goes one level up and gives up the next piece of work, after recover
+    loops with time to spare (loop time below headroom times the target)
+    it goes one level down and takes the work back. Taking work back is
+    slower than giving it up, so a level that only just fits is kept
+    instead of switching back and forth:
+
+        0 full               everything runs
+        1 no_overlay         the shown frame has no overlay drawn on it
+        2 slow_display       the Detection window updates 4x less often
+        3 slow_boundaries    the boundaries are checked for changes on
+                             every 5th frame only
+        4 low_resolution     markers are detected at half resolution
+
+    Parameters:
+        target_period (float): Loop time to stay under (seconds).
+        headroom (float): Fraction of the target the loop time must be
+            under before work is taken back.
+        tolerance (float): Fraction the period between two loops may be
+            over the target, for the jitter of the camera.
+        hold (int): Loops in a row behind before the level goes up.
+        recover (int): Loops in a row with time to spare before the
+            level goes down.
+        smoothing (float): Weight of the newest loop time in the
+            moving average, between 0 and 1.
+    """
+
+    LEVELS = ("full", "no_overlay", "slow_display", "slow_boundaries",
+              "low_resolution")
+
+    def __init__(self, target_period, headroom=0.6, tolerance=0.1, hold=10,
+                 recover=60, smoothing=0.1):
+        self.target_period = target_period
+        self.headroom = headroom
+        self.tolerance = tolerance
+        self.hold = hold
+        self.recover = recover
+        self.smoothing = smoothing
+        self.level = 0
+        self.loop_time = None
+        self.period = None
+        self._over = 0
+        self._under = 0
+        self.stats = {"loops": 0, "raised": 0, "lowered": 0,
+                      "loops_per_level": [0] * len(self.LEVELS)}
+
+    @property
+    def name(self):
+        return self.LEVELS[self.level]
+
+    def record(self, seconds, period=None):
+        """
+        Adds the time of one loop and updates the level.
+
+        Parameters:
+            seconds (float): Time the loop took.
+            period (float, optional): Time since the previous loop
+                started, None for the first one.
+
+        Returns:
+            bool: True if the level changed.
+        """
+        self.loop_time = self._smooth(self.loop_time, seconds)
+        if period is not None:
+            self.period = self._smooth(self.period, period)
+        self.stats["loops"] += 1
+        self.stats["loops_per_level"][self.level] += 1
+
+        behind = (self.period is not None and self.period
+                  > self.target_period * (1 + self.tolerance))
+        if behind or self.loop_time > self.target_period:
+            self._over += 1
+            self._under = 0
+        elif self.loop_time < self.headroom * self.target_period:
+            self._under += 1
+            self._over = 0
+        else:
+            self._over = self._under = 0
+
+        if self._over >= self.hold and self.level < len(self.LEVELS) - 1:
+            self.level += 1
+            self.stats["raised"] += 1
+        elif self._under >= self.recover and self.level > 0:
+            self.level -= 1
+            self.stats["lowered"] += 1
+        else:
+            return False
+        # Give the new level time to show its effect
+        self._over = self._under = 0
+        return True
+
+    def _smooth(self, average, value):
+        if average is None:
+            return value
+        return average + self.smoothing * (value - average)
+
+    def draw_overlay(self):
+        """
+        True if the overlay should be drawn on the shown frame.
+        """
+        return self.level < 1
+
+    def display_period(self, period):
+        """
+        Minimum time between two shown frames, given the normal one.
+        """
+        return period * 4 if self.level >= 2 else period
+
+    def boundary_check_interval(self):
+        """
+        Every how many frames the boundaries are checked for changes.
+        """
+        return 5 if self.level >= 3 else 1
+
+    def detection_scale(self):
+        """
+        Scale of the grayscale image the markers are detected on.
+        """
+        return 0.5 if self.level >= 4 else 1.0
@@ -0,0 +1,164 @@
+import cv2.aruco as aruco
+import numpy as np
+
+
+def crop_parameters(parameters):
+    """
+    Copy of detector parameters for searching a crop around one marker:
+    the same, but with the OpenCV default maxMarkerPerimeterRate (4.0),
+    as the marker fills much of the crop.
+    """
+    copy = aruco.DetectorParameters()
+    for name in dir(parameters):
+        value = getattr(parameters, name)
+        if not name.startswith("_") and not callable(value):
+            setattr(copy, name, value)
+    copy.maxMarkerPerimeterRate = 4.0
+    return copy
+
+
+class MarkerTracker:
+    """
+    Speeds up ArUco detection by only searching where the markers are
+    expected to be. The cars move a few pixels per frame, so every
+    tracked marker's next corners are predicted from its last two
+    detections, and detectMarkers is run on a padded crop around each
+    prediction instead of the whole frame.
+
+    The full frame is still scanned every full_scan_interval frames, to
+    pick up markers that entered the view, and right away whenever a
+    tracked marker is not found in its crop.
+
+    The marker perimeter limits of the detector parameters are relative
+    to the size of the searched image. A crop is only a little larger
+    than its marker, so the crops are searched without the upper limit,
+    which is meant for the full frame.
+
+    Parameters:
+        dictionary: ArUco dictionary, e.g. DICT_4X4_50.
+        parameters: aruco.DetectorParameters used for every detection.
+        full_scan_interval (int): Scan the full frame at least this
+            often (frames).
+        padding (float): Crop padding around the predicted marker, as a
+            fraction of the marker size.
+        min_padding (int): Smallest crop padding in pixels.
+    """
+
+    def __init__(self, dictionary, parameters, full_scan_interval=10,
+                 padding=0.75, min_padding=20):
+        self.dictionary = dictionary
+        self.parameters = parameters
+        self.crop_parameters = crop_parameters(parameters)
+        self.full_scan_interval = full_scan_interval
+        self.padding = padding
+        self.min_padding = min_padding
+
+        # marker id -> (last corners, corner motion per frame)
+        self._tracks = {}
+        self._since_full_scan = 0
+        self.stats = {
+            "frames": 0,
+            "full_scans": 0,
+            "lost_scans": 0,
+            "roi_scans": 0,
+            "roi_hits": 0,
+            "roi_misses": 0,
+            "pixels_scanned": 0,
+        }
+
+    def detect(self, gray):
+        """
+        Detects the markers in a grayscale frame, using the tracked
+        positions when possible.
+
+        Parameters:
+            gray (np.ndarray): Grayscale frame.
+
+        Returns:
+            tuple: (corners, ids) in the same format as
+                aruco.detectMarkers.
+        """
+        self.stats["frames"] += 1
+        self._since_full_scan += 1
+
+        found = None
+        if self._tracks and self._since_full_scan < self.full_scan_interval:
+            found = self._detect_predicted(gray)
+            if found is None:
+                self.stats["lost_scans"] += 1
+
+        if found is None:
+            found = self._detect_full(gray)
+
+        self._update_tracks(found)
+        return self._as_detections(found)
+
+    def hit_rate(self):
+        """
+        Fraction of tracked markers that were found in their crop.
+        """
+        tried = self.stats["roi_hits"] + self.stats["roi_misses"]
+        return self.stats["roi_hits"] / tried if tried else 0.0
+
+    def _detect_full(self, gray):
+        self.stats["full_scans"] += 1
+        self.stats["pixels_scanned"] += gray.size
+        self._since_full_scan = 0
+        corners, ids, _ = aruco.detectMarkers(
+            gray, self.dictionary, parameters=self.parameters)
+        if ids is None:
+            return {}
+        return {int(i): c[0] for i, c in zip(ids.flatten(), corners)}
+
+    def _detect_predicted(self, gray):
+        height, width = gray.shape[:2]
+        found = {}
+        for marker_id, (corners, motion) in self._tracks.items():
+            if marker_id in found:
+                continue  # Already seen in another marker's crop
+            predicted = corners + motion
+            size = np.ptp(predicted, axis=0).max()
+            pad = max(self.min_padding, self.padding * size)
+            x0, y0 = np.floor(predicted.min(axis=0) - pad).astype(int)
+            x1, y1 = np.ceil(predicted.max(axis=0) + pad).astype(int)
+            x0, y0 = max(x0, 0), max(y0, 0)
+            x1, y1 = min(x1, width), min(y1, height)
+            if x1 <= x0 or y1 <= y0:
+                self.stats["roi_misses"] += 1
+                return None
+
+            crop = gray[y0:y1, x0:x1]
+            self.stats["roi_scans"] += 1
+            self.stats["pixels_scanned"] += crop.size
+            crop_corners, ids, _ = aruco.detectMarkers(
+                crop, self.dictionary, parameters=self.crop_parameters)
+            if ids is not None:
+                offset = np.array([x0, y0], dtype=np.float32)
+                for i, c in zip(ids.flatten(), crop_corners):
+                    found.setdefault(int(i), c[0] + offset)
+
+            if marker_id not in found:
+                # Track lost, scan the whole frame instead
+                self.stats["roi_misses"] += 1
+                return None
+            self.stats["roi_hits"] += 1
+        return found
+
+    def _update_tracks(self, found):
+        tracks = {}
+        for marker_id, corners in found.items():
+            previous = self._tracks.get(marker_id)
+            motion = (corners - previous[0] if previous is not None
+                      else np.zeros_like(corners))
+            tracks[marker_id] = (corners, motion)
+        self._tracks = tracks
+
+    @staticmethod
+    def _as_detections(found):
+        if not found:
+            return (), None
+        marker_ids = sorted(found)
+        corners = tuple(found[i].reshape(1, 4, 2).astype(np.float32)
+                        for i in marker_ids)
+        ids = np.array(marker_ids, dtype=np.int32).reshape(-1, 1)
+        return corners, ids
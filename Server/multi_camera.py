@@ -0,0 +1,336 @@
+import json
+import multiprocessing
+import queue
+import time
+from collections import namedtuple
+
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+
+from boundary_grid import BoundaryGrid
+from boundary_map import BoundaryMap
+from detector_config import make_detector_parameters
+from frame_buffers import FrameBuffers
+from marker_tracker import MarkerTracker
+
+# What one camera found in one frame, in track coordinates. corners has
+# shape (M, 4, 2) and ids shape (M,). boundary holds the camera's lane
+# boundary points, shape (N, 2), only when they were detected again,
+# otherwise None.
+CameraResult = namedtuple(
+    "CameraResult", "camera frame_index capture_time ids corners boundary")
+# Sent once by a worker whose camera or video has ended
+CameraClosed = namedtuple("CameraClosed", "camera frames error")
+
+
+def load_cameras(path):
+    """
+    Reads the camera list for multi-camera mode from a JSON file:
+
+        [{"source": 0, "homography": [[1, 0, 0], [0, 1, 0], [0, 0, 1]]},
+         {"source": 1, "homography": [[...], [...], [...]]}]
+
+    source is a camera index or a video file, homography the 3x3 matrix
+    that maps the camera's pixels to track coordinates.
+
+    Returns:
+        list of tuple: (source, homography) per camera.
+    """
+    with open(path) as f:
+        cameras = json.load(f)
+    return [(camera["source"], np.asarray(camera["homography"], dtype=np.float64))
+            for camera in cameras]
+
+def to_track(points, homography):
+    """
+    Maps image points to track coordinates.
+
+    Parameters:
+        points (np.ndarray): Points with shape (..., 2).
+        homography (np.ndarray): 3x3 image to track matrix.
+
+    Returns:
+        np.ndarray: float32 array of the same shape.
+    """
+    points = np.asarray(points, dtype=np.float32)
+    if points.size == 0:
+        return points.reshape(points.shape)
+    mapped = cv2.perspectiveTransform(points.reshape(-1, 1, 2), homography)
+    return mapped.reshape(points.shape)
+
+
+class CameraProcessor:
+    """
+    Marker detection and boundary extraction for one camera, with the
+    results mapped to track coordinates. Runs inside a camera worker
+    process, or directly for comparison.
+
+    Parameters:
+        camera (int): Index of the camera in the camera list.
+        homography (np.ndarray): 3x3 image to track matrix.
+        lower (np.ndarray): Lower HSV bound of the boundary color.
+        upper (np.ndarray): Upper HSV bound of the boundary color.
+        cell_size (float): Cell size of the camera's BoundaryGrid.
+        dictionary (int): ArUco dictionary, e.g. aruco.DICT_4X4_50.
+        track_markers (bool): Detect markers around their predicted
+            positions, see MarkerTracker.
+        full_scan_interval (int): See MarkerTracker.
+        change_fraction (float): See BoundaryMap.
+        boundary_level (int): Pyramid level of the boundaries, see
+            BoundaryMap.
+        detector_settings (dict, optional): aruco.DetectorParameters
+            values, see detector_config.make_detector_parameters.
+    """
+
+    def __init__(self, camera, homography, lower, upper, cell_size,
+                 dictionary=aruco.DICT_4X4_50, track_markers=True,
+                 full_scan_interval=10, change_fraction=0.25,
+                 boundary_level=0, detector_settings=None):
+        self.camera = camera
+        self.homography = np.asarray(homography, dtype=np.float64)
+        self.dictionary = aruco.getPredefinedDictionary(dictionary)
+        self.parameters = make_detector_parameters(detector_settings)
+        self.tracker = None
+        if track_markers:
+            self.tracker = MarkerTracker(self.dictionary, self.parameters,
+                                         full_scan_interval)
+        self.boundary_map = BoundaryMap(lower, upper, cell_size,
+                                        change_fraction=change_fraction,
+                                        level=boundary_level)
+        self.buffers = FrameBuffers()
+        self.frames = 0
+
+    def process(self, frame, capture_time):
+        """
+        Returns the CameraResult of one BGR frame.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY,
+                            dst=self.buffers.get("gray", frame.shape[:2]))
+        if self.tracker is not None:
+            corners, ids = self.tracker.detect(gray)
+        else:
+            corners, ids, _ = aruco.detectMarkers(
+                gray, self.dictionary, parameters=self.parameters)
+        image_corners = [corner[0] for corner in corners]
+        rebuilt = self.boundary_map.update(frame, image_corners)
+
+        if ids is None:
+            ids = np.empty(0, dtype=np.int32)
+            track_corners = np.empty((0, 4, 2), dtype=np.float32)
+        else:
+            ids = ids.reshape(-1).astype(np.int32)
+            track_corners = to_track(np.array(image_corners), self.homography)
+        boundary = None
+        if rebuilt:
+            boundary = to_track(self.boundary_map.points, self.homography)
+        result = CameraResult(self.camera, self.frames, capture_time, ids,
+                              track_corners, boundary)
+        self.frames += 1
+        return result
+
+
+def camera_worker(camera, source, homography, options, results, stop):
+    """
+    Entry point of a camera worker process. Reads frames from a camera
+    index or video file and puts a CameraResult for every frame into
+    results until the stream ends or stop is set, then a CameraClosed.
+
+    Parameters:
+        camera (int): Index of the camera in the camera list.
+        source (int or str): cv2.VideoCapture source.
+        homography (np.ndarray): 3x3 image to track matrix.
+        options (dict): Keyword arguments for CameraProcessor.
+        results (multiprocessing.Queue): Where the results go.
+        stop (multiprocessing.Event): Set to stop the worker.
+    """
+    # Every worker gets one core, the processes run side by side
+    cv2.setNumThreads(1)
+    frames = 0
+    error = None
+    cap = cv2.VideoCapture(source)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    frame = None
+    try:
+        processor = CameraProcessor(camera, homography, **options)
+        while not stop.is_set():
+            # Decode into the last frame's memory
+            ret, frame = cap.read(image=frame)
+            if not ret:
+                break
+            results.put(processor.process(frame, time.time()))
+            frames += 1
+    except Exception as e:
+        error = str(e)
+    finally:
+        cap.release()
+        results.put(CameraClosed(camera, frames, error))
+
+
+class CameraPool:
+    """
+    One worker process per camera. Detection and boundary extraction
+    run in the workers, so they use one core each instead of sharing
+    the GIL, and only the small track coordinate results come back.
+
+    Parameters:
+        cameras (sequence of tuple): (source, homography) per camera,
+            see load_cameras.
+        options (dict): Keyword arguments for CameraProcessor.
+    """
+
+    def __init__(self, cameras, options):
+        # Spawned workers do not inherit the server's sockets and threads
+        self._context = multiprocessing.get_context("spawn")
+        self.results_queue = self._context.Queue()
+        self.stop_event = self._context.Event()
+        self.processes = [
+            self._context.Process(
+                target=camera_worker, name=f"camera-{camera}", daemon=True,
+                args=(camera, source, homography, options, self.results_queue,
+                      self.stop_event))
+            for camera, (source, homography) in enumerate(cameras)]
+        self.closed = []
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def results(self, timeout=1.0):
+        """
+        Yields the CameraResults of all workers in arrival order until
+        every camera has closed or stop is called.
+        """
+        while len(self.closed) < len(self.processes):
+            try:
+                item = self.results_queue.get(timeout=timeout)
+            except queue.Empty:
+                if self.stop_event.is_set() or not any(
+                        p.is_alive() for p in self.processes):
+                    return
+                continue
+            if isinstance(item, CameraClosed):
+                self.closed.append(item)
+                if item.error:
+                    print(f"Camera {item.camera} failed: {item.error}")
+                continue
+            yield item
+
+    def stop(self):
+        """
+        Stops and joins all workers.
+        """
+        self.stop_event.set()
+        deadline = time.monotonic() + 2.0
+        for process in self.processes:
+            # Empty the queue, a worker cannot exit while its last
+            # results are still waiting to be written to it
+            while process.is_alive() and time.monotonic() < deadline:
+                try:
+                    self.results_queue.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+
+class Coordinator:
+    """
+    Merges the results of several cameras into one view of the track.
+    The boundary points of every camera are kept in track coordinates
+    and combined into one BoundaryGrid. A marker seen by more than one
+    camera (where their views overlap) is taken from the camera that
+    owns the car. The owner keeps the car as long as it still sees it,
+    and another camera that sees it takes over once the owner does not,
+    so a car crossing the overlap is handed off once instead of jumping
+    between two slightly different poses. Sightings older than max_age
+    are ignored.
+
+    The object can be passed to find_targets in place of a BoundaryMap.
+
+    Parameters:
+        cell_size (float): Cell size of the merged BoundaryGrid.
+        max_age (float): How long a sighting stays valid (seconds).
+    """
+
+    def __init__(self, cell_size, max_age=0.2):
+        self.cell_size = cell_size
+        self.max_age = max_age
+        self.grid = BoundaryGrid(np.empty((0, 2), dtype=np.float32), cell_size)
+        # Like BoundaryMap.level, for the slack find_targets gives the
+        # clearance, which is always 0 here
+        self.level = 0
+        self._boundaries = {}
+        # marker id -> {camera: (capture_time, corners)}
+        self._sightings = {}
+        self._owners = {}
+        self.latest_time = 0.0
+        self.stats = {"results": 0, "boundary_builds": 0, "duplicates": 0,
+                      "handoffs": 0}
+
+    def add(self, result):
+        """
+        Adds one CameraResult.
+        """
+        self.stats["results"] += 1
+        self.latest_time = max(self.latest_time, result.capture_time)
+        if result.boundary is not None:
+            self._boundaries[result.camera] = result.boundary
+            self.grid = BoundaryGrid(
+                np.concatenate(list(self._boundaries.values())), self.cell_size)
+            self.stats["boundary_builds"] += 1
+
+        seen = set(result.ids.tolist())
+        for marker_id, corners in zip(result.ids.tolist(), result.corners):
+            self._sightings.setdefault(marker_id, {})[result.camera] = (
+                result.capture_time, corners)
+        # The camera no longer sees the markers missing from its frame
+        for marker_id, cameras in self._sightings.items():
+            if marker_id not in seen:
+                cameras.pop(result.camera, None)
+
+    def markers(self):
+        """
+        Returns the merged markers like aruco.detectMarkers does, plus
+        the capture time of the oldest sighting used.
+
+        Returns:
+            tuple: (corners, ids, capture_time), corners a list of
+                (1, 4, 2) arrays in track coordinates and ids an (M, 1)
+                array, None if no marker is seen.
+        """
+        corners = []
+        ids = []
+        capture_time = self.latest_time
+        for marker_id in sorted(self._sightings):
+            cameras = self._sightings[marker_id]
+            fresh = {camera: sighting for camera, sighting in cameras.items()
+                     if self.latest_time - sighting[0] <= self.max_age}
+            if not fresh:
+                self._owners.pop(marker_id, None)
+                continue
+            if len(fresh) > 1:
+                self.stats["duplicates"] += len(fresh) - 1
+            owner = self._owners.get(marker_id)
+            if owner not in fresh:
+                # Hand the car to the camera that saw it last
+                new_owner = max(fresh, key=lambda camera: (fresh[camera][0],
+                                                           -camera))
+                if owner is not None:
+                    self.stats["handoffs"] += 1
+                owner = self._owners[marker_id] = new_owner
+            sighting_time, marker_corners = fresh[owner]
+            capture_time = min(capture_time, sighting_time)
+            corners.append(marker_corners.reshape(1, 4, 2))
+            ids.append(marker_id)
+        if not ids:
+            return [], None, capture_time
+        return corners, np.array(ids, dtype=np.int32).reshape(-1, 1), capture_time
+
+    def clearance(self, point):
+        """
+        There is no distance field in track coordinates, so every
+        marker searches the grid. See BoundaryMap.clearance.
+        """
+        return 0.0
@@ -0,0 +1,267 @@
+import queue
+import threading
+import time
+
+
+class LatestQueue:
+    """
+    Bounded queue where the newest item always wins. When the queue is
+    full the oldest item is dropped to make room, so a slow consumer
+    always gets the most recent frame instead of a stale one and never
+    blocks the producer.
+
+    Parameters:
+        maxsize (int): Number of items kept, 1 keeps only the latest.
+    """
+
+    def __init__(self, maxsize=1):
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def put(self, item):
+        """
+        Adds an item, dropping the oldest one if the queue is full.
+        """
+        with self._lock:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def get(self, timeout=None):
+        """
+        Removes and returns the oldest item. Raises queue.Empty if no
+        item arrives within timeout seconds.
+        """
+        return self._queue.get(timeout=timeout)
+
+
+class StageStats:
+    """
+    Throughput counter for one pipeline stage.
+
+    Parameters:
+        name (str): Name of the stage shown in reports.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.busy = 0.0
+        self.started = time.monotonic()
+        self._window_start = self.started
+        self._window_count = 0
+
+    def record(self, duration):
+        """
+        Counts one processed item that took duration seconds.
+        """
+        self.count += 1
+        self.busy += duration
+        self._window_count += 1
+
+    def rate(self):
+        """
+        Items per second since the last call to rate, or since the
+        stage started on the first call.
+        """
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        rate = self._window_count / elapsed if elapsed > 0 else 0.0
+        self._window_start = now
+        self._window_count = 0
+        return rate
+
+    def summary(self):
+        """
+        Returns a dict with the total count, average rate in items per
+        second and average time spent per item in milliseconds.
+        """
+        elapsed = time.monotonic() - self.started
+        return {
+            "count": self.count,
+            "fps": self.count / elapsed if elapsed > 0 else 0.0,
+            "ms_per_item": self.busy / self.count * 1000 if self.count else 0.0,
+        }
+
+
+class Stage(threading.Thread):
+    """
+    One pipeline stage running in its own thread. It takes items from
+    its inbox, calls work on them and puts the result into every
+    outbox. A stage without an inbox is a source and calls work() with
+    no argument, it ends the pipeline by raising EOFError. Results that
+    are None are not forwarded.
+
+    Parameters:
+        name (str): Name of the stage.
+        work (callable): Function doing the stage's work.
+        stop_event (threading.Event): Shared event that stops all stages.
+        inbox (LatestQueue, optional): Queue to read items from.
+        outboxes (sequence of LatestQueue): Queues the results go to.
+        period (float): Minimum time between two items in seconds, used
+            to run a stage at a lower rate.
+    """
+
+    def __init__(self, name, work, stop_event, inbox=None, outboxes=(),
+                 period=0.0):
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.stop_event = stop_event
+        self.inbox = inbox
+        self.outboxes = list(outboxes)
+        self.period = period
+        self.stats = StageStats(name)
+        self.error = None
+
+    def step(self, timeout=0.1):
+        """
+        Processes at most one item. Returns False when the pipeline
+        should stop.
+        """
+        if self.inbox is not None:
+            try:
+                item = self.inbox.get(timeout=timeout)
+            except queue.Empty:
+                return True
+
+        start = time.monotonic()
+        try:
+            result = self.work() if self.inbox is None else self.work(item)
+        except EOFError:
+            return False
+        self.stats.record(time.monotonic() - start)
+
+        if result is False:
+            return False
+        if result is not None:
+            for box in self.outboxes:
+                box.put(result)
+
+        if self.period:
+            time.sleep(max(0.0, self.period - (time.monotonic() - start)))
+        return True
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                if not self.step():
+                    break
+        except Exception as e:
+            self.error = e
+            print(f"Stage {self.name} failed: {e}")
+        finally:
+            self.stop_event.set()
+
+
+class Pipeline:
+    """
+    Capture, perception, send and display stages connected by
+    LatestQueues. Every stage runs at its own pace: a slow stage only
+    makes the stages after it skip items, it never stalls capture.
+
+    The display stage is optional. It runs in the thread that calls
+    run(), because most GUI backends need that, and can be limited to
+    a lower rate than the rest.
+
+    Parameters:
+        capture (callable): Returns the next frame, raises EOFError at
+            the end of the stream.
+        perceive (callable): Takes a frame and returns a result that is
+            passed on to send and display.
+        send (callable): Takes a perception result and sends its commands.
+        display (callable, optional): Takes a perception result, returns
+            False to stop the pipeline.
+        display_period (float): Minimum time between two displayed frames.
+        report_interval (float, optional): If set, the stage rates are
+            printed this often (seconds).
+    """
+
+    def __init__(self, capture, perceive, send, display=None,
+                 display_period=0.0, report_interval=None):
+        self.stop_event = threading.Event()
+        self.frames = LatestQueue()
+        self.results = LatestQueue()
+        self.shown = LatestQueue()
+        self.report_interval = report_interval
+
+        outboxes = [self.results] + ([self.shown] if display else [])
+        self.stages = [
+            Stage("capture", capture, self.stop_event,
+                  outboxes=[self.frames]),
+            Stage("perception", perceive, self.stop_event,
+                  inbox=self.frames, outboxes=outboxes),
+            Stage("send", send, self.stop_event, inbox=self.results),
+        ]
+        self.display = None
+        if display:
+            self.display = Stage("display", display, self.stop_event,
+                                 inbox=self.shown, period=display_period)
+
+    def start(self):
+        """
+        Starts the capture, perception and send threads.
+        """
+        for stage in self.stages:
+            stage.start()
+
+    def run(self):
+        """
+        Starts the pipeline and blocks until it stops, running the
+        display stage in the calling thread if there is one.
+        """
+        self.start()
+        next_report = time.monotonic() + (self.report_interval or 0)
+        try:
+            while not self.stop_event.is_set():
+                if self.display is not None:
+                    if not self.display.step():
+                        break
+                else:
+                    self.stop_event.wait(0.1)
+
+                if self.report_interval and time.monotonic() >= next_report:
+                    print(self.format_rates())
+                    next_report += self.report_interval
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Stops all stages and waits for their threads to finish.
+        """
+        self.stop_event.set()
+        for stage in self.stages:
+            if stage.is_alive():
+                stage.join(timeout=2.0)
+
+    def all_stages(self):
+        return self.stages + ([self.display] if self.display else [])
+
+    def format_rates(self):
+        """
+        One line with the current rate of every stage in frames per second.
+        """
+        return " | ".join(f"{stage.name} {stage.stats.rate():5.1f} fps"
+                          for stage in self.all_stages())
+
+    def summary(self):
+        """
+        Returns a dict with the StageStats summary of every stage and the
+        number of items dropped by each queue.
+        """
+        report = {stage.name: stage.stats.summary()
+                  for stage in self.all_stages()}
+        report["dropped"] = {
+            "frames": self.frames.dropped,
+            "results": self.results.dropped,
+            "shown": self.shown.dropped,
+        }
+        return report
@@ -0,0 +1,373 @@
+import collections
+import http.server
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from latency_monitor import RollingHistogram
+
+
+class _Measurement:
+    """
+    Context manager timing one run of a stage, cheaper than a
+    contextlib generator.
+    """
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _StageHistogram:
+    __slots__ = ("recent", "count", "total", "max")
+
+    def __init__(self, bin_width, max_value, window):
+        self.recent = RollingHistogram(bin_width, max_value, window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class StageMetrics:
+    """
+    Live stage times and counters of the running server, a drop-in for
+    StageTimer that keeps a bounded amount of data however long it
+    runs. Every stage has a rolling histogram of its last window runs
+    for the percentiles, and its run count, total and longest time
+    since the start. Counters add up events such as detected markers.
+    The stats dicts of other parts (e.g. the command sender) can be
+    added to be shown next to them.
+
+    Parameters:
+        bin_width (float): Histogram bin width (seconds), the precision
+            of the percentiles.
+        max_value (float): Longest time the histograms tell apart
+            (seconds), longer runs go into the last bin.
+        window (int): Number of recent runs per stage in the percentiles.
+    """
+
+    def __init__(self, bin_width=0.00005, max_value=0.5, window=1000):
+        self.bin_width = bin_width
+        self.max_value = max_value
+        self.window = window
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = collections.defaultdict(int)
+        self._stats = {}
+
+    def measure(self, name):
+        """
+        Context manager that times the code inside it as stage name.
+        """
+        return _Measurement(self, name)
+
+    def record(self, name, seconds):
+        """
+        Adds a duration measured elsewhere to stage name.
+        """
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = _StageHistogram(
+                    self.bin_width, self.max_value, self.window)
+            stage.recent.add(seconds)
+            stage.count += 1
+            stage.total += seconds
+            if seconds > stage.max:
+                stage.max = seconds
+
+    def count(self, name, amount=1):
+        """
+        Adds amount to counter name.
+        """
+        with self._lock:
+            self._counters[name] += amount
+
+    def add_stats(self, source, stats):
+        """
+        Shows the numeric values of a stats dict, or of a function
+        returning one, as source_key.
+        """
+        self._stats[source] = stats
+
+    def summary(self, percentiles=(50, 95, 99)):
+        """
+        Returns a dict with the count, mean, max and recent percentiles
+        (in milliseconds) of every stage, like StageTimer.summary.
+        """
+        report = {}
+        with self._lock:
+            for name, stage in self._stages.items():
+                stats = {"count": stage.count,
+                         "mean_ms": stage.total / stage.count * 1000,
+                         "max_ms": stage.max * 1000}
+                for p in percentiles:
+                    stats[f"p{p}_ms"] = stage.recent.percentile(p) * 1000
+                report[name] = stats
+        return report
+
+    def render(self, percentiles=(50, 90, 99)):
+        """
+        The metrics as text in the Prometheus exposition format, times
+        in seconds.
+        """
+        lines = ["# Stage times, quantiles over the last "
+                 f"{self.window} runs of each stage",
+                 "# TYPE stage_seconds summary"]
+        with self._lock:
+            for name, stage in sorted(self._stages.items()):
+                for p in percentiles:
+                    value = stage.recent.percentile(p)
+                    lines.append(f'stage_seconds{{stage="{name}",'
+                                 f'quantile="{p / 100:g}"}} {value:.6f}')
+                lines.append(f'stage_seconds_sum{{stage="{name}"}} '
+                             f'{stage.total:.6f}')
+                lines.append(f'stage_seconds_count{{stage="{name}"}} '
+                             f'{stage.count}')
+            lines.append("# TYPE stage_seconds_max gauge")
+            for name, stage in sorted(self._stages.items()):
+                lines.append(f'stage_seconds_max{{stage="{name}"}} '
+                             f'{stage.max:.6f}')
+            lines.append("# TYPE events_total counter")
+            for name, value in sorted(self._counters.items()):
+                lines.append(f'events_total{{name="{name}"}} {value}')
+        for source, stats in self._stats.items():
+            if callable(stats):
+                stats = stats()
+            for key, value in stats.items():
+                # Lists such as the loops per level are left out
+                if isinstance(value, (int, float)):
+                    lines.append(f"{source}_{key} {value}")
+        lines.append(f"uptime_seconds {time.monotonic() - self.started:.1f}")
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of every thread of the process that can be
+    switched on and off while the server runs. While on, a background
+    thread takes the call stack of all other threads every interval
+    seconds and counts how often each stack was seen. Unlike cProfile
+    the profiled code is not slowed down by every call, only by the
+    sampling itself, and nothing at all while it is off.
+
+    Parameters:
+        interval (float): Time between two samples (seconds).
+        ignore (collection of str): Names of threads not sampled, by
+            default the MetricsServer's, which only waits for requests.
+    """
+
+    def __init__(self, interval=0.005, ignore=("metrics-server",)):
+        self.interval = interval
+        self.ignore = set(ignore)
+        self.samples = 0
+        self.started = None
+        self.stopped = None
+        self._stacks = collections.Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=None):
+        """
+        Starts sampling, forgetting the samples of an earlier run.
+        Nothing happens if it is already running.
+        """
+        if self._thread is not None:
+            return
+        if interval is not None:
+            self.interval = interval
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+        self.started = time.monotonic()
+        self.stopped = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name="sampling-profiler",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling, the samples are kept for the report.
+        """
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+        self._thread = None
+        self.stopped = time.monotonic()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if ident == own or name in self.ignore:
+                    continue
+                calls = []
+                while frame is not None:
+                    code = frame.f_code
+                    calls.append(f"{code.co_name} "
+                                 f"({code.co_filename.rsplit('/', 1)[-1]}"
+                                 f":{code.co_firstlineno})")
+                    frame = frame.f_back
+                calls.append(name)
+                stacks.append(";".join(reversed(calls)))
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def folded(self):
+        """
+        The sampled stacks in the folded format of flamegraph.pl, one
+        line per stack: the thread name and the calls from the outside
+        in, separated by semicolons, and how often it was seen.
+        """
+        with self._lock:
+            stacks = self._stacks.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def report(self, top=10):
+        """
+        Text with, for every thread, the share of the samples it was
+        seen in each function: at the top of its stack (self) and
+        anywhere in it (total). A thread waiting in select or a queue
+        shows up as the function it waits in.
+        """
+        with self._lock:
+            stacks = list(self._stacks.items())
+            samples = self.samples
+        threads = collections.defaultdict(
+            lambda: (collections.Counter(), collections.Counter()))
+        for stack, count in stacks:
+            thread, *calls = stack.split(";")
+            own, total = threads[thread]
+            if calls:
+                own[calls[-1]] += count
+            for call in set(calls):
+                total[call] += count
+        end = self.stopped if self.stopped is not None else time.monotonic()
+        seconds = end - self.started if self.started is not None else 0.0
+        state = "running" if self.running else "stopped"
+        lines = [f"Profiler {state}, {samples} samples in {seconds:.1f} s "
+                 f"every {self.interval * 1000:.1f} ms"]
+        for thread, (own, total) in sorted(threads.items()):
+            lines.append(f"\nThread {thread}, % of the samples:")
+            lines.append("    self   total  function")
+            for call, count in own.most_common(top):
+                lines.append(f"{count / samples:7.1%} "
+                             f"{total[call] / samples:7.1%}  {call}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(threading.Thread):
+    """
+    HTTP server on localhost for the StageMetrics and the
+    SamplingProfiler of the running server:
+
+        GET  /metrics          stage times, counters and stats
+        GET  /profile          top functions of the sampling profiler
+        GET  /profile/folded   sampled stacks for flamegraph.pl
+        POST /profile/start    start sampling, ?interval=0.005
+        POST /profile/stop     stop sampling
+
+    Parameters:
+        metrics (StageMetrics): Metrics to serve.
+        profiler (SamplingProfiler, optional): Profiler to control, a
+            new one if not given.
+        port (int): Port to listen on, 0 for any free one (see address).
+        host (str): Address to listen on, only this computer by default.
+    """
+
+    def __init__(self, metrics, profiler=None, port=8081, host="127.0.0.1"):
+        super().__init__(name="metrics-server", daemon=True)
+        self.metrics = metrics
+        self.profiler = profiler if profiler is not None \
+            else SamplingProfiler()
+        self.httpd = http.server.ThreadingHTTPServer((host, port),
+                                                     self._handler())
+        self.httpd.daemon_threads = True
+        self.address = self.httpd.server_address
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == "/metrics":
+                    self._reply(server.metrics.render())
+                elif path == "/profile":
+                    self._reply(server.profiler.report())
+                elif path == "/profile/folded":
+                    self._reply(server.profiler.folded())
+                else:
+                    self._reply("Not found\n", 404)
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                if url.path == "/profile/start":
+                    query = parse_qs(url.query)
+                    interval = None
+                    try:
+                        if "interval" in query:
+                            interval = float(query["interval"][0])
+                    except ValueError:
+                        self._reply("Bad interval\n", 400)
+                        return
+                    if interval is not None and interval <= 0:
+                        self._reply("Bad interval\n", 400)
+                        return
+                    server.profiler.start(interval)
+                    self._reply("Profiler started\n")
+                elif url.path == "/profile/stop":
+                    server.profiler.stop()
+                    self._reply(server.profiler.report())
+                else:
+                    self._reply("Not found\n", 404)
+
+            def _reply(self, text, status=200):
+                body = text.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep the server's console for its own messages
+
+        return Handler
+
+    def run(self):
+        self.httpd.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        """
+        Stops serving and the profiler, and closes the socket.
+        """
+        self.profiler.stop()
+        if self.is_alive():
+            self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,83 @@
+"""
+Reads the steering telemetry the server recorded (TELEMETRY_FILE) and
+prints a summary per vehicle: how many commands were decided, sent,
+repeated as keepalives and dropped, the rate and range of the sent
+angles, and the mean score of the chosen boundary points. The records
+can also be written as CSV, or loaded in Python with
+telemetry.load_telemetry for analysis with NumPy.
+
+Usage:
+    python read_telemetry.py [telemetry.ring] [--csv run.csv]
+                             [--vehicle 3] [--last 20]
+"""
+import argparse
+
+import numpy as np
+
+from telemetry import KEEPALIVE, OUTCOMES, QUEUED, SENT, load_telemetry
+
+
+def summarize(records):
+    """
+    Prints the summary of every vehicle in the records.
+    """
+    if len(records) == 0:
+        print("No records")
+        return
+    duration = records["time"][-1] - records["time"][0]
+    print(f"{len(records)} records over {duration:.1f} s")
+    for marker_id in np.unique(records["marker_id"]):
+        mine = records[records["marker_id"] == marker_id]
+        counts = np.bincount(mine["outcome"], minlength=len(OUTCOMES))
+        counted = ", ".join(f"{counts[i]} {name}"
+                            for i, name in enumerate(OUTCOMES))
+        print(f"  vehicle {marker_id}: {counted}")
+        sent = mine[mine["outcome"] == SENT]
+        if len(sent):
+            seconds = max(sent["time"][-1] - sent["time"][0], 1e-9)
+            print(f"    sent angles {sent['angle'].min()}..{sent['angle'].max()}, "
+                  f"mean {sent['angle'].mean():.1f}, "
+                  f"{(len(sent) - 1) / seconds:.1f} per second")
+        scores = mine["score"][mine["outcome"] == QUEUED]
+        scores = scores[np.isfinite(scores)]
+        if len(scores):
+            print(f"    best point score mean {scores.mean():.3f}, "
+                  f"max {scores.max():.3f}")
+
+def write_csv(records, path):
+    with open(path, "w") as f:
+        f.write("time,marker_id,angle,outcome,heading,point_x,point_y,score\n")
+        for r in records:
+            f.write(f"{r['time']:.6f},{r['marker_id']},{r['angle']},"
+                    f"{OUTCOMES[r['outcome']]},{r['heading']:.2f},"
+                    f"{r['point'][0]:.1f},{r['point'][1]:.1f},{r['score']:.4f}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("path", nargs="?", default="telemetry.ring")
+    parser.add_argument("--csv", help="Also write the records to this file")
+    parser.add_argument("--vehicle", type=int, help="Only this marker ID")
+    parser.add_argument("--last", type=int, default=0,
+                        help="Print the last records as well")
+    args = parser.parse_args()
+
+    records = load_telemetry(args.path)
+    if args.vehicle is not None:
+        records = records[records["marker_id"] == args.vehicle]
+    summarize(records)
+    if args.last:
+        for r in records[-args.last:]:
+            outcome = OUTCOMES[r["outcome"]]
+            detail = ""
+            if r["outcome"] != KEEPALIVE and np.isfinite(r["score"]):
+                detail = (f" heading {r['heading']:.0f}, point "
+                          f"({r['point'][0]:.0f}, {r['point'][1]:.0f}), "
+                          f"score {r['score']:.3f}")
+            print(f"  {r['time']:.3f} vehicle {r['marker_id']} {outcome} "
+                  f"{r['angle']}{detail}")
+    if args.csv:
+        write_csv(records, args.csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Drives simulated cars around a taped oval with the server's own
+steering, without a camera, car or track. Every step the simulator
+renders an overhead frame with each car's ArUco marker, perceive()
+from aruco_edge_detector.py decides the servo angles as it would for
+the camera, and the cars move by those angles with the bicycle model.
+Runs headless on simulated time, as fast as the frames are processed.
+The commands go through the same per-car gating as on the server:
+choose_commands compares them with the last angle sent to the car, and
+a car is sent at most one angle per SEND_INTERVAL. The report shows
+the lane departures and the frames per second. The simulation is the
+same every time for the same arguments.
+
+Usage:
+    python simulate.py [--cars 8] [--seconds 60] [--width 640]
+                       [--height 480] [--delay 0.1] [--show]
+"""
+import argparse
+import time
+
+import cv2
+
+import aruco_edge_detector as detector
+from boundary_map import BoundaryMap
+from frame_buffers import FrameBuffers
+from marker_tracker import MarkerTracker
+from track_simulator import TrackSimulator
+from vehicle_registry import Vehicle
+
+
+class SimulatedLink:
+    """
+    Stands in for the server's VehicleRegistry and CommandSender on
+    simulated time. Every car has a Vehicle whose last_angle and
+    last_send are kept like record_sent does, so choose_commands gates
+    the angles as it does on the server. A posted angle replaces one
+    still waiting, and is handed to the car once send_interval has
+    passed since the last one.
+
+    Parameters:
+        simulator (TrackSimulator): The cars to command.
+        send_interval (float): Shortest time between two angles to the
+            same car (seconds).
+    """
+
+    def __init__(self, simulator, send_interval=detector.SEND_INTERVAL):
+        self.simulator = simulator
+        self.send_interval = send_interval
+        self._vehicles = {marker_id: Vehicle(marker_id, None, None, 0.0)
+                          for marker_id in simulator.cars}
+        self._pending = {}
+        self.sent = 0
+
+    def connected(self):
+        return self._vehicles.keys()
+
+    def get(self, marker_id):
+        return self._vehicles.get(marker_id)
+
+    def post(self, marker_id, angle):
+        self._pending[marker_id] = angle
+
+    def flush(self):
+        """
+        Sends the waiting angles that are due.
+        """
+        now = self.simulator.time
+        for marker_id, angle in list(self._pending.items()):
+            vehicle = self._vehicles[marker_id]
+            # A little slack for the rounding of the simulated time
+            if (vehicle.last_send is not None
+                    and now - vehicle.last_send < self.send_interval - 1e-9):
+                continue
+            del self._pending[marker_id]
+            self.simulator.set_servo(marker_id, angle)
+            vehicle.last_angle = angle
+            vehicle.last_send = now
+            self.sent += 1
+
+
+def run(simulator, steps, show=False):
+    """
+    Runs the closed loop for steps frames.
+
+    Returns:
+        dict: departures (per car), detected (markers found per frame,
+            summed), commands (sent to the cars), seconds (wall time),
+            offset (root mean square distance from the middle of the
+            lane, pixels) and steering (servo degrees turned per car
+            and second).
+    """
+    boundary_map = BoundaryMap(
+        detector.lower_yellow, detector.upper_yellow, detector.HIGH_THRESHOLD,
+        change_fraction=detector.BOUNDARY_CHANGE_FRACTION,
+        level=detector.BOUNDARY_LEVEL)
+    tracker = None
+    if detector.TRACK_MARKERS:
+        tracker = MarkerTracker(detector.aruco_dict, detector.parameters,
+                                detector.FULL_SCAN_INTERVAL)
+    buffers = FrameBuffers()
+    link = SimulatedLink(simulator)
+    detected = 0
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        frame = simulator.render()
+        perception = detector.perceive(frame, boundary_map, tracker=tracker,
+                                       capture_time=simulator.time,
+                                       buffers=buffers, registry=link)
+        detected += len(perception.targets)
+        for marker_id, angle in perception.commands:
+            link.post(marker_id, angle)
+        link.flush()
+        simulator.step()
+        if show:
+            cv2.imshow("Simulation",
+                       detector.draw_overlay(perception, boundary_map))
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    seconds = time.perf_counter() - start
+    if show:
+        cv2.destroyAllWindows()
+    cars = simulator.cars.values()
+    car_steps = max(sum(car.steps for car in cars), 1)
+    return {"departures": {car.marker_id: car.departures for car in cars},
+            "detected": detected, "commands": link.sent, "seconds": seconds,
+            "offset": (sum(car.offset_squares for car in cars)
+                       / car_steps) ** 0.5,
+            "steering": (sum(car.steering_travel for car in cars)
+                         / (car_steps * simulator.dt))}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--cars", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=60.0,
+                        help="Simulated time")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--lane", type=int, default=120,
+                        help="Lane width in pixels")
+    parser.add_argument("--speed", type=float, default=100.0,
+                        help="Car speed in pixels per second")
+    parser.add_argument("--delay", type=float, default=0.1,
+                        help="Command to servo latency in seconds")
+    parser.add_argument("--fps", type=float, default=30.0,
+                        help="Simulated camera frame rate")
+    parser.add_argument("--show", action="store_true",
+                        help="Show the frames with the overlay")
+    args = parser.parse_args()
+
+    simulator = TrackSimulator(detector.aruco_dict, args.width, args.height,
+                               lane_width=args.lane, speed=args.speed,
+                               command_delay=args.delay, dt=1 / args.fps)
+    simulator.add_cars(args.cars)
+    steps = round(args.seconds * args.fps)
+    result = run(simulator, steps, args.show)
+
+    departures = result["departures"]
+    simulated = simulator.time
+    print(f"{args.cars} cars, {simulated:.0f} s simulated in "
+          f"{result['seconds']:.1f} s: {steps / result['seconds']:.0f} fps, "
+          f"{simulated / result['seconds']:.1f}x real time")
+    print(f"  markers found in {result['detected'] / (steps * args.cars):.1%} "
+          f"of the car frames, {result['commands']} commands")
+    print(f"  lane departures: {sum(departures.values())} in total, "
+          f"{sum(departures.values()) / simulated * 60:.1f} per minute")
+    print(f"  weaving: {result['offset']:.1f} px RMS from the middle of the "
+          f"lane, servo turning {result['steering']:.0f} deg/s")
+    worst = sorted(departures.items(), key=lambda item: -item[1])[:5]
+    if worst[0][1]:
+        print("  most by car: " + ", ".join(f"{marker_id}: {count}"
+                                            for marker_id, count in worst
+                                            if count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+
+class StageTimer:
+    """
+    Collects how long each named processing stage takes, e.g. the
+    grayscale conversion or detectMarkers, so that their latency
+    percentiles can be reported, and counts events such as detected
+    markers.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.counts = defaultdict(int)
+
+    @contextmanager
+    def measure(self, name):
+        """
+        Context manager that times the code inside it as stage name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """
+        Adds a duration measured elsewhere to stage name.
+        """
+        self.samples[name].append(seconds)
+
+    def count(self, name, amount=1):
+        """
+        Adds amount to counter name.
+        """
+        self.counts[name] += amount
+
+    def summary(self, percentiles=(50, 95, 99)):
+        """
+        Returns a dict with the count, mean and percentiles (in
+        milliseconds) of every stage, e.g. {"grayscale": {"count": 10,
+        "mean_ms": 0.2, "p50_ms": 0.2, ...}}.
+        """
+        report = {}
+        for name, samples in self.samples.items():
+            ms = np.asarray(samples) * 1000
+            stats = {"count": len(ms), "mean_ms": float(ms.mean())}
+            for p in percentiles:
+                stats[f"p{p}_ms"] = float(np.percentile(ms, p))
+            report[name] = stats
+        return report
+
+
+class NullTimer:
+    """
+    Timer that does nothing, used when no timing is wanted.
+    """
+
+    def measure(self, name):
+        return nullcontext()
+
+    def record(self, name, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+
+NULL_TIMER = NullTimer()
@@ -1,87 +1,297 @@
+import queue
 import socket
 import threading
-import keyboard
 import time
 
-# Create and bind the server socket
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.bind(("", 5000))
-s.listen(5)
-print("Server is now running, waiting for a connection...")
+from command_sender import CommandSender
+from vehicle_registry import VehicleRegistry
 
-# Dictionary to map IP address to user number
-ip_to_user = {}
+# ==== Changeable Parameters ====
+SERVER_PORT = 5000
+# Minimum time between two commands to a car (seconds), key presses in
+# between are merged into the next command
+SEND_INTERVAL = 0.05
+# While a key is held, its command is sent again this often (seconds).
+# Once every key is released HOLD_COMMAND is sent this often instead,
+# so the active car keeps its angle and throttle. A car that is no
+# longer active steers straight and stops after the client's
+# COMMAND_TIMEOUT.
+REPEAT_INTERVAL = 0.2
+# Time a new client has to send its user ID (seconds)
+HANDSHAKE_TIMEOUT = 5.0
 
-# Function to listen for keyboard input and send messages
-def send_control_signals(clientsocket):
-    print("Control keys: [W] Forward, [S] Backward, [A] Left, [D] Right, [Q] Quit")
-    try:
+# Keys and the command they send, grouped by what they control. The
+# newest held key of each group wins, so steering and throttle keys can
+# be held together.
+KEY_COMMANDS = {
+    "w": ("throttle", "forward"),
+    "s": ("throttle", "backward"),
+    "q": ("throttle", "stop"),
+    "a": ("steering", "left"),
+    "f": ("steering", "full_left"),
+    "x": ("steering", "straight"),
+    "d": ("steering", "right"),
+    "g": ("steering", "full_right"),
+}
+# Sent while no key is held, changes nothing on the car
+HOLD_COMMAND = ("hold",)
+# Selects the next connected car, the number keys select a car by user ID
+NEXT_CAR_KEY = "tab"
+QUIT_KEY = "esc"
+
+
+# ==== Input Sources ====
+class KeyboardInput:
+    """
+    Key events from the keyboard library. The library calls back from
+    its own thread for every press, release and auto-repeat of a key,
+    so nothing polls the keyboard.
+    """
+
+    def __init__(self):
+        self._hook = None
+
+    def start(self, on_key):
+        """
+        Starts calling on_key(key, pressed) for every key event.
+        """
+        import keyboard
+
+        def handle(event):
+            if event.name is not None:
+                on_key(event.name.lower(),
+                       event.event_type == keyboard.KEY_DOWN)
+
+        self._hook = keyboard.hook(handle)
+
+    def stop(self):
+        if self._hook is not None:
+            import keyboard
+            keyboard.unhook(self._hook)
+            self._hook = None
+
+
+class ScriptedInput:
+    """
+    Replays a list of key events from a thread, to drive the server
+    from a script instead of the keyboard.
+
+    Parameters:
+        events (list of tuple): (time, key, pressed) in seconds after
+            start, pressed being False for a release.
+    """
+
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda event: event[0])
+        self.done = threading.Event()
+        self._stop = threading.Event()
+
+    def start(self, on_key):
+        threading.Thread(target=self._run, args=(on_key,), daemon=True).start()
+
+    def _run(self, on_key):
+        start = time.monotonic()
+        for at, key, pressed in self.events:
+            if self._stop.wait(max(0.0, start + at - time.monotonic())):
+                break
+            on_key(key, pressed)
+        self.done.set()
+
+    def stop(self):
+        self._stop.set()
+
+
+# ==== Control ====
+def encode_words(vehicle_id, sequence, capture_time, words):
+    """
+    Encodes a manual command, the words of a command are sent back to
+    back as the client's TextCommandReader expects them.
+    """
+    return "".join(words).encode()
+
+
+class ManualController(threading.Thread):
+    """
+    Turns key events into commands for the active car. The input source
+    only puts the events on a queue. This thread takes them off, keeps
+    track of the held keys, and posts the resulting command to the
+    command sender when it changes and every repeat_interval while a key
+    is held. While no key is held HOLD_COMMAND is posted every
+    repeat_interval, so the active car's client does not run into its
+    fail safe. Auto-repeated presses of a held key do not change
+    anything and are not sent, and the sender merges commands that come
+    faster than its send interval.
+
+    Parameters:
+        sender (CommandSender): Sends the commands to the cars.
+        registry (VehicleRegistry): The connected cars.
+        repeat_interval (float): How often the command of the held keys
+            is sent again (seconds).
+    """
+
+    def __init__(self, sender, registry, repeat_interval=REPEAT_INTERVAL):
+        super().__init__(name="manual-control", daemon=True)
+        self.sender = sender
+        self.registry = registry
+        self.repeat_interval = repeat_interval
+        self.active = None
+        self.finished = threading.Event()
+        self._events = queue.Queue()
+        # Held command keys and when they were pressed
+        self._held = {}
+        self._command = ()
+        self._next_repeat = None
+        self.stats = {"events": 0, "repeats_ignored": 0, "posted": 0}
+
+    def on_key(self, key, pressed):
+        """
+        Input source callback, never blocks.
+        """
+        self._events.put(("key", key, pressed))
+
+    def on_connect(self, vehicle_id):
+        """
+        Registry callback, makes the first car that connects active.
+        """
+        self._events.put(("connect", vehicle_id, None))
+
+    def stop(self):
+        self._events.put(("quit", None, None))
+
+    def run(self):
         while True:
-            if keyboard.is_pressed('w'):
-                message = "forward"
-                clientsocket.send(bytes(message, "utf-8"))
-                print(f"Sent: {message}")
-                time.sleep(0.2)
-
-            elif keyboard.is_pressed('s'):
-                message = "backward"
-                clientsocket.send(bytes(message, "utf-8"))
-                print(f"Sent: {message}")
-                time.sleep(0.2)
-
-            elif keyboard.is_pressed('x'):
-                message = "straight"
-                clientsocket.send(bytes(message, "utf-8"))
-                print(f"Sent: {message}")
-                time.sleep(0.2)
-
-            elif keyboard.is_pressed('a'):
-                message = "left"
-                clientsocket.send(bytes(message, "utf-8"))
-                print(f"Sent: {message}")
-                time.sleep(0.2)
-
-            elif keyboard.is_pressed('f'):
-                message = "full_left"
-                clientsocket.send(bytes(message, "utf-8"))
-                print(f"Sent: {message}")
-                time.sleep(0.2)
-
-            elif keyboard.is_pressed('d'):
-                message = "right"
-                clientsocket.send(bytes(message, "utf-8"))
-                print(f"Sent: {message}")
-                time.sleep(0.2)
-
-            elif keyboard.is_pressed('g'):
-                message = "full_right"
-                clientsocket.send(bytes(message, "utf-8"))
-                print(f"Sent: {message}")
-                time.sleep(0.2)
-
-            elif keyboard.is_pressed('q'):
-                message = "stop"
-                clientsocket.send(bytes(message, "utf-8"))
-                print(f"Sent: {message}") 
-    except Exception as e:
-        print(f"Error: {e}")
-
-# Main loop to accept client connections
-while True:
-    clientsocket, address = s.accept()
-    ip = address[0]
-    print(f"Connection from {ip} has been established.")
+            timeout = None
+            if self._next_repeat is not None:
+                timeout = max(0.0, self._next_repeat - time.monotonic())
+            try:
+                kind, key, pressed = self._events.get(timeout=timeout)
+            except queue.Empty:
+                self._send()
+                continue
+            if kind == "quit":
+                break
+            if kind == "connect":
+                if self.active not in self.registry:
+                    self._select(key)
+            else:
+                self.stats["events"] += 1
+                if not self._handle_key(key, pressed):
+                    break
+        self.finished.set()
+
+    def _handle_key(self, key, pressed):
+        """
+        Applies one key event. Returns False to quit.
+        """
+        if key in KEY_COMMANDS:
+            if pressed and key in self._held:
+                self.stats["repeats_ignored"] += 1
+                return True
+            if pressed:
+                self._held[key] = time.monotonic()
+            elif self._held.pop(key, None) is None:
+                return True
+            command = self._held_command()
+            if command != self._command:
+                self._command = command
+                if command:
+                    self._send()
+        elif not pressed:
+            pass
+        elif key == QUIT_KEY:
+            return False
+        elif key == NEXT_CAR_KEY:
+            cars = sorted(self.registry.connected())
+            if cars:
+                later = [car for car in cars
+                         if self.active is None or car > self.active]
+                self._select((later or cars)[0])
+        elif key.isdigit():
+            if int(key) in self.registry:
+                self._select(int(key))
+            else:
+                print(f"Car {key} is not connected")
+        return True
+
+    def _held_command(self):
+        """
+        The newest held key of each group, steering first.
+        """
+        newest = {}
+        for key in sorted(self._held, key=self._held.get):
+            group, word = KEY_COMMANDS[key]
+            newest[group] = word
+        return tuple(newest[group] for group in ("steering", "throttle")
+                     if group in newest)
+
+    def _select(self, vehicle_id):
+        if vehicle_id != self.active:
+            self.active = vehicle_id
+            print(f"Controlling car {vehicle_id}")
+            self._send()
+
+    def _send(self):
+        if self.active is not None:
+            if self.sender.post(self.active, self._command or HOLD_COMMAND):
+                self.stats["posted"] += 1
+        self._next_repeat = time.monotonic() + self.repeat_interval
+
+
+def start_server(server_socket, input_source, send_interval=SEND_INTERVAL,
+                 repeat_interval=REPEAT_INTERVAL):
+    """
+    Starts accepting cars on server_socket and controlling them from
+    input_source, in background threads.
+
+    Returns:
+        tuple: The ManualController, VehicleRegistry and CommandSender.
+    """
+    def forget(vehicle_id, reason, sock):
+        if registry.remove(vehicle_id, sock) is not None:
+            print(f"Car {vehicle_id} disconnected: {reason}")
+
+    def register(vehicle, replaced):
+        sender.register(vehicle.vehicle_id, vehicle.sock)
+        print(f"Mapped IP {vehicle.address[0]} to user ID "
+              f"{vehicle.vehicle_id}")
+        controller.on_connect(vehicle.vehicle_id)
+
+    sender = CommandSender(send_interval, encode=encode_words, on_drop=forget)
+    # The command sender closes the sockets of the cars
+    registry = VehicleRegistry(server_socket, HANDSHAKE_TIMEOUT,
+                               on_connect=register, close_sockets=False)
+    controller = ManualController(sender, registry, repeat_interval)
+    controller.start()
+    sender.start()
+    registry.start()
+    input_source.start(controller.on_key)
+    return controller, registry, sender
+
+def stop_server(controller, registry, sender, input_source):
+    input_source.stop()
+    controller.stop()
+    controller.join(timeout=2.0)
+    registry.stop()
+    sender.stop()
+
+
+# ==== Start of the Program ====
+if __name__ == "__main__":
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(("", SERVER_PORT))
+    s.listen(5)
+    print("Server is now running, waiting for a connection...")
+    print("Control keys: [W] Forward, [S] Backward, [Q] Stop, [A] Left, "
+          "[F] Full left, [X] Straight, [D] Right, [G] Full right")
+    print("[Tab] Next car, [1]-[9] Car by user ID, [Esc] Quit")
 
+    keys = KeyboardInput()
+    parts = start_server(s, keys)
     try:
-        # Receive the user number from the client (assumes it's sent right after connecting)
-        user_data = clientsocket.recv(1024)
-        user_id = int(user_data.decode().strip())
-        ip_to_user[ip] = user_id
-        print(f"Mapped IP {ip} to user ID {user_id}")
-    except Exception as e:
-        print(f"Failed to receive or parse user ID from {ip}: {e}")
-        clientsocket.close()
-        continue
-
-    # Start the keyboard control in a separate thread
-    send_control_signals(clientsocket)
+        # Waiting in steps keeps Ctrl+C working on Windows
+        while not parts[0].finished.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        pass
+    stop_server(*parts, keys)
+    s.close()
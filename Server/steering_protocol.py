@@ -0,0 +1,165 @@
+# Binary steering protocol shared by the server and the vehicles.
+# Server/steering_protocol.py and Client/steering_protocol.py must be
+# kept identical.
+import math
+import struct
+from collections import namedtuple
+
+VERSION = 2
+
+# Message types
+COMMAND = 0  # Server -> vehicle: steer and throttle
+HELLO = 1    # Vehicle -> server: UDP address announcement
+ACK = 2      # Vehicle -> server: command applied, capture_time holds
+             # the vehicle's time.time() when the servo was set
+HEARTBEAT = 3  # Vehicle -> server: still connected, over TCP
+
+# version, type, vehicle id, sequence, capture time, servo angle,
+# throttle, hold time. Little endian, 24 bytes.
+MESSAGE = struct.Struct("<BBHIdhfH")
+MESSAGE_SIZE = MESSAGE.size
+# Unit of the ACK's hold time (seconds). It is rounded down, so the
+# round trip is never underestimated, and holds over 6.5 s are capped.
+HOLD_TIME_UNIT = 0.0001
+
+# Throttle value meaning "leave the throttle as it is"
+NO_THROTTLE = float("nan")
+
+SteeringMessage = namedtuple(
+    "SteeringMessage",
+    "kind vehicle_id sequence capture_time angle throttle hold_time")
+
+
+def pack_message(kind, vehicle_id, sequence=0, capture_time=0.0, angle=0,
+                 throttle=NO_THROTTLE, hold_time=0.0):
+    """
+    Packs one fixed size message.
+
+    Parameters:
+        kind (int): Message type, COMMAND, HELLO or ACK.
+        vehicle_id (int): ID of the vehicle (its ArUco marker).
+        sequence (int): Per vehicle message counter, wraps at 2**32.
+        capture_time (float): time.time() when the camera frame the
+            command is based on was captured.
+        angle (int): Servo angle in degrees.
+        throttle (float): Motor PWM value, NO_THROTTLE to keep it.
+        hold_time (float): ACK only, seconds from the vehicle receiving
+            the command to setting the servo.
+
+    Returns:
+        bytes: MESSAGE_SIZE bytes.
+    """
+    hold = min(max(int(hold_time / HOLD_TIME_UNIT), 0), 0xFFFF)
+    return MESSAGE.pack(VERSION, kind, vehicle_id, sequence & 0xFFFFFFFF,
+                        capture_time, angle, throttle, hold)
+
+def pack_command(vehicle_id, sequence, capture_time, angle,
+                 throttle=NO_THROTTLE):
+    """
+    Packs a steering command, see pack_message.
+    """
+    return pack_message(COMMAND, vehicle_id, sequence, capture_time, angle,
+                        throttle)
+
+def pack_ack(vehicle_id, sequence, applied_time, hold_time=0.0):
+    """
+    Packs the acknowledgement of an applied command.
+
+    Parameters:
+        vehicle_id (int): ID of the vehicle.
+        sequence (int): Sequence number of the applied command.
+        applied_time (float): The vehicle's time.time() right after the
+            servo was set.
+        hold_time (float): Seconds from receiving the command to
+            applied_time.
+    """
+    return pack_message(ACK, vehicle_id, sequence, applied_time,
+                        hold_time=hold_time)
+
+def unpack_message(data):
+    """
+    Unpacks one message.
+
+    Parameters:
+        data (bytes): Exactly MESSAGE_SIZE bytes.
+
+    Returns:
+        SteeringMessage: The decoded message.
+
+    Raises:
+        ValueError: If the size or version is wrong.
+    """
+    if len(data) != MESSAGE_SIZE:
+        raise ValueError(f"Expected {MESSAGE_SIZE} bytes, got {len(data)}")
+    version, kind, vehicle_id, sequence, capture_time, angle, throttle, \
+        hold = MESSAGE.unpack(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported protocol version {version}")
+    return SteeringMessage(kind, vehicle_id, sequence, capture_time, angle,
+                           throttle, hold * HOLD_TIME_UNIT)
+
+def has_throttle(message):
+    """
+    True if the message sets the throttle.
+    """
+    return not math.isnan(message.throttle)
+
+
+class MessageReader:
+    """
+    Splits a TCP byte stream into messages.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Adds received bytes and returns the complete messages in them.
+        """
+        self._buffer += data
+        count = len(self._buffer) // MESSAGE_SIZE
+        messages = [unpack_message(bytes(self._buffer[i * MESSAGE_SIZE:
+                                                     (i + 1) * MESSAGE_SIZE]))
+                    for i in range(count)]
+        del self._buffer[:count * MESSAGE_SIZE]
+        return messages
+
+
+class SequenceFilter:
+    """
+    Drops commands that arrive out of order or too late. Over UDP an
+    old angle can arrive after a newer one, and applying it would steer
+    the car with outdated information.
+
+    Parameters:
+        max_age (float, optional): Drop commands whose capture time is
+            older than this many seconds. Needs the clock offset between
+            server and vehicle.
+        clock_offset (float): Server clock minus vehicle clock (seconds).
+    """
+
+    def __init__(self, max_age=None, clock_offset=0.0):
+        self.max_age = max_age
+        self.clock_offset = clock_offset
+        self.last_sequence = None
+        self.dropped = 0
+
+    def accept(self, message, now=None):
+        """
+        Returns True if the message is newer than every message accepted
+        before and not too old.
+        """
+        if self.last_sequence is not None:
+            # Serial number arithmetic, handles the wrap at 2**32
+            if (message.sequence - self.last_sequence) & 0xFFFFFFFF >= 0x80000000 \
+                    or message.sequence == self.last_sequence:
+                self.dropped += 1
+                return False
+        if self.max_age is not None and now is not None:
+            age = now + self.clock_offset - message.capture_time
+            if age > self.max_age:
+                self.dropped += 1
+                return False
+        self.last_sequence = message.sequence
+        return True
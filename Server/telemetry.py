@@ -0,0 +1,187 @@
+import collections
+import threading
+import time
+
+import numpy as np
+
+# What happened to a steering command
+QUEUED = 0      # Decided from a frame and handed to the command sender
+SENT = 1        # Written to the vehicle's socket
+KEEPALIVE = 2   # Unchanged angle repeated so the vehicle knows we are there
+DROPPED = 3     # The vehicle was dropped after a send error
+OUTCOMES = ("queued", "sent", "keepalive", "dropped")
+
+# One record, 32 bytes. Values that are not known for an outcome (the
+# target of a sent command, the angle of a dropped vehicle) are NaN or
+# -1.
+RECORD_DTYPE = np.dtype([
+    ("time", "<f8"),          # time.time() when it happened
+    ("marker_id", "<i2"),
+    ("angle", "<i2"),         # Servo angle
+    ("outcome", "u1"),
+    ("heading", "<f4"),       # Marker heading in degrees
+    ("point", "<f4", (2,)),   # Best boundary point (x, y)
+    ("score", "<f4"),         # Score of the best point, lower is better
+], align=True)
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"),
+    ("version", "<u4"),
+    ("capacity", "<u8"),
+    ("written", "<u8"),       # Records written since the file was created
+    ("record_size", "<u4"),
+])
+HEADER_SIZE = 64
+MAGIC = b"ATLM"
+VERSION = 1
+
+
+class TelemetryRing:
+    """
+    Preallocated file of fixed-size telemetry records, memory mapped so
+    that writing a batch is a copy into memory. When the file is full
+    the oldest records are overwritten. The header counts every record
+    ever written, which tells a reader where the ring starts.
+
+    Parameters:
+        path (str): File to create, an existing one is overwritten.
+        capacity (int): Number of records kept.
+    """
+
+    def __init__(self, path, capacity=100000):
+        self.path = path
+        self.capacity = capacity
+        size = HEADER_SIZE + capacity * RECORD_DTYPE.itemsize
+        with open(path, "wb") as f:
+            f.truncate(size)
+        self._header = np.memmap(path, HEADER_DTYPE, "r+", 0, (1,))
+        self._records = np.memmap(path, RECORD_DTYPE, "r+", HEADER_SIZE,
+                                  (capacity,))
+        header = self._header[0]
+        header["magic"] = MAGIC
+        header["version"] = VERSION
+        header["capacity"] = capacity
+        header["record_size"] = RECORD_DTYPE.itemsize
+        self.written = 0
+
+    def write(self, records):
+        """
+        Appends a structured array of records.
+        """
+        count = len(records)
+        # Only the newest capacity records of a huge batch survive
+        records = records[-self.capacity:]
+        start = (self.written + count - len(records)) % self.capacity
+        first = min(len(records), self.capacity - start)
+        self._records[start:start + first] = records[:first]
+        self._records[:len(records) - first] = records[first:]
+        self.written += count
+        # The count goes last, a reader never sees it ahead of the data
+        self._header["written"] = self.written
+
+    def flush(self):
+        self._records.flush()
+        self._header.flush()
+
+    def close(self):
+        self.flush()
+        self._records = self._header = None
+
+
+class TelemetryRecorder:
+    """
+    Records steering telemetry without slowing down the threads that
+    produce it. record() only appends a tuple to a deque, and a
+    background thread turns the waiting tuples into records and writes
+    them to a TelemetryRing in batches.
+
+    Parameters:
+        path (str): Ring file, see TelemetryRing.
+        capacity (int): Number of records kept in the file.
+        flush_interval (float): How often the background thread writes
+            (seconds).
+    """
+
+    def __init__(self, path, capacity=100000, flush_interval=0.1):
+        self.ring = TelemetryRing(path, capacity)
+        self.flush_interval = flush_interval
+        self._pending = collections.deque()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="telemetry",
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def record(self, marker_id, angle, outcome, heading=float("nan"),
+               point=None, score=float("nan")):
+        """
+        Adds one record, stamped with the current time. Safe to call
+        from any thread.
+
+        Parameters:
+            marker_id (int): ID of the vehicle's ArUco marker.
+            angle (int): Servo angle, -1 if there is none.
+            outcome (int): QUEUED, SENT, KEEPALIVE or DROPPED.
+            heading (float): Marker heading in degrees.
+            point (array-like, optional): Best boundary point (x, y).
+            score (float): Score of the best point.
+        """
+        if point is None:
+            x = y = float("nan")
+        else:
+            x, y = point
+        self._pending.append((time.time(), marker_id, angle, outcome,
+                              heading, (x, y), score))
+
+    def flush(self):
+        """
+        Writes the waiting records to the ring.
+        """
+        count = len(self._pending)
+        if count == 0:
+            return
+        batch = [self._pending.popleft() for _ in range(count)]
+        self.ring.write(np.array(batch, dtype=RECORD_DTYPE))
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        """
+        Writes what is left and closes the file.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=2.0)
+        self.flush()
+        self.ring.close()
+
+
+def load_telemetry(path):
+    """
+    Reads a telemetry ring file.
+
+    Parameters:
+        path (str): File written by a TelemetryRing.
+
+    Returns:
+        np.ndarray: Structured array with RECORD_DTYPE, oldest record
+            first.
+
+    Raises:
+        ValueError: If the file is not a telemetry ring of this version.
+    """
+    header = np.fromfile(path, HEADER_DTYPE, count=1)
+    if (len(header) == 0 or header[0]["magic"] != MAGIC
+            or header[0]["version"] != VERSION
+            or header[0]["record_size"] != RECORD_DTYPE.itemsize):
+        raise ValueError(f"{path} is not a version {VERSION} telemetry file")
+    capacity = int(header[0]["capacity"])
+    written = int(header[0]["written"])
+    records = np.fromfile(path, RECORD_DTYPE, count=capacity,
+                          offset=HEADER_SIZE)
+    if written <= capacity:
+        return records[:written]
+    start = written % capacity
+    return np.concatenate([records[start:], records[:start]])
@@ -0,0 +1,278 @@
+import math
+
+import cv2
+import numpy as np
+
+TAPE_COLOR = (0, 220, 230)
+FLOOR_COLOR = (90, 90, 90)
+# Servo angles the cars accept, 90 is straight, smaller steers left
+MIN_SERVO = 48
+MAX_SERVO = 132
+
+
+class SimCar:
+    """
+    Pose and controls of one simulated car. x and y are the middle of
+    the rear axle in pixels, where the marker is mounted, and heading is
+    in degrees like estimate_heading (0 points right, 90 up).
+    """
+    __slots__ = ("marker_id", "x", "y", "heading", "servo", "pending",
+                 "departures", "steps", "offset_squares", "steering_travel")
+
+    def __init__(self, marker_id, x, y, heading):
+        self.marker_id = marker_id
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.servo = 90
+        # (apply time, servo angle) of commands still on their way
+        self.pending = []
+        self.departures = 0
+        # For the oscillation: squared distances from the middle of the
+        # lane and how far the servo turned, summed over the steps
+        self.steps = 0
+        self.offset_squares = 0.0
+        self.steering_travel = 0
+
+
+class TrackSimulator:
+    """
+    Headless stand-in for the camera, track and cars. The track is a
+    lane between two ellipses of yellow tape seen from above. Every car
+    carries a marker of the given dictionary, its top edge facing
+    forward, and moves with the kinematic bicycle model: it drives at a
+    constant speed and turns with the steering angle set by its servo.
+
+    A car whose center leaves the lane counts as a lane departure and
+    is put back on the middle of the lane next to where it left, facing
+    along the lane. How much a car weaves is kept as its distance from
+    the middle of the lane (see lane_offset) and the total angle its
+    servo turned. Everything runs on simulated time, so it runs as
+    fast as the frames can be rendered and processed.
+
+    Parameters:
+        dictionary: ArUco dictionary of the markers, e.g. DICT_4X4_50.
+        width, height (int): Frame size in pixels.
+        lane_width (int): Distance between the two tapes (pixels).
+        tape (int): Width of the tape (pixels).
+        marker_size (int): Side of a marker without its white border.
+        speed (float): Speed of every car (pixels per second).
+        wheelbase (float): Distance between the axles (pixels).
+        max_steer (float): Steering angle at the ends of the servo
+            range (degrees).
+        command_delay (float): Time from a servo command to the servo
+            turning (seconds), the network and servo latency.
+        dt (float): Simulated time per step (seconds).
+    """
+
+    def __init__(self, dictionary, width=640, height=480, lane_width=120,
+                 tape=10, marker_size=36, speed=100.0, wheelbase=40.0,
+                 max_steer=30.0, command_delay=0.0, dt=1 / 30):
+        self.dictionary = dictionary
+        self.width = width
+        self.height = height
+        self.lane_width = lane_width
+        self.marker_size = marker_size
+        self.speed = speed
+        self.wheelbase = wheelbase
+        self.max_steer = max_steer
+        self.command_delay = command_delay
+        self.dt = dt
+        self.time = 0.0
+        self.cars = {}
+
+        # Middle of the lane
+        self.center = (width / 2, height / 2)
+        margin = tape + 10
+        self.axes = (width / 2 - margin - lane_width / 2,
+                     height / 2 - margin - lane_width / 2)
+        self.background, self.lane, self.middle = self._draw_track(tape)
+        self._images = {}
+
+    def _draw_track(self, tape):
+        """
+        Renders the empty track, the mask of the lane (255 between the
+        middles of the two tapes) and the distance of every pixel from
+        the middle of the lane.
+        """
+        frame = np.full((self.height, self.width, 3), FLOOR_COLOR,
+                        dtype=np.uint8)
+        lane = np.zeros((self.height, self.width), dtype=np.uint8)
+        center = tuple(round(c) for c in self.center)
+        outer = tuple(round(a + self.lane_width / 2) for a in self.axes)
+        inner = tuple(round(a - self.lane_width / 2) for a in self.axes)
+        cv2.ellipse(lane, center, outer, 0, 0, 360, 255, -1)
+        cv2.ellipse(lane, center, inner, 0, 0, 360, 0, -1)
+        for axes in (outer, inner):
+            cv2.ellipse(frame, center, axes, 0, 0, 360, TAPE_COLOR, tape)
+        middle = np.full((self.height, self.width), 255, dtype=np.uint8)
+        cv2.ellipse(middle, center, tuple(round(a) for a in self.axes), 0, 0,
+                    360, 0, 1)
+        middle = cv2.distanceTransform(middle, cv2.DIST_L2, 3)
+        return frame, lane, middle
+
+    def lane_pose(self, phase):
+        """
+        Point on the middle of the lane at phase (radians, counter
+        clockwise from the right) and the heading along it.
+        """
+        a, b = self.axes
+        x = self.center[0] + a * math.cos(phase)
+        y = self.center[1] - b * math.sin(phase)
+        heading = math.degrees(math.atan2(b * math.cos(phase),
+                                          -a * math.sin(phase)))
+        return x, y, heading % 360
+
+    def add_cars(self, count, first_id=0):
+        """
+        Places count cars evenly spaced along the middle of the lane,
+        driving counter clockwise.
+        """
+        for i in range(count):
+            x, y, heading = self.lane_pose(2 * math.pi * i / count)
+            marker_id = first_id + i
+            self.cars[marker_id] = SimCar(marker_id, x, y, heading)
+
+    def set_servo(self, marker_id, angle):
+        """
+        Sends a servo angle to a car, applied after command_delay.
+        """
+        car = self.cars.get(marker_id)
+        if car is not None:
+            angle = min(MAX_SERVO, max(MIN_SERVO, angle))
+            car.pending.append((self.time + self.command_delay, angle))
+
+    def step(self):
+        """
+        Advances the simulation by dt.
+
+        Returns:
+            list of int: Markers of the cars that left the lane.
+        """
+        self.time += self.dt
+        departed = []
+        for car in self.cars.values():
+            while car.pending and car.pending[0][0] <= self.time:
+                servo = car.pending.pop(0)[1]
+                car.steering_travel += abs(servo - car.servo)
+                car.servo = servo
+            # Servo below 90 turns left, which is counter clockwise
+            steer = (90 - car.servo) / (90 - MIN_SERVO) * self.max_steer
+            heading = math.radians(car.heading)
+            distance = self.speed * self.dt
+            car.x += distance * math.cos(heading)
+            car.y -= distance * math.sin(heading)
+            turn = distance / self.wheelbase * math.tan(math.radians(steer))
+            car.heading = (car.heading + math.degrees(turn)) % 360
+            if not self._on_lane(car):
+                car.departures += 1
+                departed.append(car.marker_id)
+                self._put_back(car)
+            car.steps += 1
+            car.offset_squares += self.lane_offset(car) ** 2
+        return departed
+
+    def lane_offset(self, car):
+        """
+        Distance of a car from the middle of the lane (pixels).
+        """
+        x = min(max(round(car.x), 0), self.width - 1)
+        y = min(max(round(car.y), 0), self.height - 1)
+        return float(self.middle[y, x])
+
+    def _on_lane(self, car):
+        x, y = round(car.x), round(car.y)
+        return (0 <= x < self.width and 0 <= y < self.height
+                and self.lane[y, x] > 0)
+
+    def _put_back(self, car):
+        a, b = self.axes
+        phase = math.atan2(-(car.y - self.center[1]) / b,
+                           (car.x - self.center[0]) / a)
+        car.x, car.y, car.heading = self.lane_pose(phase)
+        car.servo = 90
+        car.pending.clear()
+
+    def marker_image(self, marker_id):
+        """
+        The marker with a white border, as a grayscale image.
+        """
+        image = self._images.get(marker_id)
+        if image is None:
+            size = self.marker_size
+            if hasattr(cv2.aruco, "generateImageMarker"):
+                image = cv2.aruco.generateImageMarker(self.dictionary,
+                                                      marker_id, size)
+            else:
+                image = cv2.aruco.drawMarker(self.dictionary, marker_id, size)
+            border = size // 4
+            image = cv2.copyMakeBorder(image, border, border, border, border,
+                                       cv2.BORDER_CONSTANT, value=255)
+            self._images[marker_id] = image
+        return image
+
+    def render(self):
+        """
+        Draws the track with every car's marker at its pose.
+
+        Returns:
+            np.ndarray: BGR frame.
+        """
+        frame = self.background.copy()
+        for car in self.cars.values():
+            self._draw_marker(frame, car)
+        return frame
+
+    def _marker_matrix(self, car, side):
+        """
+        Affine matrix from the marker image to the frame, the marker's
+        top edge pointing along the heading.
+        """
+        matrix = cv2.getRotationMatrix2D((side / 2, side / 2),
+                                         car.heading - 90, 1.0)
+        matrix[0, 2] += car.x - side / 2
+        matrix[1, 2] += car.y - side / 2
+        return matrix
+
+    def marker_corners(self, marker_id):
+        """
+        Where a car's marker is drawn in the frame: its four outer
+        corners without the white border, in the order detectMarkers
+        returns them (top left, top right, bottom right, bottom left of
+        the upright marker).
+
+        Returns:
+            np.ndarray: float32 array with shape (4, 2).
+        """
+        car = self.cars[marker_id]
+        side = self.marker_image(marker_id).shape[0]
+        border = (side - self.marker_size) / 2
+        # Pixel centers are at whole coordinates, so the marker's edges
+        # lie half a pixel outside its first and last pixels
+        low, high = border - 0.5, side - border - 0.5
+        corners = np.array([[low, low], [high, low], [high, high],
+                            [low, high]])
+        matrix = self._marker_matrix(car, side)
+        return (corners @ matrix[:, :2].T + matrix[:, 2]).astype(np.float32)
+
+    def _draw_marker(self, frame, car):
+        image = self.marker_image(car.marker_id)
+        side = image.shape[0]
+        # Bounding square of the marker at any rotation
+        reach = int(math.ceil(side / math.sqrt(2))) + 1
+        cx, cy = round(car.x), round(car.y)
+        x0, y0 = max(cx - reach, 0), max(cy - reach, 0)
+        x1 = min(cx + reach, self.width)
+        y1 = min(cy + reach, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        matrix = self._marker_matrix(car, side)
+        matrix[0, 2] -= x0
+        matrix[1, 2] -= y0
+        region = frame[y0:y1, x0:x1]
+        gray = np.empty(region.shape[:2], dtype=np.uint8)
+        mask = cv2.warpAffine(np.full_like(image, 255), matrix,
+                              (x1 - x0, y1 - y0), flags=cv2.INTER_NEAREST)
+        cv2.warpAffine(image, matrix, (x1 - x0, y1 - y0), dst=gray,
+                       flags=cv2.INTER_LINEAR)
+        region[mask > 0] = gray[mask > 0, np.newaxis]
@@ -0,0 +1,301 @@
+"""
+Tunes the ArUco detector parameters for speed versus recall. Sweeps
+the main aruco.DetectorParameters fields (the adaptive threshold
+window sizes, the minimum marker perimeter and the corner refinement)
+over simulated frames, or over a recorded clip. Each
+configuration is scored by its recall, its false detections, its
+corner error and the time detectMarkers takes per frame.
+
+The simulated frames come from track_simulator.py, with the cars at
+random places on the lane, and made harder with blur, noise and uneven
+light. The true corners of every marker are known there. A recording
+has no ground truth, so what a slow, thorough configuration finds in
+it is taken as the truth instead.
+
+The configurations on the Pareto front are printed. No other
+configuration is better in one of recall, corner error and time
+without being worse in another. The fastest of them whose recall is
+at most --recall-slack below the OpenCV defaults', with no more false
+detections and corner error, is written to --output. Set
+DETECTOR_PARAMETERS_FILE in aruco_edge_detector.py to that file to
+use it.
+
+Usage:
+    python tune_detector.py [--frames 40] [--cars 8] [--marker-size 24]
+                            [--noise 6] [--blur 0.8] [--lighting 0.5]
+                            [--recall-slack 0.01] [--video clip.avi]
+                            [--output detector.json]
+"""
+import argparse
+import itertools
+import math
+import time
+
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+
+import aruco_edge_detector as detector
+from detector_config import make_detector_parameters, save_detector_settings
+from track_simulator import TrackSimulator
+
+# (adaptiveThreshWinSizeMin, adaptiveThreshWinSizeMax,
+# adaptiveThreshWinSizeStep), each window size is one thresholding
+# pass. (3, 23, 10) is the OpenCV default: 3, 13 and 23.
+THRESHOLD_WINDOWS = [(3, 23, 10), (3, 33, 10), (3, 13, 10), (5, 15, 10),
+                     (7, 7, 10), (13, 13, 10), (23, 23, 10)]
+MIN_PERIMETER_RATES = [0.03, 0.01, 0.05, 0.08]
+# maxMarkerPerimeterRate is not swept: it hardly changes the time of a
+# full frame scan, and MarkerTracker ignores it for its crops, where a
+# marker is a large part of the image
+CORNER_REFINEMENTS = ["none", "subpix", "contour"]
+# What a recording is compared against
+REFERENCE = {"adaptiveThreshWinSizeMin": 3, "adaptiveThreshWinSizeMax": 53,
+             "adaptiveThreshWinSizeStep": 4, "minMarkerPerimeterRate": 0.01,
+             "cornerRefinementMethod": "subpix"}
+# A detection whose corners are further than this from the marker's
+# (mean, pixels) counts as false
+MATCH_DISTANCE = 5.0
+
+
+def configurations():
+    """
+    Every combination of the swept values, the defaults first.
+    """
+    for windows, low, refine in itertools.product(
+            THRESHOLD_WINDOWS, MIN_PERIMETER_RATES, CORNER_REFINEMENTS):
+        yield {"adaptiveThreshWinSizeMin": windows[0],
+               "adaptiveThreshWinSizeMax": windows[1],
+               "adaptiveThreshWinSizeStep": windows[2],
+               "minMarkerPerimeterRate": low,
+               "cornerRefinementMethod": refine}
+
+def degrade(frame, rng, noise, blur, lighting):
+    """
+    Blurs the frame, darkens it from left to right by up to lighting
+    (a fraction) and adds Gaussian noise with noise as its standard
+    deviation.
+    """
+    if blur:
+        frame = cv2.GaussianBlur(frame, (0, 0), blur)
+    image = frame.astype(np.float32)
+    if lighting:
+        image *= np.linspace(1.0, 1.0 - lighting, frame.shape[1],
+                             dtype=np.float32)[np.newaxis, :, np.newaxis]
+    if noise:
+        image += rng.normal(0, noise, image.shape).astype(np.float32)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+def simulated_frames(args):
+    """
+    Grayscale frames with the cars at random places on the lane, and
+    the true corners of their markers.
+
+    Returns:
+        list of tuple: (gray, {marker_id: corners}) per frame.
+    """
+    rng = np.random.default_rng(0)
+    simulator = TrackSimulator(detector.aruco_dict, args.width, args.height,
+                               marker_size=args.marker_size)
+    simulator.add_cars(args.cars)
+    frames = []
+    for _ in range(args.frames):
+        for i, car in enumerate(simulator.cars.values()):
+            # Spread out so that the markers never overlap
+            phase = 2 * math.pi * (i + rng.uniform(0, 0.5)) / args.cars
+            car.x, car.y, car.heading = simulator.lane_pose(phase)
+            car.x += rng.uniform(-15, 15)
+            car.y += rng.uniform(-15, 15)
+            car.heading = (car.heading + rng.uniform(-30, 30)) % 360
+        frame = degrade(simulator.render(), rng, args.noise, args.blur,
+                        args.lighting)
+        truth = {marker_id: simulator.marker_corners(marker_id)
+                 for marker_id in simulator.cars}
+        frames.append((cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), truth))
+    return frames
+
+def recorded_frames(path, count):
+    """
+    Up to count grayscale frames of a video and the markers the
+    REFERENCE configuration finds in them.
+    """
+    capture = cv2.VideoCapture(path)
+    parameters = make_detector_parameters(REFERENCE)
+    frames = []
+    while len(frames) < count:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        corners, ids, _ = aruco.detectMarkers(gray, detector.aruco_dict,
+                                              parameters=parameters)
+        truth = {}
+        if ids is not None:
+            truth = {int(marker_id): corner[0]
+                     for marker_id, corner in zip(ids.ravel(), corners)}
+        frames.append((gray, truth))
+    capture.release()
+    return frames
+
+def evaluate(frames, settings, repeat=2):
+    """
+    Detects the markers of every frame with the settings.
+
+    Returns:
+        dict: recall (share of the true markers found), false (wrong
+            detections per frame), error (mean corner distance of the
+            found markers, pixels) and ms (detectMarkers time per
+            frame, the fastest of repeat runs).
+    """
+    parameters = make_detector_parameters(settings)
+    found = markers = false = 0
+    errors = []
+    seconds = 0.0
+    for gray, truth in frames:
+        fastest = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            corners, ids, _ = aruco.detectMarkers(gray, detector.aruco_dict,
+                                                  parameters=parameters)
+            elapsed = time.perf_counter() - start
+            fastest = elapsed if fastest is None else min(fastest, elapsed)
+        seconds += fastest
+        markers += len(truth)
+        matched = set()
+        for marker_id, corner in zip(() if ids is None else ids.ravel(),
+                                     corners):
+            expected = truth.get(int(marker_id))
+            if expected is None or marker_id in matched:
+                false += 1
+                continue
+            error = float(np.linalg.norm(corner[0] - expected, axis=1).mean())
+            if error > MATCH_DISTANCE:
+                false += 1
+                continue
+            matched.add(marker_id)
+            errors.append(error)
+        found += len(matched)
+    return {"recall": found / markers if markers else 1.0,
+            "false": false / len(frames),
+            "error": float(np.mean(errors)) if errors else math.inf,
+            "ms": seconds / len(frames) * 1000}
+
+def dominates(a, b):
+    """
+    True if result a is at least as good as b in recall, corner error
+    and time, and better in one of them.
+    """
+    at_least = (a["recall"] >= b["recall"] and a["error"] <= b["error"]
+                and a["ms"] <= b["ms"])
+    better = (a["recall"] > b["recall"] or a["error"] < b["error"]
+              or a["ms"] < b["ms"])
+    return at_least and better
+
+def pareto_front(results):
+    """
+    The (settings, result) pairs no other pair dominates, fastest first.
+    """
+    front = [(settings, result) for settings, result in results
+             if not any(dominates(other, result) for _, other in results)]
+    return sorted(front, key=lambda pair: pair[1]["ms"])
+
+def choose(front, baseline, recall_slack=0.0):
+    """
+    The fastest configuration of the front that is no worse than the
+    baseline in false detections and corner error, and whose recall is
+    at most recall_slack below it. None if there is none.
+    """
+    for settings, result in front:
+        if (result["recall"] >= baseline["recall"] - recall_slack
+                and result["false"] <= baseline["false"]
+                and result["error"] <= baseline["error"]):
+            return settings, result
+    return None
+
+def describe(settings):
+    return (f"{settings['adaptiveThreshWinSizeMin']:>2}-"
+            f"{settings['adaptiveThreshWinSizeMax']:<2}/"
+            f"{settings['adaptiveThreshWinSizeStep']:<2} "
+            f"{settings['minMarkerPerimeterRate']:5.2f} "
+            f"{settings['cornerRefinementMethod']:>7}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--video", help="Recorded clip instead of simulated "
+                        "frames")
+    parser.add_argument("--frames", type=int, default=40)
+    parser.add_argument("--cars", type=int, default=8)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--marker-size", type=int, default=24,
+                        help="Marker side in pixels without its border")
+    parser.add_argument("--noise", type=float, default=6.0,
+                        help="Standard deviation of the pixel noise")
+    parser.add_argument("--blur", type=float, default=0.8,
+                        help="Sigma of the Gaussian blur in pixels")
+    parser.add_argument("--lighting", type=float, default=0.5,
+                        help="How much darker the right edge is (0-1)")
+    parser.add_argument("--repeat", type=int, default=2,
+                        help="Runs per frame, the fastest is timed")
+    parser.add_argument("--recall-slack", type=float, default=0.01,
+                        help="Recall the chosen configuration may lose "
+                        "against the defaults (0-1)")
+    parser.add_argument("--output", default="detector.json")
+    args = parser.parse_args()
+
+    if args.video:
+        frames = recorded_frames(args.video, args.frames)
+        source = f"{args.video}, {len(frames)} frames"
+    else:
+        frames = simulated_frames(args)
+        source = (f"{len(frames)} simulated {args.width}x{args.height} "
+                  f"frames, {args.cars} markers of {args.marker_size} px, "
+                  f"noise {args.noise}, blur {args.blur}, "
+                  f"lighting {args.lighting}")
+    if not frames:
+        parser.error(f"no frames in {args.video}")
+    print(f"Sweeping on {source}")
+
+    start = time.perf_counter()
+    results = [(settings, evaluate(frames, settings, args.repeat))
+               for settings in configurations()]
+    baseline = results[0][1]
+    print(f"{len(results)} configurations in "
+          f"{time.perf_counter() - start:.0f} s")
+
+    front = pareto_front(results)
+    chosen = choose(front, baseline, args.recall_slack)
+    print("\nPareto front (windows min-max/step, minimum perimeter rate, "
+          "refinement):")
+    print(f"  {'configuration':<25} {'recall':>7} {'false':>6} "
+          f"{'error px':>9} {'ms':>6}")
+    rows = front if any(pair[0] is results[0][0] for pair in front) \
+        else [results[0]] + front
+    for settings, result in rows:
+        mark = ""
+        if settings is results[0][0]:
+            mark = "  defaults"
+        if chosen is not None and settings is chosen[0]:
+            mark += "  chosen"
+        print(f"  {describe(settings):<25} {result['recall']:7.1%} "
+              f"{result['false']:6.2f} {result['error']:9.3f} "
+              f"{result['ms']:6.2f}{mark}")
+
+    if chosen is None:
+        print("\nNothing on the front is as good as the defaults, "
+              "nothing written")
+        return
+    settings, result = chosen
+    save_detector_settings(args.output, settings,
+                           {"recall": result["recall"],
+                            "false_per_frame": result["false"],
+                            "corner_error_px": result["error"],
+                            "detect_ms": result["ms"],
+                            "defaults_detect_ms": baseline["ms"]},
+                           source)
+    print(f"\n{baseline['ms'] / result['ms']:.1f}x faster than the defaults, "
+          f"written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import selectors
+import socket
+import threading
+import time
+
+
+class Vehicle:
+    """
+    One connected vehicle. Only the registry replaces a Vehicle, its
+    fields are updated in place by the threads that own them: the
+    command sender sets last_angle and last_send, and the receiving
+    threads call VehicleRegistry.touch.
+    """
+    __slots__ = ("vehicle_id", "sock", "address", "connected_at", "last_seen",
+                 "heard", "last_angle", "last_send", "reader")
+
+    def __init__(self, vehicle_id, sock, address, now):
+        self.vehicle_id = vehicle_id
+        self.sock = sock
+        self.address = address
+        self.connected_at = now
+        self.last_seen = now
+        # Set once the vehicle has sent anything after the handshake
+        self.heard = False
+        self.last_angle = None
+        self.last_send = None
+        # Splits the messages the vehicle sends back, set by on_connect
+        self.reader = None
+
+
+class _Handshake:
+    __slots__ = ("sock", "address", "deadline")
+
+    def __init__(self, sock, address, deadline):
+        self.sock = sock
+        self.address = address
+        self.deadline = deadline
+
+
+class VehicleRegistry(threading.Thread):
+    """
+    Accepts the vehicles' TCP connections and keeps track of which ones
+    are connected. Every new connection must send its user ID first.
+    All handshakes run at the same time on non-blocking sockets, so a
+    client that connects and stays silent only times out itself instead
+    of delaying every other vehicle.
+
+    A vehicle that connects again with an ID already in use replaces
+    the old connection in one step, and a later failure of the old
+    socket cannot remove the new one. A vehicle that has sent anything
+    since it connected (acknowledgements, hellos) is dropped when it
+    has been silent for heartbeat_timeout.
+
+    The frame loop reads connected() and get() without taking a lock.
+    They read a snapshot that is replaced as a whole whenever a vehicle
+    joins or leaves, and never changes after it was published.
+
+    Parameters:
+        server_socket (socket.socket): Listening TCP socket.
+        handshake_timeout (float): How long a new connection may take to
+            send its ID (seconds).
+        heartbeat_timeout (float, optional): Drop a vehicle that has
+            been silent this long (seconds), None to never drop one.
+        on_connect (callable, optional): Called as on_connect(vehicle,
+            replaced) from the registry thread once a vehicle sent its
+            ID. replaced is the Vehicle it replaces, or None.
+        on_disconnect (callable, optional): Called as
+            on_disconnect(vehicle, reason) when the registry drops a
+            vehicle, not when remove is called.
+        close_sockets (bool): Close the socket of a replaced, removed or
+            dropped vehicle. False if another object, like the
+            CommandSender the sockets are registered with, closes them.
+    """
+
+    def __init__(self, server_socket, handshake_timeout=5.0,
+                 heartbeat_timeout=None, on_connect=None, on_disconnect=None,
+                 close_sockets=True):
+        super().__init__(name="vehicle-registry", daemon=True)
+        self.server_socket = server_socket
+        self.handshake_timeout = handshake_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.close_sockets = close_sockets
+
+        self._lock = threading.Lock()
+        self._vehicles = {}
+        self._ids = frozenset()
+        self._handshakes = {}
+        self._selector = selectors.DefaultSelector()
+        self._stopped = threading.Event()
+        self.stats = {"accepted": 0, "registered": 0, "replaced": 0,
+                      "failed": 0, "timed_out": 0, "expired": 0,
+                      "removed": 0}
+
+    def connected(self):
+        """
+        Returns the IDs of the connected vehicles as a frozenset.
+        """
+        return self._ids
+
+    def get(self, vehicle_id):
+        """
+        Returns the Vehicle with the given ID, or None.
+        """
+        return self._vehicles.get(vehicle_id)
+
+    def __contains__(self, vehicle_id):
+        return vehicle_id in self._ids
+
+    def touch(self, vehicle_id, now=None):
+        """
+        Notes that a vehicle was heard from, e.g. an acknowledgement or
+        hello arrived. Safe to call from any thread.
+        """
+        vehicle = self._vehicles.get(vehicle_id)
+        if vehicle is not None:
+            vehicle.last_seen = time.monotonic() if now is None else now
+            vehicle.heard = True
+
+    def remove(self, vehicle_id, sock=None):
+        """
+        Removes a vehicle (and closes its socket, see close_sockets).
+        With sock given, it is
+        only removed if that is still its socket, so the failure of a
+        replaced connection does not remove the new one.
+
+        Returns:
+            Vehicle: The removed vehicle, or None.
+        """
+        with self._lock:
+            vehicle = self._vehicles.get(vehicle_id)
+            if vehicle is None or (sock is not None and vehicle.sock is not sock):
+                return None
+            self._publish({i: v for i, v in self._vehicles.items()
+                           if i != vehicle_id})
+            self.stats["removed"] += 1
+        if self.close_sockets:
+            vehicle.sock.close()
+        return vehicle
+
+    def stop(self):
+        """
+        Stops accepting, aborts the open handshakes and forgets all
+        vehicles (closing their sockets, see close_sockets).
+        """
+        self._stopped.set()
+        if self.is_alive():
+            self.join(timeout=2.0)
+        for handshake in list(self._handshakes.values()):
+            self._close_handshake(handshake)
+        with self._lock:
+            vehicles = list(self._vehicles.values())
+            self._publish({})
+        if self.close_sockets:
+            for vehicle in vehicles:
+                vehicle.sock.close()
+        self._selector.close()
+
+    def run(self):
+        self.server_socket.setblocking(False)
+        self._selector.register(self.server_socket, selectors.EVENT_READ)
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            timeout = self._expire(now)
+            for key, _ in self._selector.select(min(timeout, 0.2)):
+                if key.fileobj is self.server_socket:
+                    self._accept()
+                else:
+                    self._read_handshake(key.data)
+
+    def _publish(self, vehicles):
+        # Called with the lock held. Readers see either the old or the
+        # new dict, never one being changed.
+        self._vehicles = vehicles
+        self._ids = frozenset(vehicles)
+
+    def _accept(self):
+        deadline = time.monotonic() + self.handshake_timeout
+        while True:
+            try:
+                sock, address = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return  # Listening socket closed
+            self.stats["accepted"] += 1
+            sock.setblocking(False)
+            handshake = _Handshake(sock, address, deadline)
+            self._handshakes[sock] = handshake
+            self._selector.register(sock, selectors.EVENT_READ, handshake)
+
+    def _read_handshake(self, handshake):
+        try:
+            data = handshake.sock.recv(1024)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._fail(handshake, str(e))
+            return
+        if not data:
+            self._fail(handshake, "connection closed")
+            return
+        try:
+            vehicle_id = int(data.decode().strip())
+        except ValueError:
+            self._fail(handshake, f"invalid user ID {data[:20]!r}")
+            return
+        self._selector.unregister(handshake.sock)
+        del self._handshakes[handshake.sock]
+        self._register(vehicle_id, handshake)
+
+    def _register(self, vehicle_id, handshake):
+        sock = handshake.sock
+        # Send small commands right away instead of batching them
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        vehicle = Vehicle(vehicle_id, sock, handshake.address, time.monotonic())
+        with self._lock:
+            replaced = self._vehicles.get(vehicle_id)
+            vehicles = dict(self._vehicles)
+            vehicles[vehicle_id] = vehicle
+            self._publish(vehicles)
+            self.stats["registered"] += 1
+            if replaced is not None:
+                self.stats["replaced"] += 1
+        if self.on_connect is not None:
+            self.on_connect(vehicle, replaced)
+        if replaced is not None and self.close_sockets:
+            replaced.sock.close()
+
+    def _fail(self, handshake, reason, timed_out=False):
+        self.stats["timed_out" if timed_out else "failed"] += 1
+        print(f"Failed to receive user ID from {handshake.address[0]}: {reason}")
+        self._close_handshake(handshake)
+
+    def _close_handshake(self, handshake):
+        self._handshakes.pop(handshake.sock, None)
+        try:
+            self._selector.unregister(handshake.sock)
+        except (KeyError, ValueError):
+            pass
+        handshake.sock.close()
+
+    def _expire(self, now):
+        """
+        Closes handshakes and drops vehicles that took too long. Returns
+        how long the thread may sleep before the next deadline.
+        """
+        wait = 1.0
+        for handshake in list(self._handshakes.values()):
+            if handshake.deadline <= now:
+                self._fail(handshake, "timed out", timed_out=True)
+            else:
+                wait = min(wait, handshake.deadline - now)
+
+        if self.heartbeat_timeout is None:
+            return wait
+        for vehicle in list(self._vehicles.values()):
+            if not vehicle.heard:
+                continue
+            left = vehicle.last_seen + self.heartbeat_timeout - now
+            if left > 0:
+                wait = min(wait, left)
+            elif self.remove(vehicle.vehicle_id, vehicle.sock) is not None:
+                self.stats["expired"] += 1
+                if self.on_disconnect is not None:
+                    self.on_disconnect(vehicle, "no heartbeat")
+        return wait